@@ -0,0 +1 @@
+"""Benchmarks sur données synthétiques : python -m bench.run --help"""
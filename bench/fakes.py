@@ -0,0 +1,114 @@
+"""Substituts en mémoire des objets Discord (serveur, membre, rôle, salon).
+
+Les appels "API" (add_roles, remove_roles, send) attendent une latence
+configurable et lèvent un 429 avec une probabilité donnée.
+"""
+import asyncio
+import itertools
+import random
+
+import discord
+
+
+class FakeAPI:
+    """Latence et injection de 429 partagées par tous les objets simulés"""
+
+    def __init__(self, latency=0.05, jitter=0.02, rate_limit_prob=0.0, retry_after=0.05, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def call(self):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.rng.random() < self.rate_limit_prob:
+            self.rate_limited += 1
+            error = discord.HTTPException(_Response(429), {"message": "You are being rate limited.",
+                                                            "retry_after": self.retry_after})
+            error.retry_after = self.retry_after
+            raise error
+
+
+class _Response:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "Too Many Requests" if status == 429 else "Error"
+
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember:
+    bot = False
+
+    def __init__(self, member_id, api, roles=()):
+        self.id = member_id
+        self.api = api
+        self.roles = list(roles)
+        self.mention = f"<@{member_id}>"
+
+    async def add_roles(self, *roles, reason=None):
+        await self.api.call()
+        for role in roles:
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.api.call()
+        for role in roles:
+            if role in self.roles:
+                self.roles.remove(role)
+
+    def __str__(self):
+        return f"etudiant{self.id}"
+
+
+class FakeChannel:
+    def __init__(self, channel_id, api):
+        self.id = channel_id
+        self.api = api
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        # Les messages ne subissent pas d'injection de 429, seulement la latence
+        await asyncio.sleep(self.api.latency)
+        self.sent += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id, roles, api):
+        self.id = guild_id
+        self.roles = list(roles)
+        self.api = api
+        self.members = {}
+        self._ids = itertools.count(1)
+
+    def add_member(self, roles=()):
+        member = FakeMember(next(self._ids), self.api, roles)
+        self.members[member.id] = member
+        return member
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    async def fetch_members(self, limit=None, after=None):
+        after_id = after.id if after is not None else 0
+        for member_id in sorted(self.members):
+            if member_id > after_id:
+                yield self.members[member_id]
@@ -0,0 +1,311 @@
+"""Benchmarks : parsing du roster, ingestion multi-sources, latence de validation et débit des claims.
+
+    python -m bench.run --rows 1000,10000,100000 --source-rows 10000 --users 300 --output bench_output.json
+
+Les résultats sont écrits en JSON pour comparer deux versions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bench import synthetic  # noqa: E402
+from bench.fakes import FakeAPI, FakeChannel, FakeGuild, FakeRole  # noqa: E402
+
+
+def percentile(values, p):
+    """Percentile par rang le plus proche (values non vide)"""
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# === ROSTER ===
+def bench_roster(roster, rules, rows, workdir, memory=True):
+    """Parsing à froid, construction et chargement du snapshot, pic mémoire"""
+    path = os.path.join(workdir, f"roster_{rows}.xlsx")
+    t = time.perf_counter()
+    synthetic.generate_cms(path, rows, seed=rows)
+    generate_s = time.perf_counter() - t
+
+    ruleset = rules.load_rules(os.path.join(workdir, "rules.json"))
+
+    t = time.perf_counter()
+    data = roster.parse_roster(path, ruleset)
+    parse_s = time.perf_counter() - t
+
+    # tracemalloc ralentit fortement le parsing : mesure séparée
+    parse_peak = 0
+    if memory:
+        tracemalloc.start()
+        roster.parse_roster(path, ruleset)
+        _, parse_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    snapshot = path + ".snapshot"
+    t = time.perf_counter()
+    roster.save_snapshot(snapshot, path, ruleset.fingerprint, data)
+    snapshot_write_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    roster.load_roster_cached(path, snapshot, ruleset)
+    snapshot_load_s = time.perf_counter() - t
+
+    result = {
+        "rows": rows,
+        "eligible": len(data.eligible),
+        "generate_s": generate_s,
+        "parse_s": parse_s,
+        "parse_peak_mb": parse_peak / 2 ** 20,
+        "snapshot_write_s": snapshot_write_s,
+        "snapshot_load_s": snapshot_load_s,
+        "snapshot_mb": os.path.getsize(snapshot) / 2 ** 20,
+    }
+    return result, data, ruleset
+
+
+# === MULTI-SOURCES ===
+def bench_sources(ingest, rows, workdir):
+    """Ingestion CMS + L3 (source de référence) : parsing parallèle, snapshot fusionné, une source modifiée"""
+    cms_path = os.path.join(workdir, f"sources_cms_{rows}.xlsx")
+    l3_path = os.path.join(workdir, f"sources_l3_{rows}.xlsx")
+    synthetic.generate_cms(cms_path, rows, seed=rows)
+    synthetic.generate_l3(l3_path, rows, seed=rows + 1)
+    sources = [
+        ingest.Source(cms_path, rules_file=os.path.join(workdir, "rules.json"), compare={"section": "Sect"}),
+        ingest.Source(l3_path, sheet="L3 ACAD C", header_row=9, rules_file=None,
+                      search_columns=["Nom", "Prénom"], compare={"section": "Section"}),
+    ]
+    merged_snapshot = os.path.join(workdir, f"sources_{rows}.snapshot")
+
+    t = time.perf_counter()
+    merged, _ = ingest.load_sources(sources, merged_snapshot=merged_snapshot)
+    cold_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    ingest.load_sources(sources, merged_snapshot=merged_snapshot)
+    merged_snapshot_s = time.perf_counter() - t
+
+    # Seule la source L3 change : snapshot de la source CMS relu, L3 re-parsée, puis fusion
+    synthetic.generate_l3(l3_path, rows, seed=rows + 2)
+    t = time.perf_counter()
+    ingest.load_sources(sources, merged_snapshot=merged_snapshot)
+    one_stale_s = time.perf_counter() - t
+
+    return {
+        "rows_per_source": rows,
+        "merged_rows": len(merged),
+        "eligible": len(merged.eligible),
+        "conflicts": len(merged.conflicts),
+        "cold_s": cold_s,
+        "merged_snapshot_s": merged_snapshot_s,
+        "one_stale_s": one_stale_s,
+    }
+
+
+# === VALIDATION ===
+async def bench_validation(main, data, ruleset, args):
+    """N utilisateurs simultanés passent par validate_matricule avec des objets Discord simulés"""
+    from role_scheduler import RoleScheduler
+
+    api = FakeAPI(latency=args.latency, rate_limit_prob=args.rate_limit_prob, retry_after=args.retry_after)
+    roles = [FakeRole(i + 1, name) for i, name in enumerate(ruleset.role_names)]
+    guild = FakeGuild(1, roles, api)
+    channel = FakeChannel(1, api)
+
+    import guilds
+    import throttle
+
+    # Serveur simulé configuré avec le roster déjà parsé (pas de chargement paresseux)
+    config = guilds.GuildConfig(guild.id, "bench.xlsx", claims_namespace="bench")
+    main.guild_registry = guilds.GuildRegistry({guild.id: config}, main.claims_registry)
+    state = main.guild_registry.get(guild.id)
+    state.roster = data
+    state.managed_roles = ruleset.role_names
+    state.prefilter = throttle.BloomFilter.from_keys(data.eligible, main.PREFILTER_ERROR_RATE)
+    main.role_scheduler = RoleScheduler(rate=args.role_rate, burst=args.role_burst, workers=args.role_workers,
+                                        base_delay=args.retry_after)
+    main.role_scheduler.start()
+    await main.load_claims()
+
+    # 80 % de matricules valides distincts, 10 % invalides, 10 % déjà pris par un autre
+    eligible = list(data.eligible)
+    inputs = []
+    for i in range(args.users):
+        bucket = i % 10
+        if bucket == 8:
+            inputs.append(f"99{i:010d}")
+        elif bucket == 9 and inputs:
+            inputs.append(inputs[0])
+        else:
+            inputs.append(eligible[i % len(eligible)])
+    members = [guild.add_member() for _ in inputs]
+
+    latencies = []
+
+    async def one(member, text):
+        t = time.perf_counter()
+        await main.validate_matricule(guild, member, text, channel.send, ack=channel.send)
+        latencies.append(time.perf_counter() - t)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(one(m, text) for m, text in zip(members, inputs)))
+    wall = time.perf_counter() - t
+    await main.persistence.aflush()
+    await main.role_scheduler.close()
+
+    return {
+        "users": args.users,
+        "wall_s": wall,
+        "throughput_per_s": args.users / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "api_calls": api.calls,
+        "api_429": api.rate_limited,
+        "messages_sent": channel.sent,
+        "scheduler": dict(main.role_scheduler.stats),
+        "claims": len(state.claims.claims),
+    }
+
+
+# === CLAIMS ===
+async def bench_claims(workdir, count):
+    """Débit du journal des claims : écriture directe vs file write-behind"""
+    from claims import ClaimsStore
+    from persistence import WriteBehindQueue
+
+    direct = ClaimsStore(os.path.join(workdir, "direct.json"))
+    t = time.perf_counter()
+    for i in range(count):
+        direct.claim(f"{i:012d}", i)
+    direct_s = time.perf_counter() - t
+    direct.close()
+
+    store = ClaimsStore(os.path.join(workdir, "queued.json"))
+    writer = WriteBehindQueue(store.write_records, batch_size=100, flush_interval=1.0, name="bench-io")
+    store.writer = writer
+    writer.start()
+    t = time.perf_counter()
+    for i in range(count):
+        store.claim(f"{i:012d}", i)
+    submit_s = time.perf_counter() - t
+    await writer.aflush()
+    flushed_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    await writer.run(store.compact)
+    compact_s = time.perf_counter() - t
+    writer.close()
+    store.close()
+
+    return {
+        "claims": count,
+        "direct_per_s": count / direct_s,
+        "queued_submit_per_s": count / submit_s,
+        "queued_flushed_per_s": count / flushed_s,
+        "batches": writer.batches_written,
+        "compact_s": compact_s,
+    }
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,10000,50000", help="Tailles de roster, séparées par des virgules")
+    parser.add_argument("--source-rows", type=int, default=10000,
+                        help="Lignes par source pour l'ingestion CMS + L3 (0 : désactivé)")
+    parser.add_argument("--users", type=int, default=300, help="Utilisateurs simultanés pour la validation")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latence simulée de l'API Discord (s)")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.02, help="Probabilité d'un 429 par appel")
+    parser.add_argument("--retry-after", type=float, default=0.05, help="retry_after des 429 simulés (s)")
+    parser.add_argument("--role-rate", type=float, default=50.0, help="Débit du token bucket des rôles (/s)")
+    parser.add_argument("--role-burst", type=int, default=50, help="Rafale du token bucket des rôles")
+    parser.add_argument("--role-workers", type=int, default=2, help="Workers du planificateur de rôles")
+    parser.add_argument("--no-memory", action="store_true", help="Ne pas mesurer le pic mémoire (plus rapide)")
+    parser.add_argument("--claims", type=int, default=20000, help="Claims écrits pour le débit du journal")
+    parser.add_argument("--output", default="bench_output.json", help="Fichier de résultats JSON")
+    parser.add_argument("--keep", action="store_true", help="Conserver le dossier de travail")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    workdir = tempfile.mkdtemp(prefix="disbot-bench-")
+    shutil.copy(os.path.join(REPO_DIR, "rules.json"), workdir)
+    cwd = os.getcwd()
+    # main.py crée ses fichiers (log, journal des claims) dans le dossier courant
+    os.chdir(workdir)
+    try:
+        import ingest
+        import main
+        import roster
+        import rules
+        logging.getLogger().setLevel(logging.WARNING)
+
+        results = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "params": vars(args),
+            "roster": [],
+        }
+
+        data = ruleset = None
+        for rows in [int(r) for r in args.rows.split(",") if r.strip()]:
+            result, data, ruleset = bench_roster(roster, rules, rows, workdir, memory=not args.no_memory)
+            results["roster"].append(result)
+            print(f"roster {rows:>7} lignes: parse {result['parse_s']:.2f}s, "
+                  f"snapshot {result['snapshot_load_s'] * 1000:.1f}ms, pic {result['parse_peak_mb']:.0f}Mo")
+
+        if args.source_rows > 0:
+            results["sources"] = bench_sources(ingest, args.source_rows, workdir)
+            s = results["sources"]
+            print(f"sources CMS + L3 ({s['rows_per_source']} lignes chacune): à froid {s['cold_s']:.2f}s, "
+                  f"snapshot fusionné {s['merged_snapshot_s'] * 1000:.1f}ms, "
+                  f"une source modifiée {s['one_stale_s']:.2f}s")
+
+        if data is not None:
+            results["validation"] = asyncio.run(bench_validation(main, data, ruleset, args))
+            v = results["validation"]
+            print(f"validation {v['users']} utilisateurs: p50 {v['p50_ms']:.0f}ms, p99 {v['p99_ms']:.0f}ms, "
+                  f"{v['throughput_per_s']:.0f}/s, {v['api_429']} 429")
+
+        results["claims"] = asyncio.run(bench_claims(workdir, args.claims))
+        c = results["claims"]
+        print(f"claims: direct {c['direct_per_s']:.0f}/s, file {c['queued_submit_per_s']:.0f}/s "
+              f"(écrits {c['queued_flushed_per_s']:.0f}/s)")
+
+        results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        main.persistence.close()
+        main.log_listener.stop()
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Résultats: {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,67 @@
+"""Génération de rosters Excel synthétiques au format de CMS62026.xlsx et l3.xlsx."""
+import random
+from datetime import datetime, timedelta
+
+import openpyxl
+
+CMS_HEADERS = ['Horodateur', 'Adresse e-mail', 'Choix 1', 'Choix 2', 'Choix 3',
+               'Nom et Prénom', 'Matricule', 'Sect', 'Affectation', 'Section Prog. Web']
+L3_HEADERS = ['N°', 'Palier', 'Spécialité', 'Section', 'Matricule', 'Nom', 'Prénom',
+              'Etat', 'Groupe TD', 'Groupe TP']
+PROGRAMS = [
+    "Programmation web  -  Introduction à l'IA",
+    "Sécurité Informatique  -  Administration Clients/Serveurs",
+    "Intelligence Artificielle et Optimisation  -  Extraction de l'information",
+]
+NAMES = ["BOUCENNA", "DJEBARA", "FLICI", "HASSEN", "KECHI", "ABBAS", "BOUBAHA", "DJEFFAL"]
+FIRST_NAMES = ["Khaled", "Rayan", "Yacine", "Amira", "Zakaria", "Imene", "Ramy", "Hamza"]
+
+
+def make_matricule(rng):
+    """Matricule à 12 chiffres avec un préfixe d'année réaliste"""
+    return int(f"{rng.choice([2121, 2222, 2323, 2424])}{rng.randrange(10 ** 8):08d}")
+
+
+def generate_cms(path, rows, seed=0):
+    """Roster au format CMS62026.xlsx (en-têtes en ligne 1) ; retourne la liste des matricules"""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Affectation")
+    ws.append(CMS_HEADERS)
+    start = datetime(2025, 12, 8, 22, 0, 0)
+    matricules = []
+    for i in range(rows):
+        matricule = make_matricule(rng)
+        matricules.append(str(matricule))
+        choices = rng.sample(PROGRAMS, 3)
+        program = rng.choice(PROGRAMS)
+        section = rng.choice(["A", "B"]) if program == PROGRAMS[0] else None
+        name = f"{rng.choice(NAMES)} {rng.choice(FIRST_NAMES)}"
+        ws.append([start + timedelta(seconds=i), f"etudiant{i}@example.com", *choices,
+                   name, float(matricule), rng.choice("ABC"), program, section])
+    wb.save(path)
+    return matricules
+
+
+def generate_l3(path, rows, seed=0):
+    """Roster au format l3.xlsx (8 lignes d'en-tête avant les colonnes)"""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("L3 ACAD C")
+    for line in ("Université des Sciences et de Technologie Houari Boumediene",
+                 "Faculté d'Informatique", "Année Universitaire 2025/2026",
+                 "Liste des étudiants: L3 ACAD C"):
+        ws.append([line])
+    ws.append([])
+    ws.append([None] * 5 + ["Version synthétique"])
+    ws.append([])
+    ws.append([])
+    ws.append(L3_HEADERS)
+    matricules = []
+    for i in range(rows):
+        matricule = str(make_matricule(rng))
+        matricules.append(matricule)
+        ws.append([float(i + 1), "L3", "ACAD", rng.choice("ABC"), matricule, rng.choice(NAMES),
+                   rng.choice(FIRST_NAMES).upper(), "ADM", float(rng.randint(1, 4)), float(rng.randint(1, 4))])
+    wb.save(path)
+    return matricules
@@ -0,0 +1,373 @@
+"""Stockage des matricules attribués : snapshot JSON + journal append-only + historique d'audit."""
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class ClaimIndex:
+    """Index bidirectionnel : matricule -> id Discord, id Discord -> matricules, et date de chaque claim"""
+
+    def __init__(self):
+        self.by_matricule = {}
+        self.by_user = {}
+        self.claimed_at = {}
+
+    def set(self, matricule, user_id, ts=None):
+        """Attribue le matricule (retiré de l'ancien détenteur) ; retourne l'ancien détenteur"""
+        previous = self.by_matricule.get(matricule)
+        if previous is not None and previous != user_id:
+            self._discard(previous, matricule)
+        self.by_matricule[matricule] = user_id
+        self.by_user.setdefault(user_id, set()).add(matricule)
+        if ts is not None or previous != user_id:
+            self.claimed_at[matricule] = ts
+        return previous
+
+    def pop(self, matricule):
+        """Libère le matricule ; retourne son détenteur (None s'il était libre)"""
+        user_id = self.by_matricule.pop(matricule, None)
+        if user_id is not None:
+            self._discard(user_id, matricule)
+            self.claimed_at.pop(matricule, None)
+        return user_id
+
+    def _discard(self, user_id, matricule):
+        matricules = self.by_user.get(user_id)
+        if matricules is not None:
+            matricules.discard(matricule)
+            if not matricules:
+                del self.by_user[user_id]
+
+    def matricules_of(self, user_id):
+        return sorted(self.by_user.get(str(user_id), ()))
+
+    def replace(self, other):
+        """Remplace le contenu sur place : les références à by_matricule restent valides"""
+        self.by_matricule.clear()
+        self.by_matricule.update(other.by_matricule)
+        self.by_user.clear()
+        self.by_user.update(other.by_user)
+        self.claimed_at.clear()
+        self.claimed_at.update(other.claimed_at)
+
+    def __len__(self):
+        return len(self.by_matricule)
+
+
+class ClaimsStore:
+    """Index des claims (matricule <-> id Discord) persisté par journal.
+
+    Chaque claim/unclaim ajoute une ligne au journal (O(1)). compact() réécrit
+    le snapshot de façon atomique et repart d'un journal vide ; load() relit le
+    snapshot puis rejoue le journal. Si un writer (WriteBehindQueue) est fourni,
+    les entrées lui sont confiées et écrites par lots sur son thread.
+
+    Chaque entrée est aussi ajoutée à l'historique d'audit (<snapshot>.audit.jsonl),
+    jamais compacté : date, auteur de l'action et raison.
+    """
+
+    def __init__(self, snapshot_path, journal_path=None, writer=None, audit_path=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or snapshot_path + ".journal"
+        self.audit_path = audit_path or os.path.splitext(snapshot_path)[0] + ".audit.jsonl"
+        self.writer = writer
+        self.index = ClaimIndex()
+        self.claims = self.index.by_matricule  # matricule -> id Discord
+        self.journal_records = 0
+        self._lock = threading.Lock()
+        self._journal = None
+        self._audit = None
+
+    # === CHARGEMENT ===
+    def load(self):
+        """Relit le snapshot puis rejoue le(s) journal(aux)"""
+        with self._lock:
+            self._close_journal()
+            index = ClaimIndex()
+            if os.path.exists(self.snapshot_path):
+                try:
+                    with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                        snapshot = json.load(f)
+                    for matricule, entry in snapshot.items():
+                        # Ancien format : matricule -> id ; nouveau : matricule -> {user_id, claimed_at}
+                        if isinstance(entry, dict):
+                            index.set(matricule, str(entry["user_id"]), entry.get("claimed_at"))
+                        else:
+                            index.set(matricule, str(entry))
+                except Exception as e:
+                    logging.error(f"Erreur lors du chargement des claims: {e}")
+
+            replayed = 0
+            # Un ".old" reste si on a planté pendant une compaction : il passe avant le journal courant
+            for path in (self._old_journal_path, self.journal_path):
+                replayed += self._replay(path, index)
+
+            self.index.replace(index)
+            self.journal_records = replayed
+        if replayed:
+            logging.info(f"Journal des claims rejoué: {replayed} entrée(s)")
+        return self.claims
+
+    @staticmethod
+    def _replay(path, index):
+        if not os.path.exists(path):
+            return 0
+        _drop_torn_tail(path)
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Ligne corrompue (la dernière, si tronquée, a déjà été coupée)
+                    logging.warning(f"Entrée de journal ignorée ({path}:{line_no})")
+                    continue
+                apply_record(index, record)
+                count += 1
+        return count
+
+    # === ÉCRITURE ===
+    def claim(self, matricule, user_id, actor=None, reason=None):
+        """Attribue un matricule (transfert s'il était à un autre membre) ; retourne l'ancien détenteur"""
+        user_id = str(user_id)
+        ts = round(time.time(), 3)
+        previous = self.index.set(matricule, user_id, ts)
+        record = {"op": "claim", "matricule": matricule, "user_id": user_id, "ts": ts}
+        if previous is not None and previous != user_id:
+            record["from"] = previous
+        self._append(_with_audit(record, actor, reason))
+        return previous
+
+    def unclaim(self, matricule, actor=None, reason=None):
+        """Libère un matricule ; retourne son ancien détenteur (None s'il était libre)"""
+        previous = self.index.pop(matricule)
+        if previous is not None:
+            record = {"op": "unclaim", "matricule": matricule, "user_id": previous, "ts": round(time.time(), 3)}
+            self._append(_with_audit(record, actor, reason))
+        return previous
+
+    def matricules_of(self, user_id):
+        """Matricules attribués à un membre"""
+        return self.index.matricules_of(user_id)
+
+    def claimed_at(self, matricule):
+        """Date du claim (timestamp Unix), None si inconnue (claims antérieurs à l'historique)"""
+        return self.index.claimed_at.get(matricule)
+
+    def _append(self, record):
+        if self.writer is not None:
+            self.writer.submit(record)
+        else:
+            self.write_records([record])
+
+    def write_records(self, records):
+        """Écrit un lot d'entrées en une seule écriture (dernière opération par matricule)"""
+        latest = {}
+        for record in records:
+            latest.pop(record["matricule"], None)
+            latest[record["matricule"]] = record
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in latest.values())
+        audit = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with self._lock:
+            try:
+                if self._journal is None:
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+                self._journal.write(data)
+                self._journal.flush()
+                self.journal_records += len(latest)
+            except Exception as e:
+                logging.error(f"Erreur lors de l'écriture du journal des claims: {e}")
+            try:
+                # L'historique garde toutes les entrées, y compris celles remplacées dans le lot
+                if self._audit is None:
+                    self._audit = open(self.audit_path, "a", encoding="utf-8")
+                self._audit.write(audit)
+                self._audit.flush()
+            except Exception as e:
+                logging.error(f"Erreur lors de l'écriture de l'historique des claims: {e}")
+
+    def history(self, matricule=None, user_id=None, limit=10):
+        """Dernières entrées d'audit d'un matricule ou d'un membre (lecture du fichier : thread I/O)"""
+        user_id = str(user_id) if user_id is not None else None
+        entries = collections.deque(maxlen=limit)
+        try:
+            with open(self.audit_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    # Filtre grossier avant de décoder : la plupart des lignes ne concernent pas la cible
+                    if (matricule and matricule not in line) or (user_id and user_id not in line):
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if matricule and record.get("matricule") != matricule:
+                        continue
+                    if user_id and user_id not in (record.get("user_id"), record.get("from"), record.get("by")):
+                        continue
+                    entries.append(record)
+        except FileNotFoundError:
+            pass
+        return list(entries)
+
+    # === COMPACTION ===
+    @property
+    def _old_journal_path(self):
+        return self.journal_path + ".old"
+
+    def compact(self):
+        """Écrit un nouveau snapshot (rename atomique) et vide le journal"""
+        with self._lock:
+            if self.journal_records == 0:
+                return False
+            claims = dict(self.claims)
+            claimed_at = dict(self.index.claimed_at)
+            # On bascule sur un nouveau journal : les claims suivants ne sont pas bloqués
+            self._close_journal()
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self._old_journal_path):
+                    # Compaction précédente échouée : on concatène pour ne rien perdre
+                    with open(self.journal_path, "rb") as src, open(self._old_journal_path, "ab") as dst:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self._old_journal_path)
+            self.journal_records = 0
+
+        snapshot = {matricule: {"user_id": user_id, "claimed_at": claimed_at.get(matricule)}
+                    for matricule, user_id in claims.items()}
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            logging.error(f"Erreur lors de la compaction des claims: {e}")
+            return False
+
+        with self._lock:
+            if os.path.exists(self._old_journal_path):
+                os.remove(self._old_journal_path)
+        logging.info(f"Claims compactés: {len(snapshot)} matricule(s) dans {self.snapshot_path}")
+        return True
+
+    def close(self):
+        """Ferme le journal et l'historique"""
+        with self._lock:
+            self._close_journal()
+            if self._audit is not None:
+                self._audit.close()
+                self._audit = None
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def __len__(self):
+        return len(self.claims)
+
+
+# === COORDINATION DES CLAIMS CONCURRENTS ===
+RESERVED = "reserved"  # Matricule libre, réservé pour cet utilisateur
+OWNED = "owned"  # Matricule déjà attribué (ou réservé) à cet utilisateur
+TAKEN = "taken"  # Matricule attribué (ou réservé) à quelqu'un d'autre
+
+
+class ClaimCoordinator:
+    """Réserve les matricules atomiquement et sérialise le travail par matricule et par utilisateur.
+
+    reserve() ne contient aucun await : deux messages simultanés pour le même
+    matricule ne peuvent pas tous les deux obtenir RESERVED. Les verrous sont
+    répartis sur un nombre fixe de "stripes", donc deux étudiants différents
+    sont traités en parallèle sauf collision de stripe.
+    """
+
+    def __init__(self, store, stripes=64):
+        self.store = store
+        self.pending = {}  # matricule -> id Discord, réservé mais pas encore confirmé
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+
+    def _stripe(self, key):
+        return hash(key) % len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def locked(self, matricule, user_id):
+        """Verrouille le matricule et l'utilisateur (ordre fixe, pas d'interblocage)"""
+        stripes = sorted({self._stripe(("m", matricule)), self._stripe(("u", str(user_id)))})
+        async with contextlib.AsyncExitStack() as stack:
+            for idx in stripes:
+                await stack.enter_async_context(self._locks[idx])
+            yield
+
+    def holder(self, matricule):
+        """Id de l'utilisateur qui détient (ou a réservé) le matricule"""
+        return self.pending.get(matricule) or self.store.claims.get(matricule)
+
+    def reserve(self, matricule, user_id):
+        """Réserve le matricule s'il est libre ; retourne RESERVED, OWNED ou TAKEN"""
+        user_id = str(user_id)
+        holder = self.holder(matricule)
+        if holder is None:
+            self.pending[matricule] = user_id
+            return RESERVED
+        return OWNED if holder == user_id else TAKEN
+
+    def commit(self, matricule, user_id):
+        """Confirme la réservation et persiste le claim"""
+        self.pending.pop(matricule, None)
+        self.store.claim(matricule, user_id)
+
+    def rollback(self, matricule, user_id):
+        """Annule la réservation (ex: échec de l'attribution du rôle)"""
+        if self.pending.get(matricule) == str(user_id):
+            del self.pending[matricule]
+
+
+def _drop_torn_tail(path):
+    """Coupe une dernière ligne sans fin de ligne (écriture interrompue) : la suivante ne s'y collera pas"""
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Recherche du dernier saut de ligne par blocs, depuis la fin
+        pos = size
+        while pos > 0:
+            start = max(0, pos - 4096)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline != -1:
+                pos = start + newline + 1
+                break
+            pos = start
+        logging.warning(f"Entrée de journal tronquée supprimée ({path}: {size - pos} octet(s))")
+        f.truncate(pos)
+
+
+def _with_audit(record, actor, reason):
+    if actor is not None:
+        record["by"] = str(actor)
+    if reason:
+        record["reason"] = reason
+    return record
+
+
+def apply_record(index, record):
+    """Applique une entrée du journal à l'index des claims"""
+    op = record.get("op")
+    if op == "claim":
+        index.set(record["matricule"], record["user_id"], record.get("ts"))
+    elif op == "unclaim":
+        index.pop(record["matricule"])
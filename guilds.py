@@ -0,0 +1,297 @@
+"""Configuration par serveur, roster chargé à la demande et claims par espace de noms.
+
+Exemple de fichier (guilds.json) :
+
+    {
+        "defaults": {"rules_file": "rules.json"},
+        "guilds": {
+            "1451327990628614298": {
+                "excel_file": "CMS62026.xlsx",
+                "channel_id": 1451336152568037456,
+                "claims_namespace": "default"
+            }
+        }
+    }
+
+Au lieu de "excel_file", un serveur peut lister plusieurs "sources" (feuilles
+Excel, CSV, JSON), fusionnées en un seul roster (voir ingest.py) :
+
+    "sources": [
+        {"path": "CMS62026.xlsx", "compare": {"section": "Sect"}},
+        {"path": "l3.xlsx", "header_row": 9, "rules_file": null, "compare": {"section": "Section"}}
+    ]
+
+Plusieurs serveurs peuvent partager un espace de noms de claims (un matricule
+validé sur l'un est alors pris pour les autres). L'espace "default" correspond
+à claimed.json ; les autres à claimed.<espace>.json.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import ingest
+import roster
+from claims import ClaimsStore, ClaimCoordinator
+
+DEFAULT_NAMESPACE = "default"
+
+
+class GuildConfigError(ValueError):
+    """Fichier de configuration des serveurs invalide"""
+
+
+class UnknownGuild(LookupError):
+    """Serveur absent de la configuration"""
+
+
+class GuildConfig:
+    """Sources et réglages d'un serveur"""
+
+    def __init__(self, guild_id, excel_file=None, rules_file="rules.json", channel_id=None,
+                 claims_namespace=None, sources=None):
+        self.guild_id = int(guild_id)
+        self.rules_file = rules_file
+        self.channel_id = int(channel_id) if channel_id else None
+        self.claims_namespace = str(claims_namespace or guild_id)
+        if sources:
+            self.sources = [ingest.Source.from_dict({"rules_file": rules_file, **s} if isinstance(s, dict) else
+                                                    {"path": s, "rules_file": rules_file})
+                            for s in sources]
+        elif excel_file:
+            self.sources = [ingest.Source(excel_file, rules_file=rules_file)]
+        else:
+            raise GuildConfigError(f"Serveur {guild_id}: 'excel_file' ou 'sources' manquant")
+
+    @property
+    def merged_snapshot(self):
+        """Snapshot du roster fusionné (plusieurs sources)"""
+        return f"roster.{self.guild_id}.snapshot"
+
+    def source_signature(self):
+        """Signature (taille, mtime) des fichiers sources et de leurs règles ; None si un fichier manque"""
+        try:
+            return tuple(roster.file_signature(path) for source in self.sources for path in source.watched_files)
+        except OSError:
+            return None
+
+    @property
+    def source_names(self):
+        return ", ".join(source.name for source in self.sources)
+
+    @classmethod
+    def from_dict(cls, guild_id, entry, defaults=None):
+        merged = {**(defaults or {}), **entry}
+        if "sources" in entry:
+            merged.pop("excel_file", None)  # Les sources du serveur remplacent le fichier par défaut
+        unknown = set(merged) - {"excel_file", "rules_file", "channel_id", "claims_namespace", "sources"}
+        if unknown:
+            raise GuildConfigError(f"Serveur {guild_id}: clés inconnues {sorted(unknown)}")
+        try:
+            return cls(guild_id, **merged)
+        except (ingest.SourceError, TypeError) as e:
+            raise GuildConfigError(f"Serveur {guild_id}: {e}") from e
+
+
+def load_guild_configs(path, fallback=None):
+    """Configurations par id de serveur ; `fallback` (GuildConfig) si le fichier n'existe pas"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        if fallback is None:
+            raise GuildConfigError(f"Fichier {path} introuvable")
+        logging.warning(f"{path} introuvable, configuration mono-serveur utilisée")
+        return {fallback.guild_id: fallback}
+    except json.JSONDecodeError as e:
+        raise GuildConfigError(f"JSON invalide dans {path}: {e}") from e
+
+    defaults = data.get("defaults", {})
+    configs = {}
+    for guild_id, entry in data.get("guilds", {}).items():
+        config = GuildConfig.from_dict(guild_id, entry, defaults)
+        configs[config.guild_id] = config
+    if not configs:
+        raise GuildConfigError(f"Aucun serveur configuré dans {path}")
+    return configs
+
+
+# === CLAIMS PAR ESPACE DE NOMS ===
+class _NamespaceWriter:
+    """Adapte la file partagée à un store : chaque entrée est étiquetée avec son store"""
+
+    def __init__(self, registry, store):
+        self.registry = registry
+        self.store = store
+
+    def submit(self, record):
+        self.registry.writer.submit((self.store, record))
+
+
+class ClaimsNamespace:
+    """Store et coordinateur d'un espace de noms de claims"""
+
+    def __init__(self, name, store):
+        self.name = name
+        self.store = store
+        self.coordinator = ClaimCoordinator(store)
+        self.loaded = False
+
+    @property
+    def claims(self):
+        return self.store.claims
+
+
+class ClaimsRegistry:
+    """Espaces de noms de claims, écrits par une seule file write-behind partagée.
+
+    `store_factory(espace, chemin JSON)` crée le store d'un espace (ClaimsStore
+    par défaut ; storage.SqliteClaimsStore pour le backend SQLite).
+    """
+
+    def __init__(self, default_path="claimed.json", writer=None, store_factory=None):
+        self.default_path = default_path
+        self.writer = writer
+        self.store_factory = store_factory
+        self.namespaces = {}
+
+    def path_for(self, name):
+        if name == DEFAULT_NAMESPACE:
+            return self.default_path
+        base, ext = os.path.splitext(self.default_path)
+        return f"{base}.{name}{ext}"
+
+    def get(self, name):
+        namespace = self.namespaces.get(name)
+        if namespace is None:
+            path = self.path_for(name)
+            store = self.store_factory(name, path) if self.store_factory else ClaimsStore(path)
+            store.writer = _NamespaceWriter(self, store)
+            namespace = self.namespaces[name] = ClaimsNamespace(name, store)
+        return namespace
+
+    def write_records(self, batch):
+        """Sink de la file : regroupe les entrées par store, une écriture par journal"""
+        by_store = {}
+        for store, record in batch:
+            by_store.setdefault(store, []).append(record)
+        for store, records in by_store.items():
+            store.write_records(records)
+
+    def load(self, name):
+        """Charge un espace de noms (sur le thread I/O)"""
+        namespace = self.get(name)
+        namespace.store.load()
+        namespace.loaded = True
+        return namespace
+
+    def compact(self):
+        """Compacte tous les journaux (sur le thread I/O)"""
+        for namespace in list(self.namespaces.values()):
+            namespace.store.compact()
+
+    def close(self):
+        for namespace in self.namespaces.values():
+            namespace.store.close()
+
+    def __len__(self):
+        return sum(len(namespace.store) for namespace in self.namespaces.values())
+
+
+# === ÉTAT PAR SERVEUR ===
+class GuildState:
+    """Roster d'un serveur, chargé au premier usage et libéré après inactivité"""
+
+    def __init__(self, config, claims):
+        self.config = config
+        self.claims = claims
+        self.roster = None  # roster.Roster, None tant que non chargé (ou libéré)
+        self.managed_roles = []  # Noms de tous les rôles gérés par les règles
+        self.prefilter = None  # Filtre de Bloom des matricules éligibles, conservé quand le roster est libéré
+        self.signature = None
+        self.load_failed = False
+        self.failed_signature = None
+        self.last_used = time.monotonic()
+        self.reload_lock = asyncio.Lock()
+        self.reconcile_lock = asyncio.Lock()
+
+    @property
+    def guild_id(self):
+        return self.config.guild_id
+
+    @property
+    def eligible(self):
+        """matricule -> rôles accordés (vide si le roster n'est pas chargé)"""
+        return self.roster.eligible if self.roster is not None else {}
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def source_signature(self):
+        """Signature (taille, mtime) des fichiers sources et de leurs règles"""
+        return self.config.source_signature()
+
+    def failed_on(self, signature):
+        """Le dernier chargement a-t-il échoué sur ces mêmes fichiers ?"""
+        return self.load_failed and signature == self.failed_signature
+
+    def record_failure(self, signature):
+        self.load_failed = True
+        self.failed_signature = signature
+
+    def needs_reload(self, signature):
+        """Fichiers modifiés depuis le dernier chargement, et pas déjà en échec dans cet état"""
+        if signature is None or signature == self.signature:
+            return False
+        # Même fichier cassé : inutile de le re-parser à chaque passage, on attend une modification
+        return not self.failed_on(signature)
+
+    def load_roster(self):
+        """Charge le roster indexé (snapshots compilés, sources re-parsées seulement si besoin) ; None si échec"""
+        try:
+            data, role_names = ingest.load_sources(self.config.sources, merged_snapshot=self.config.merged_snapshot)
+            self.managed_roles = role_names
+            logging.info(f"✅ [{self.guild_id}] {len(data.eligible)} matricules valides chargés")
+            return data
+
+        except Exception as e:
+            logging.error(f"❌ [{self.guild_id}] Erreur chargement Excel: {e}")
+            return None
+
+
+class GuildRegistry:
+    """États des serveurs configurés"""
+
+    def __init__(self, configs, claims_registry):
+        self.configs = configs
+        self.states = {
+            guild_id: GuildState(config, claims_registry.get(config.claims_namespace))
+            for guild_id, config in configs.items()
+        }
+
+    def get(self, guild_id):
+        """État du serveur, ou None s'il n'est pas configuré"""
+        return self.states.get(guild_id)
+
+    def resolve(self, guild_id=None):
+        """État du serveur désigné par un id (texte ou entier), facultatif s'il n'y en a qu'un ; UnknownGuild sinon"""
+        if guild_id is None and len(self.states) == 1:
+            return next(iter(self.states.values()))
+        state = self.get(int(guild_id)) if str(guild_id).isdigit() else None
+        if state is None:
+            raise UnknownGuild(guild_id)
+        return state
+
+    def loaded(self):
+        """États dont le roster est en mémoire"""
+        return [state for state in self.states.values() if state.roster is not None]
+
+    def idle(self, max_idle):
+        """États chargés inutilisés depuis plus de max_idle secondes"""
+        limit = time.monotonic() - max_idle
+        return [state for state in self.loaded() if state.last_used < limit]
+
+    @property
+    def namespaces(self):
+        return sorted({config.claims_namespace for config in self.configs.values()})
@@ -0,0 +1,368 @@
+"""Ingestion multi-sources : feuilles Excel, CSV et exports JSON parsés en parallèle puis fusionnés.
+
+Une source est décrite dans guilds.json :
+
+    {"path": "l3.xlsx", "sheet": "L3 ACAD C", "header_row": 9, "rules_file": null,
+     "matricule_column": "Matricule", "search_columns": ["Nom", "Prénom"],
+     "compare": {"section": "Section"}}
+
+- "format" : "xlsx", "csv" ou "json" (déduit de l'extension par défaut)
+- "rules_file" : règles d'éligibilité ; null pour une source de référence qui
+  n'accorde aucun rôle (provenance, recherche et détection de conflits)
+- "compare" : champ commun -> colonne de la source ; deux sources qui donnent
+  des valeurs différentes pour le même matricule produisent un conflit
+
+Chaque source a son propre snapshot ; seules les sources modifiées sont
+re-parsées, chacune dans un processus (durée bornée par le fichier le plus lent
+quand assez de CPU sont disponibles). Le roster fusionné a aussi son snapshot.
+
+Le processus de parsing est lancé par `python ingest.py` (options JSON sur stdin,
+résultat picklé sur stdout) : il n'importe que roster et rules, jamais main.py,
+et ne duplique pas par fork les threads et sockets du bot. Ses avertissements
+sont renvoyés avec le roster et journalisés par le processus principal.
+"""
+import concurrent.futures
+import csv
+import hashlib
+import json
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import traceback
+
+import roster
+import rules
+
+FORMATS = ("xlsx", "csv", "json")
+
+
+class SourceError(ValueError):
+    """Source mal configurée ou illisible"""
+
+
+class Source:
+    """Un fichier (ou une feuille) du roster d'un serveur"""
+
+    OPTIONS = ("path", "format", "sheet", "header_row", "rules_file", "matricule_column",
+               "search_columns", "compare", "name")
+
+    def __init__(self, path, format=None, sheet=None, header_row=1, rules_file="rules.json",
+                 matricule_column="Matricule", search_columns=(), compare=None, name=None):
+        self.path = path
+        self.format = format or os.path.splitext(path)[1].lstrip(".").lower()
+        if self.format not in FORMATS:
+            raise SourceError(f"Format non supporté pour {path}: '{self.format}'")
+        self.sheet = sheet
+        self.header_row = int(header_row)
+        self.rules_file = rules_file
+        self.matricule_column = matricule_column
+        self.search_columns = list(search_columns)
+        self.compare = dict(compare or {})
+        self.name = name or (f"{os.path.basename(path)}:{sheet}" if sheet else os.path.basename(path))
+
+    @classmethod
+    def from_dict(cls, entry):
+        if isinstance(entry, str):
+            return cls(entry)
+        unknown = set(entry) - set(cls.OPTIONS)
+        if unknown:
+            raise SourceError(f"Source {entry.get('path')}: clés inconnues {sorted(unknown)}")
+        if "path" not in entry:
+            raise SourceError(f"Source sans 'path': {entry}")
+        return cls(**entry)
+
+    @property
+    def snapshot_path(self):
+        suffix = f".{self.sheet}" if self.sheet else ""
+        return f"{self.path}{suffix}.snapshot"
+
+    @property
+    def watched_files(self):
+        """Fichiers dont la modification invalide cette source"""
+        return [self.path] + ([self.rules_file] if self.rules_file else [])
+
+    def as_dict(self):
+        return {option: getattr(self, option) for option in self.OPTIONS}
+
+    def load_ruleset(self):
+        if self.rules_file:
+            return rules.load_rules(self.rules_file)
+        return ReferenceRules(self.matricule_column, self.search_columns)
+
+    def fingerprint(self, ruleset):
+        """Empreinte des règles et des options de lecture (clé du snapshot)"""
+        options = {k: v for k, v in self.as_dict().items() if k != "name"}
+        payload = json.dumps([ruleset.fingerprint, options], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReferenceRules:
+    """Règles d'une source de référence : matricule et recherche, aucun rôle"""
+
+    def __init__(self, matricule_column="Matricule", search_columns=()):
+        self.matricule_column = matricule_column
+        self.search_columns = list(search_columns)
+        self.role_names = []
+        self.fingerprint = hashlib.sha256(
+            json.dumps(["reference", matricule_column, self.search_columns], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def compile(self, headers):
+        search_cols = []
+        for name in self.search_columns:
+            try:
+                search_cols.append(rules.resolve_column(headers, name))
+            except rules.RulesError:
+                logging.warning(f"Colonne de recherche ignorée (introuvable): '{name}'")
+        return rules.CompiledRules(rules.resolve_column(headers, self.matricule_column), [], search_cols)
+
+
+# === LECTURE ===
+def read_table(source):
+    """Lignes de la source, en-têtes en premier (les lignes au-dessus de header_row sont ignorées)"""
+    if source.format == "csv":
+        with open(source.path, "r", encoding="utf-8-sig", newline="") as f:
+            for _ in range(source.header_row - 1):
+                f.readline()
+            start = f.tell()
+            # Séparateur détecté à partir des en-têtes (exports Excel FR : ";")
+            sample = "".join(f.readline() for _ in range(20))
+            f.seek(start)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            for row in csv.reader(f, dialect):
+                yield [cell if cell != "" else None for cell in row]
+    elif source.format == "json":
+        with open(source.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and "columns" in data:
+            # {"columns": [...], "rows": [[...], ...]}
+            yield list(data["columns"])
+            yield from data.get("rows", [])
+            return
+        records = data.get("rows", []) if isinstance(data, dict) else data
+        if not isinstance(records, list):
+            raise SourceError(f"{source.path}: liste d'objets attendue")
+        # Liste d'objets : en-têtes = union des clés, dans l'ordre d'apparition
+        headers = list(dict.fromkeys(key for record in records for key in record))
+        yield headers
+        for record in records:
+            yield [record.get(header) for header in headers]
+    else:
+        raise SourceError(f"{source.path}: lecture {source.format} non gérée ici")
+
+
+def parse_source(options):
+    """Parse une source (exécuté dans un processus du pool : arguments et résultat picklables)"""
+    source = Source(**options)
+    ruleset = source.load_ruleset()
+    if source.format == "xlsx":
+        return roster.parse_roster(source.path, ruleset, source.sheet, source.header_row, source.name)
+    return roster.build_roster(read_table(source), ruleset, source.header_row, source.name)
+
+
+class _WarningCollector(logging.Handler):
+    """Avertissements émis pendant un parsing, renvoyés au processus principal"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+def parse_source_collecting(options):
+    """(roster, avertissements, exception) : parse_source sans rien écrire dans les logs"""
+    collector = _WarningCollector()
+    root = logging.getLogger()
+    root.addHandler(collector)
+    try:
+        return parse_source(options), collector.records, None
+    except Exception as e:
+        return None, collector.records, e
+    finally:
+        root.removeHandler(collector)
+
+
+def _parse_in_subprocess(source):
+    """Parse la source dans un processus neuf ; journalise ses avertissements ici"""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__)],
+                          input=json.dumps(source.as_dict()).encode("utf-8"), capture_output=True)
+    if proc.returncode != 0:
+        detail = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+        raise SourceError(f"{source.name}: échec du processus de parsing ({detail[-1] if detail else proc.returncode})")
+    parsed, warnings, error = pickle.loads(proc.stdout)
+    for level, message in warnings:
+        logging.log(level, f"[{source.name}] {message}")
+    if error is not None:
+        raise error
+    return parsed
+
+
+def _worker_main():
+    """Point d'entrée du processus de parsing : options sur stdin, (roster, avertissements, exception) sur stdout"""
+    options = json.load(sys.stdin)
+    result = parse_source_collecting(options)
+    try:
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # Exception non picklable : renvoyée sous forme de message
+        error = result[2]
+        message = traceback.format_exception_only(type(error), error)[-1].strip()
+        payload = pickle.dumps((None, result[1], SourceError(message)), protocol=pickle.HIGHEST_PROTOCOL)
+    sys.stdout.buffer.write(payload)
+    sys.stdout.buffer.flush()
+
+
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def load_sources(sources, max_workers=None, merged_snapshot=None):
+    """Roster fusionné des sources et noms des rôles gérés.
+
+    Le roster fusionné est relu depuis `merged_snapshot` si aucune source n'a
+    changé ; sinon les snapshots à jour des sources sont relus et les sources
+    modifiées parsées en parallèle. Lève une exception si une source échoue : un
+    roster partiel retirerait à tort les rôles des étudiants de la source manquante.
+    """
+    rulesets = [source.load_ruleset() for source in sources]
+    role_names = list(dict.fromkeys(name for ruleset in rulesets for name in ruleset.role_names))
+    merged_key = None
+    if merged_snapshot and len(sources) > 1:
+        merged_key = _merged_key(sources, rulesets)
+        merged = _load_merged(merged_snapshot, merged_key)
+        if merged is not None:
+            logging.info(f"⚡ Snapshot fusionné utilisé: {len(merged)} lignes ({merged_snapshot})")
+            return merged, role_names
+
+    parts = [None] * len(sources)
+    stale = []
+    for i, (source, ruleset) in enumerate(zip(sources, rulesets)):
+        snap = roster.load_snapshot(source.snapshot_path, source.path, source.fingerprint(ruleset))
+        if snap is not None:
+            logging.info(f"⚡ Snapshot utilisé: {source.name} ({len(snap['roster'])} lignes)")
+            parts[i] = snap["roster"]
+        else:
+            stale.append(i)
+
+    workers = min(len(stale), max_workers or _available_cpus())
+    if stale and workers <= 1:
+        # Un seul fichier (ou un seul CPU) : le pool n'apporterait que le coût du transfert
+        for i in stale:
+            logging.info(f"Source {sources[i].name} modifiée (ou snapshot absent), parsing...")
+            parts[i] = parse_source(sources[i].as_dict())
+    elif stale:
+        names = ", ".join(sources[i].name for i in stale)
+        logging.info(f"{len(stale)} sources à parser en parallèle ({workers} processus): {names}")
+        # Les threads ne font qu'attendre les processus de parsing
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {i: executor.submit(_parse_in_subprocess, sources[i]) for i in stale}
+            for i, future in futures.items():
+                parts[i] = future.result()
+
+    for i in stale:
+        roster.save_snapshot(sources[i].snapshot_path, sources[i].path, sources[i].fingerprint(rulesets[i]),
+                             parts[i])
+
+    if len(parts) == 1:
+        return parts[0], role_names
+    merged = merge_rosters(parts, sources)
+    logging.info(f"Roster fusionné: {len(merged)} lignes, {len(merged.eligible)} matricules éligibles, "
+                 f"{len(merged.conflicts)} conflit(s) entre sources")
+    if merged_key is not None:
+        _save_merged(merged_snapshot, merged_key, merged)
+    return merged, role_names
+
+
+def _merged_key(sources, rulesets):
+    """Empreintes des sources et signature (taille, mtime) de leurs fichiers"""
+    parts = [[source.fingerprint(ruleset), roster.file_signature(source.path)]
+             for source, ruleset in zip(sources, rulesets)]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def _load_merged(path, key):
+    try:
+        with open(path, "rb") as f:
+            snap = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Snapshot fusionné illisible ({path}): {e}")
+        return None
+    if not isinstance(snap, dict) or snap.get("version") != roster.SNAPSHOT_VERSION or snap.get("key") != key:
+        return None
+    return snap["roster"]
+
+
+def _save_merged(path, key, merged):
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": roster.SNAPSHOT_VERSION, "key": key, "roster": merged}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Impossible d'écrire le snapshot fusionné ({path}): {e}")
+
+
+# === FUSION ===
+def merge_rosters(parts, sources):
+    """Un seul Roster indexé : colonnes unies par nom, provenance par ligne, conflits entre sources"""
+    column_names = ["Source"]
+    seen = {"Source"}
+    for part in parts:
+        for name in part.column_names:
+            if name not in seen:
+                seen.add(name)
+                column_names.append(name)
+    index = {name: i for i, name in enumerate(column_names)}
+
+    first = parts[0]
+    search_cols = sorted({index[part.column_names[i]] for part in parts for i in part.search_cols})
+    merged = roster.Roster(column_names, index[first.column_names[first.matricule_col]], search_cols)
+
+    for part, source in zip(parts, sources):
+        merged.source_columns[source.name] = ["Source"] + part.column_names
+        merged.extend(part, constants={"Source": source.name})
+
+    merged.conflicts = find_conflicts(parts, sources)
+    return merged
+
+
+def find_conflicts(parts, sources):
+    """[{matricule, champ, valeurs: {source: valeur}}] quand les sources se contredisent"""
+    values = {}  # (matricule, champ) -> {source: valeur brute}
+    for part, source in zip(parts, sources):
+        for field, column in source.compare.items():
+            try:
+                name = part.column_name(column)
+            except KeyError:
+                logging.warning(f"{source.name}: colonne de comparaison introuvable '{column}'")
+                continue
+            column_values = part.columns[name]
+            for pos, matricule in enumerate(part.matricules):
+                value = column_values[pos]
+                if value in (None, ""):
+                    continue
+                values.setdefault((matricule, field), {}).setdefault(source.name, value)
+
+    conflicts = []
+    for (matricule, field), by_source in values.items():
+        if len({rules.normalize_text(v) for v in by_source.values()}) > 1:
+            conflicts.append({"matricule": matricule, "field": field, "values": by_source})
+    conflicts.sort(key=lambda c: (c["matricule"], c["field"]))
+    return conflicts
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -1,18 +1,130 @@
-from flask import Flask
-from threading import Thread
+"""Serveur HTTP de santé et d'administration, sur la boucle asyncio du bot (aiohttp).
+
+Routes :
+- GET  /              : page d'accueil (compatibilité avec l'ancien keep_alive)
+- GET  /healthz       : liveness, la boucle répond et le bot n'est pas fermé
+- GET  /readyz        : readiness, 200 seulement si gateway, roster et claims sont prêts
+- GET  /metrics       : métriques Prometheus
+- POST /api/matricules : {"matricules": [...]} -> état de chaque matricule dans le roster
+- POST /api/claims     : {"user_ids": [...]} -> matricules attribués à chaque membre
+
+Le corps peut préciser "guild_id" (obligatoire si plusieurs serveurs sont configurés).
+
+Les routes /api exigent l'en-tête "Authorization: Bearer <token>" ; sans token
+configuré, elles sont désactivées. Tout est servi depuis la mémoire du bot.
+"""
+import hmac
+import logging
 import time
 
-app = Flask('')
+from aiohttp import web
+
+import guilds
+import metrics
+
+MAX_BATCH = 1000  # Éléments maximum par requête /api
+
+HEALTH_KEY = web.AppKey("health", object)
+LOOKUP_MATRICULES_KEY = web.AppKey("lookup_matricules", object)
+LOOKUP_CLAIMS_KEY = web.AppKey("lookup_claims", object)
+TOKEN_KEY = web.AppKey("token", object)
+
+
+def create_app(health, lookup_matricules, lookup_claims, token=None):
+    """Application aiohttp.
+
+    health() -> (vivant, {composant: prêt}) ; lookup_matricules(liste, guild_id) et
+    lookup_claims(liste, guild_id) sont des coroutines -> dict sérialisable en JSON,
+    qui lèvent guilds.UnknownGuild pour un serveur inconnu.
+    """
+    app = web.Application(client_max_size=1 << 20)
+    app[HEALTH_KEY] = health
+    app[LOOKUP_MATRICULES_KEY] = lookup_matricules
+    app[LOOKUP_CLAIMS_KEY] = lookup_claims
+    app[TOKEN_KEY] = token
+    app.add_routes([
+        web.get("/", home),
+        web.get("/healthz", healthz),
+        web.get("/readyz", readyz),
+        web.get("/metrics", metrics_endpoint),
+        web.post("/api/matricules", api_matricules),
+        web.post("/api/claims", api_claims),
+    ])
+    return app
+
+
+async def start_server(app, host="0.0.0.0", port=8080):
+    """Démarre le serveur sur la boucle courante ; retourne le runner (à nettoyer à l'arrêt)"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info(f"✅ Serveur HTTP démarré sur {host}:{port}")
+    return runner
+
+
+# === SANTÉ ===
+async def home(request):
+    return web.Response(text="🤖 Bot Discord en ligne! | " + time.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+async def healthz(request):
+    alive, _ = request.app[HEALTH_KEY]()
+    return web.json_response({"status": "ok" if alive else "down"}, status=200 if alive else 503)
+
+
+async def readyz(request):
+    alive, components = request.app[HEALTH_KEY]()
+    ready = alive and all(components.values())
+    return web.json_response(
+        {"status": "ready" if ready else "not ready", "checks": components},
+        status=200 if ready else 503
+    )
+
+
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+# === API ADMIN ===
+def _check_token(request):
+    token = request.app[TOKEN_KEY]
+    if not token:
+        raise web.HTTPNotFound()
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+        raise web.HTTPUnauthorized(headers={"WWW-Authenticate": "Bearer"})
+
+
+async def _read_batch(request, field):
+    """(liste `field` du corps JSON validée et bornée, guild_id éventuel)"""
+    _check_token(request)
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="JSON invalide")
+    items = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not all(isinstance(i, (str, int)) for i in items):
+        raise web.HTTPBadRequest(text=f"'{field}' doit être une liste de chaînes")
+    if len(items) > MAX_BATCH:
+        raise web.HTTPRequestEntityTooLarge(max_size=MAX_BATCH, actual_size=len(items))
+    guild_id = body.get("guild_id")
+    return [str(i) for i in items], str(guild_id) if guild_id is not None else None
+
+
+async def _lookup(request, field, key):
+    items, guild_id = await _read_batch(request, field)
+    try:
+        results = await request.app[key](items, guild_id)
+    except guilds.UnknownGuild:
+        # Seul ce cas est un 404 : une autre erreur du lookup reste une erreur serveur
+        raise web.HTTPNotFound(text=f"Serveur inconnu: {guild_id}")
+    return web.json_response({"results": results})
+
 
-@app.route('/')
-def home():
-    return "🤖 Bot Discord en ligne! | " + time.strftime("%Y-%m-%d %H:%M:%S")
+async def api_matricules(request):
+    return await _lookup(request, "matricules", LOOKUP_MATRICULES_KEY)
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
 
-def keep_alive():
-    server = Thread(target=run)
-    server.daemon = True
-    server.start()
-    print("✅ Serveur Flask démarré sur le port 8080")
\ No newline at end of file
+async def api_claims(request):
+    return await _lookup(request, "user_ids", LOOKUP_CLAIMS_KEY)
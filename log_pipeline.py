@@ -0,0 +1,137 @@
+"""Journalisation non bloquante : QueueHandler côté boucle, fichiers tournants et JSON-lines côté listener.
+
+La boucle asyncio ne fait qu'empiler les enregistrements dans une file ; le
+formatage, l'écriture disque, la rotation et la compression gzip des anciens
+fichiers se font dans le thread du QueueListener.
+
+Les champs structurés sont passés par `extra` :
+
+    logging.info("Validation", extra={"event": "validation", "outcome": "accepted",
+                                      "user_id": "123", "durations": {...}})
+
+et ne sont écrits que par le format JSON (une ligne par enregistrement).
+"""
+import copy
+import datetime
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import secrets
+import shutil
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+STRUCTURED_FIELDS = ("event", "outcome", "user_id", "matricule_hash", "durations", "command")
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement : ts, level, msg, puis les champs structurés présents"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                  .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    """Compresse le fichier sorti de rotation (dans le thread du listener)"""
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def rotating_handler(path, max_bytes=10 * 1024 * 1024, backup_count=10, when=None, compress=True):
+    """Handler fichier tournant : par taille, ou par période si `when` est donné ("midnight", "H"...)"""
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding="utf-8", utc=True)
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    if compress:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+class _PassThroughQueueHandler(logging.handlers.QueueHandler):
+    """Résout le message sans le formater : chaque sortie du listener applique son propre format"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # La trace est figée ici : les frames ne restent pas référencées dans la file
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(log_file, *, json_file=None, level=logging.INFO, max_bytes=10 * 1024 * 1024,
+                  backup_count=10, when=None, compress=True, console=True):
+    """Installe le pipeline sur le logger racine et retourne le QueueListener démarré"""
+    log_queue = queue.SimpleQueue()  # Non bornée : put() ne bloque jamais
+    handlers = []
+
+    text_handler = rotating_handler(log_file, max_bytes, backup_count, when, compress)
+    text_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(text_handler)
+
+    if json_file:
+        json_handler = rotating_handler(json_file, max_bytes, backup_count, when, compress)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(stream_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    logging.basicConfig(level=level, handlers=[_PassThroughQueueHandler(log_queue)], force=True)
+    listener.start()
+    return listener
+
+
+def hash_matricule(matricule, salt=""):
+    """Empreinte courte et stable d'un matricule, pour agréger les logs sans l'exposer"""
+    digest = hmac.new(salt.encode("utf-8"), str(matricule).encode("utf-8"), hashlib.sha256)
+    return digest.hexdigest()[:16]
+
+
+def load_or_create_salt(path):
+    """Sel des empreintes, lu dans `path` ou généré puis conservé (les empreintes restent comparables entre redémarrages)"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            salt = f.read().strip()
+        if salt:
+            return salt
+    except FileNotFoundError:
+        pass
+    salt = secrets.token_hex(32)
+    # Créé en 0600 : sans le sel, les empreintes ne se retrouvent pas par dictionnaire
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(salt + "\n")
+    return salt
@@ -1,210 +1,519 @@
 import discord
-from discord.ext import commands
-import openpyxl
+from discord import app_commands
+from discord.ext import commands, tasks
 import logging
 import os
-import json
 import asyncio
+import contextlib
+import json
+import math
+import re
+import shutil
+import signal
+import tempfile
+import time
 from datetime import datetime
 
+import log_pipeline
+import metrics
+import roster
+import reconcile
+import report
+import storage
+import guilds
+import throttle
+from claims import RESERVED, TAKEN
+from persistence import WriteBehindQueue
+from role_scheduler import RoleScheduler, ADD, REMOVE, APPLIED, SUPERSEDED
+import keep_alive
+
 # === CONFIG ===
 TOKEN = os.getenv("DISCORD_TOKEN") or "MTQyMjU4Mzg0ODUzNzE2NTg2NA.G9wBli.kk3hBHRsnzx5q7MkZnwfA-Du42jYMJxoAmFBp0"  # Utiliser une variable d'environnement
 if not TOKEN:
     logging.error("Token Discord non trouvé. Définir la variable DISCORD_TOKEN")
     exit(1)
 
+GUILDS_FILE = "guilds.json"  # Roster, règles, channel et espace de claims de chaque serveur
+# Configuration mono-serveur utilisée si GUILDS_FILE n'existe pas
 GUILD_ID = 1451327990628614298
-ROLE_NAME = "ACAD B"
 EXCEL_FILE = "CMS62026.xlsx"
+RULES_FILE = "rules.json"  # Colonnes, critères d'éligibilité et rôles attribués
 CHANNEL_ID = 1451336152568037456
-CLAIM_FILE = "claimed.json"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None  # None : nombre de shards recommandé par Discord
+ROSTER_IDLE_SECONDS = 1800  # Roster d'un serveur libéré après 30 min sans utilisation
+# Ancien mode : matricule posté dans le channel du serveur (channel_id). Nécessite l'intent message_content ;
+# à False, seule la commande /verify valide (les commandes admin passent par @mention)
+MESSAGE_VALIDATION = True
+CLAIM_FILE = "claimed.json"  # Espace de claims "default" (les autres : claimed.<espace>.json)
+CLAIM_COMPACT_SECONDS = 300  # Compaction périodique du journal des claims
+CLAIM_BATCH_SIZE = 100  # Écriture du journal dès 100 claims en attente...
+CLAIM_FLUSH_SECONDS = 1.0  # ... ou au plus tard après 1 seconde
+RELEASE_CLAIMS_ON_LEAVE = True  # Un membre qui quitte le serveur libère ses matricules
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # "sqlite" : claims, historique et rosters dans SQLITE_FILE
+SQLITE_FILE = "disbot.db"  # Claims JSON importés automatiquement au premier démarrage
+SQLITE_READERS = 2  # Connexions de lecture (requêtes !stats, historique)
+ROLE_RATE = 5.0  # Opérations de rôle par seconde (token bucket)
+ROLE_BURST = 10  # Rafale maximale autorisée
+ROLE_ACK_SECONDS = 2.0  # Au-delà, on prévient l'utilisateur que le rôle est en file d'attente
+ROLE_SHUTDOWN_SECONDS = 10.0  # À l'arrêt, délai laissé aux opérations de rôle en file avant abandon
+THROTTLE_USER_ATTEMPTS = 5  # Tentatives par membre...
+THROTTLE_USER_WINDOW = 60  # ... par fenêtre glissante de 60 s (0 tentative : pas de limite)
+THROTTLE_MATRICULE_ATTEMPTS = 10  # Tentatives par matricule, tous membres confondus...
+THROTTLE_MATRICULE_WINDOW = 300  # ... sur 5 minutes
+REJECTION_CACHE_SECONDS = 60  # Même entrée refusée renvoyée par le même membre : pas de nouvelle réponse
+REJECTION_CACHE_SIZE = 10000
+PREFILTER_ERROR_RATE = 0.01  # Filtre de Bloom des matricules éligibles (None : désactivé)
+RECONCILE_CHECKPOINT = "reconcile.{guild_id}.checkpoint.json"  # Un point de reprise par serveur
+RECONCILE_CHUNK = 1000  # Membres traités par bloc (et par point de reprise)
+RECONCILE_CONCURRENCY = 4  # Opérations de rôle simultanées pour la réconciliation
+RECONCILE_MAX_STRIP_RATIO = 0.2  # Au-delà de 20 % des détenteurs privés de rôles : refus sans "force"
+RECONCILE_CONFIRM_SECONDS = 60  # Délai pour confirmer une réconciliation qui retire des rôles
 LOG_FILE = "bot_activity.log"
+LOG_JSON_FILE = os.getenv("LOG_JSON_FILE")  # Ex. "bot_activity.jsonl" : événements structurés (JSON-lines)
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotation à 10 Mo...
+LOG_ROTATE_WHEN = None  # ... ou par période ("midnight", "H"...) si défini
+LOG_BACKUP_COUNT = 14  # Anciens fichiers conservés (compressés en .gz)
+LOG_HASH_SALT = os.getenv("LOG_HASH_SALT")  # Les matricules ne sont logués qu'en empreinte dans le JSON...
+LOG_SALT_FILE = ".log_salt"  # ... sel généré et conservé ici si la variable n'est pas définie
+HTTP_SERVER = True  # Serveur santé/admin (/healthz, /readyz, /metrics, /api) sur la boucle du bot
+HTTP_HOST = "0.0.0.0"
+HTTP_PORT = int(os.getenv("PORT", "8080"))
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")  # Sans token, l'API /api est désactivée
+READY_MAX_LATENCY = 10.0  # Heartbeat plus lent : le bot n'est plus considéré prêt
+PROFILE_DIR = "."  # Dossier des profils écrits par !profile stop
+ROSTER_POLL_SECONDS = 30  # Intervalle de surveillance du fichier Excel
 
 # === LOGGING AVANCÉ ===
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+# Les handlers fichier/console tournent dans le thread du QueueListener, jamais sur la boucle
+log_listener = log_pipeline.setup_logging(
+    LOG_FILE,
+    json_file=LOG_JSON_FILE,
+    max_bytes=LOG_MAX_BYTES,
+    backup_count=LOG_BACKUP_COUNT,
+    when=LOG_ROTATE_WHEN
 )
+if LOG_JSON_FILE and not LOG_HASH_SALT:
+    # Sans sel, l'empreinte d'un matricule se retrouve en hachant la liste des matricules
+    LOG_HASH_SALT = log_pipeline.load_or_create_salt(LOG_SALT_FILE)
+    logging.info(f"🔑 Sel des empreintes de matricule lu/généré dans {LOG_SALT_FILE}")
 
 # === DISCORD INTENTS ===
 intents = discord.Intents.default()
 intents.members = True
-intents.message_content = True
+intents.message_content = MESSAGE_VALIDATION
 intents.guilds = True
 
-bot = commands.Bot(
-    command_prefix="!",
+bot = commands.AutoShardedBot(
+    command_prefix="!" if MESSAGE_VALIDATION else commands.when_mentioned_or("!"),
     intents=intents,
+    shard_count=SHARD_COUNT,
     help_command=None  # Personnaliser l'aide
 )
 
 # === GLOBALS ===
-matricules = set()
-claimed = {}
-excel_headers = []
-
+repository = storage.Repository(SQLITE_FILE, SQLITE_READERS) if STORAGE_BACKEND == "sqlite" else None
+claims_registry = guilds.ClaimsRegistry(
+    CLAIM_FILE,
+    store_factory=(lambda name, path: storage.SqliteClaimsStore(repository, name, path)) if repository else None
+)
+persistence = WriteBehindQueue(
+    claims_registry.write_records,
+    batch_size=CLAIM_BATCH_SIZE,
+    flush_interval=CLAIM_FLUSH_SECONDS,
+    name="claims-io"
+)
+claims_registry.writer = persistence
+guild_registry = guilds.GuildRegistry(
+    guilds.load_guild_configs(GUILDS_FILE, fallback=guilds.GuildConfig(
+        GUILD_ID, EXCEL_FILE, RULES_FILE, CHANNEL_ID, guilds.DEFAULT_NAMESPACE)),
+    claims_registry
+)
+role_scheduler = RoleScheduler(rate=ROLE_RATE, burst=ROLE_BURST)
+user_limiter = throttle.SlidingWindowLimiter(THROTTLE_USER_ATTEMPTS, THROTTLE_USER_WINDOW)
+matricule_limiter = throttle.SlidingWindowLimiter(THROTTLE_MATRICULE_ATTEMPTS, THROTTLE_MATRICULE_WINDOW)
+rejection_cache = throttle.NegativeCache(REJECTION_CACHE_SECONDS, REJECTION_CACHE_SIZE)
+synced_guilds = set()  # Serveurs où /verify est publié
+connected_shards = set()
+claims_loaded = False
+http_runner = None
+profiler = metrics.SamplingProfiler()
+export_lock = asyncio.Lock()  # Un export !checkall à la fois (thread et fichier temporaire)
+
+# === METRICS ===
+VALIDATIONS = metrics.Counter(
+    "disbot_validations_total", "Tentatives de validation par résultat", ["outcome"])
+VALIDATION_SECONDS = metrics.Histogram(
+    "disbot_validation_seconds", "Durée totale d'une validation", ["outcome"])
+VALIDATION_STAGE_SECONDS = metrics.Histogram(
+    "disbot_validation_stage_seconds", "Durée des étapes de validation", ["stage"])
+ADMIN_COMMAND_SECONDS = metrics.Histogram(
+    "disbot_admin_command_seconds", "Durée des commandes", ["command"])
+ROLE_OPERATIONS = metrics.Counter(
+    "disbot_role_operations_total", "Opérations de rôle par événement (applied, skipped, rate_limited...)",
+    ["event"])
+ROLE_OPERATIONS.set_function(lambda: {(k,): v for k, v in role_scheduler.stats.items()})
+metrics.Gauge("disbot_role_queue_depth", "Opérations de rôle en attente").set_function(
+    lambda: role_scheduler.pending)
+metrics.Gauge("disbot_persistence_queue_depth", "Écritures de claims en attente").set_function(
+    lambda: persistence.pending)
+metrics.Gauge("disbot_gateway_latency_seconds", "Latence du heartbeat Discord").set_function(
+    lambda: bot.latency)
+metrics.Gauge("disbot_roster_matricules", "Matricules éligibles chargés (rosters en mémoire)").set_function(
+    lambda: sum(len(state.eligible) for state in guild_registry.loaded()))
+metrics.Gauge("disbot_rosters_loaded", "Rosters de serveur en mémoire").set_function(
+    lambda: len(guild_registry.loaded()))
+metrics.Gauge("disbot_claims", "Matricules attribués").set_function(lambda: len(claims_registry))
+metrics.Counter("disbot_throttle_total", "Tentatives acceptées ou limitées par fenêtre glissante",
+                ["scope", "result"]).set_function(lambda: {
+    (scope, result): count
+    for scope, limiter in (("user", user_limiter), ("matricule", matricule_limiter))
+    for result, count in limiter.stats.items()
+})
+metrics.Counter("disbot_rejection_cache_total", "Consultations du cache des entrées refusées",
+                ["result"]).set_function(lambda: {(k,): v for k, v in rejection_cache.stats.items()})
+metrics.Gauge("disbot_rejection_cache_entries", "Entrées refusées en cache").set_function(
+    lambda: len(rejection_cache))
+PREFILTER = metrics.Counter(
+    "disbot_prefilter_total", "Décisions du filtre de Bloom (rejected, passed, false_positive)", ["result"])
+metrics.Gauge("disbot_prefilter_bytes", "Taille des filtres de Bloom en mémoire").set_function(
+    lambda: sum(state.prefilter.nbytes for state in guild_registry.states.values() if state.prefilter))
+
+
+class ValidationTrace:
+    """Durées par étape d'une validation : alimente l'histogramme et le log structuré"""
+
+    def __init__(self):
+        self.matricule = None
+        self.durations = {}
+
+    def record(self, stage, seconds):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+        VALIDATION_STAGE_SECONDS.observe(seconds, stage=stage)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def log_fields(self, author, outcome, elapsed):
+        """Champs `extra` du format JSON-lines (durées en ms, matricule en empreinte)"""
+        durations = {stage: round(seconds * 1000, 2) for stage, seconds in self.durations.items()}
+        durations["total"] = round(elapsed * 1000, 2)
+        return {
+            "event": "validation",
+            "outcome": outcome,
+            "user_id": str(author.id),
+            "matricule_hash": matricule_hash(self.matricule) if self.matricule else None,
+            "durations": durations,
+        }
+
+
+def matricule_hash(matricule):
+    """Empreinte salée du matricule : seule trace d'un matricule dans les logs"""
+    return log_pipeline.hash_matricule(matricule, LOG_HASH_SALT or "")
+
+
+# === ROSTERS PAR SERVEUR ===
+async def ensure_roster(state):
+    """Roster du serveur, chargé au premier usage (snapshot : rapide) ; None si indisponible"""
+    state.touch()
+    if state.roster is None:
+        await reload_roster(state, lazy=True)
+    return state.roster
+
+
+def get_roles(guild, names):
+    """Objets rôle correspondant aux noms ; lève KeyError si un rôle n'existe pas"""
+    roles = []
+    for name in names:
+        role = discord.utils.get(guild.roles, name=name)
+        if role is None:
+            raise KeyError(name)
+        roles.append(role)
+    return roles
 
-# === LOAD MATRICULES WITH ERROR HANDLING ===
-def load_matricules():
-    """Version CORRIGÉE avec la bonne colonne de section"""
-    global excel_headers
 
-    try:
-        wb = openpyxl.load_workbook(EXCEL_FILE, data_only=True)
-        sheet = wb.active
+# === LOAD CLAIMED MATRICULES ===
+async def load_claims():
+    """Charge les espaces de claims des serveurs configurés (snapshot + rejeu du journal) sur le thread I/O"""
+    global claims_loaded
 
-        excel_headers = [cell.value for cell in sheet[1]]
-        logging.info(f"En-têtes: {excel_headers}")
+    persistence.start()
+    for name in guild_registry.namespaces:
+        await persistence.run(claims_registry.load, name)
+    claims_loaded = True
 
-        # === TROUVER LES BONNES COLONNES ===
-        col_indices = {}
 
-        # 1. Colonne Matricule (colonne G, index 6)
-        col_indices['matricule'] = 6  # Fixe car on sait que c'est colonne 7 (G)
+@tasks.loop(seconds=CLAIM_COMPACT_SECONDS)
+async def compact_claims():
+    """Compacte périodiquement les journaux dans les snapshots, hors de la boucle"""
+    try:
+        await persistence.run(claims_registry.compact)
+    except Exception as e:
+        logging.error(f"Erreur lors de la compaction des claims: {e}")
+
+
+# === HTTP (SANTÉ / ADMIN) ===
+def health_status():
+    """(vivant, {composant: prêt}) pour /healthz et /readyz"""
+    alive = not bot.is_closed()
+    latency = bot.latency
+    shards = bot.shard_count or 1
+    components = {
+        "gateway": (len(connected_shards) >= shards and bot.is_ready()
+                    and latency == latency and latency < READY_MAX_LATENCY),
+        "rosters": not any(state.load_failed for state in guild_registry.states.values()),
+        "claims": claims_loaded,
+        "role_scheduler": role_scheduler.running,
+    }
+    return alive, components
+
+
+async def api_lookup_matricules(items, guild_id=None):
+    """État de chaque matricule : lignes du roster, rôles accordés, membre qui l'a validé"""
+    state = guild_registry.resolve(guild_id)
+    data = await ensure_roster(state)
+    claimed = state.claims.claims
+    results = {}
+    for item in items:
+        matricule = roster.normalize_matricule(item)
+        rows = []
+        if data is not None:
+            for pos in data.lookup(matricule):
+                rows.append({
+                    "row": data.row_numbers[pos],
+                    "roles": list(data.roles[pos]),
+                    "reason": data.reasons[pos],
+                })
+        results[item] = {
+            "matricule": matricule,
+            "found": bool(rows),
+            "eligible_roles": list(state.eligible.get(matricule, ())),
+            "claimed_by": claimed.get(matricule),
+            "rows": rows,
+        }
+    return results
+
+
+async def api_lookup_claims(user_ids, guild_id=None):
+    """Matricules validés par chaque membre"""
+    state = guild_registry.resolve(guild_id)
+    return {user_id: state.claims.store.matricules_of(user_id) for user_id in user_ids}
+
+
+async def start_http_server():
+    """Serveur santé/admin sur la boucle du bot (plus de thread Flask)"""
+    global http_runner
+
+    if not HTTP_SERVER or http_runner is not None:
+        return
+    app = keep_alive.create_app(health_status, api_lookup_matricules, api_lookup_claims, ADMIN_API_TOKEN)
+    try:
+        http_runner = await keep_alive.start_server(app, HTTP_HOST, HTTP_PORT)
+    except OSError as e:
+        logging.error(f"❌ Serveur HTTP non démarré ({HTTP_HOST}:{HTTP_PORT}): {e}")
 
-        # 2. Colonne Programme (Affectation) - colonne I, index 8
-        col_indices['program'] = 8  # Colonne I
 
-        # 3. Colonne Section IMPORTANTE : "Section Prog. Web" (colonne J, index 9)
-        # Celle-ci contient probablement "B", pas la colonne "Sect"
-        col_indices['section'] = 9  # Colonne J ("Section Prog. Web")
+async def stop_http_server():
+    global http_runner
 
-        logging.info(f"Colonnes utilisées: {col_indices}")
+    if http_runner is not None:
+        await http_runner.cleanup()
+        http_runner = None
 
-        valid_matricules = set()
-        invalid_reasons = []
 
-        for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-            try:
-                # === LIRE LE MATRICULE ===
-                matricule_raw = row[col_indices['matricule']]
-                if matricule_raw is None:
-                    continue
-
-                # Convertir proprement
-                if isinstance(matricule_raw, (int, float)):
-                    # Si c'est un float (212231455913.0), convertir en int puis string
-                    matricule = str(int(matricule_raw))
-                else:
-                    matricule = str(matricule_raw).strip()
-                    # Nettoyer
-                    matricule = ''.join(filter(str.isdigit, matricule))
-
-                if not matricule:
-                    continue
-
-                # === LIRE LE PROGRAMME ===
-                program_raw = row[col_indices['program']]
-                program = str(program_raw or "").strip().lower() if program_raw else ""
-
-                # === LIRE LA SECTION IMPORTANTE ===
-                section_raw = row[col_indices['section']]
-                section = str(section_raw or "").strip().upper() if section_raw else ""
-
-                # === DEBUG pour le matricule problématique ===
-                if matricule == "212231455913":
-                    logging.info(f"DEBUG {matricule}: Program='{program[:50]}...', Section='{section}'")
-
-                # === VÉRIFICATIONS ===
-                is_valid = True
-                reason = ""
-
-                # 1. Vérifier programme
-                if not program:
-                    is_valid = False
-                    reason = "Programme vide"
-                elif not ("programmation web" in program and "introduction à l'ia" in program):
-                    is_valid = False
-                    reason = f"Programme incorrect: {program[:50]}..."
-
-                # 2. Vérifier section (doit être "B")
-                if section != "B":
-                    is_valid = False
-                    reason = f"Section incorrecte: '{section}' (attendu 'B')"
-
-                # 3. Ajouter si valide
-                if is_valid:
-                    valid_matricules.add(matricule)
-                    if matricule == "212231455913":
-                        logging.info(f"✓ MATRICULE ACCEPTÉ: {matricule}")
-                else:
-                    if matricule == "212231455913":
-                        logging.warning(f"✗ MATRICULE REJETÉ: {matricule} - {reason}")
-                    invalid_reasons.append(f"{matricule}: {reason}")
+# === EVENTS ===
+@bot.event
+async def setup_hook():
+    """Avant la connexion au gateway : le serveur HTTP répond (non prêt) pendant le démarrage"""
+    await start_http_server()
+    # Claims chargés avant le premier message : une validation ne peut pas voir un état vide.
+    # Une seule fois (on_ready est aussi appelé à chaque reconnexion) ; les rosters sont
+    # chargés au premier usage de chaque serveur
+    await load_claims()
 
-            except Exception as e:
-                logging.warning(f"Erreur ligne {row_idx}: {e}")
-                continue
 
-        logging.info(f"✅ {len(valid_matricules)} matricules valides chargés")
+@bot.event
+async def on_shard_connect(shard_id):
+    connected_shards.add(shard_id)
 
-        # Afficher quelques raisons de rejet
-        if invalid_reasons:
-            logging.info(f"Exemples de rejets: {invalid_reasons[:5]}")
 
-        return valid_matricules
+@bot.event
+async def on_shard_resumed(shard_id):
+    connected_shards.add(shard_id)
 
-    except Exception as e:
-        logging.error(f"❌ Erreur chargement Excel: {e}")
-        return set()
 
-    except Exception as e:
-        logging.error(f"❌ Erreur chargement Excel: {e}")
-        return set()
+@bot.event
+async def on_shard_disconnect(shard_id):
+    connected_shards.discard(shard_id)
+    logging.warning(f"⚠️ Shard {shard_id} déconnecté du gateway Discord")
 
 
-# === LOAD CLAIMED MATRICULES ===
-def load_claims():
-    """Charge les matricules déjà attribués"""
-    if os.path.exists(CLAIM_FILE):
-        try:
-            with open(CLAIM_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"Erreur lors du chargement des claims: {e}")
-            return {}
-    return {}
+@bot.event
+async def on_ready():
+    """Événement déclenché quand le bot est prêt"""
+    logging.info(f"Bot connecté: {bot.user.name} (ID: {bot.user.id}), {bot.shard_count} shard(s)")
+    logging.info(f"Servers: {len(bot.guilds)}, configurés: {len(guild_registry.states)}")
 
+    for guild in bot.guilds:
+        if guild_registry.get(guild.id) is None:
+            logging.warning(f"Serveur non configuré dans {GUILDS_FILE}: {guild.name} ({guild.id})")
 
-def save_claims():
-    """Sauvegarde les matricules attribués"""
-    try:
-        with open(CLAIM_FILE, "w", encoding="utf-8") as f:
-            json.dump(claimed, f, indent=4)
-    except Exception as e:
-        logging.error(f"Erreur lors de la sauvegarde des claims: {e}")
+    await sync_app_commands()
 
+    if not watch_roster.is_running():
+        watch_roster.start()
+    if not compact_claims.is_running():
+        compact_claims.start()
+    if not evict_rosters.is_running():
+        evict_rosters.start()
+    role_scheduler.start()
 
-# === EVENTS ===
-@bot.event
-async def on_ready():
-    """Événement déclenché quand le bot est prêt"""
-    global matricules, claimed
+    await update_presence()
 
-    logging.info(f"Bot connecté: {bot.user.name} (ID: {bot.user.id})")
-    logging.info(f"Servers: {len(bot.guilds)}")
 
-    # Charger les données
-    matricules = load_matricules()
-    claimed = load_claims()
+async def sync_app_commands():
+    """Publie /verify sur les serveurs configurés (synchro par serveur : disponible immédiatement)"""
+    for guild_id in guild_registry.states:
+        if guild_id in synced_guilds or bot.get_guild(guild_id) is None:
+            continue
+        guild = discord.Object(id=guild_id)
+        bot.tree.copy_global_to(guild=guild)
+        try:
+            synced = await bot.tree.sync(guild=guild)
+            synced_guilds.add(guild_id)
+            logging.info(f"[{guild_id}] Commandes slash synchronisées: {[c.name for c in synced]}")
+        except discord.HTTPException as e:
+            logging.error(f"[{guild_id}] Échec de la synchronisation des commandes slash: {e}")
 
-    # Vérifier la présence des fichiers nécessaires
-    if not matricules:
-        logging.warning("Aucun matricule chargé. Vérifiez le fichier Excel.")
 
-    # Changer le statut du bot
+async def update_presence():
+    """Affiche le nombre de serveurs servis dans le statut du bot"""
     await bot.change_presence(
         activity=discord.Activity(
             type=discord.ActivityType.watching,
-            name=f"{len(matricules)} matricules"
+            name=f"{len(guild_registry.states)} serveur(s)"
         )
     )
 
 
+# === HOT RELOAD DU ROSTER ===
+async def reload_roster(state, lazy=False):
+    """Recharge le roster d'un serveur hors de la boucle, remplace l'index et retire les rôles perdus.
+
+    Retourne (ajoutés, retirés, rôles retirés) ou None si le chargement a échoué. En mode
+    lazy (premier usage), ne fait rien si un appel concurrent a déjà chargé le roster, ni
+    si le dernier échec portait sur les mêmes fichiers.
+    """
+    async with state.reload_lock:
+        signature = state.source_signature()
+        if lazy and (state.roster is not None or state.failed_on(signature)):
+            return None
+        new_roster = await asyncio.to_thread(state.load_roster)
+        if new_roster is None or not new_roster.eligible:
+            state.record_failure(signature)
+            logging.warning(f"[{state.guild_id}] Reload ignoré: aucun matricule chargé, l'ancien roster est conservé")
+            return None
+        old_matricules = state.eligible
+        new_matricules = new_roster.eligible
+        if state.roster is None and state.signature is not None and signature != state.signature:
+            # Rôles perdus pendant que le roster était libéré : non calculables, !reconcile les corrige
+            logging.warning(f"[{state.guild_id}] Roster modifié pendant qu'il était libéré, "
+                            f"lancer !reconcile pour retirer les rôles perdus")
+
+        added = new_matricules.keys() - old_matricules.keys()
+        removed = old_matricules.keys() - new_matricules.keys()
+        # Rôles perdus par matricule (matricule retiré ou critères modifiés)
+        lost = {}
+        for matricule, roles in old_matricules.items():
+            dropped = set(roles) - set(new_matricules.get(matricule, ()))
+            if dropped:
+                lost[matricule] = dropped
+
+        prefilter = None
+        if PREFILTER_ERROR_RATE:
+            prefilter = await asyncio.to_thread(throttle.BloomFilter.from_keys, new_matricules, PREFILTER_ERROR_RATE)
+
+        # Remplacement atomique : on_message voit l'ancien ou le nouvel index, jamais un mélange
+        state.roster = new_roster
+        state.prefilter = prefilter
+        state.signature = signature
+        state.load_failed = False
+        if added:
+            rejection_cache.clear()  # Un matricule refusé vient peut-être d'être ajouté
+
+        if repository is not None:
+            await mirror_roster(state, new_roster, signature)
+
+        roles_removed = await revoke_roles(state, lost)
+        if old_matricules and (added or removed):
+            logging.info(f"🔄 [{state.guild_id}] Roster rechargé: +{len(added)} / -{len(removed)} matricules, "
+                         f"{roles_removed} rôle(s) retiré(s)")
+        return added, removed, roles_removed
+
+
+async def mirror_roster(state, data, signature):
+    """Copie le roster dans SQLite (requêtes !stats) s'il a changé depuis la dernière copie"""
+    try:
+        rows = await asyncio.to_thread(repository.sync_roster, state.guild_id, data, json.dumps(signature))
+    except Exception as e:
+        logging.error(f"❌ [{state.guild_id}] Copie du roster dans SQLite impossible: {e}")
+        return
+    if rows is not None:
+        logging.info(f"📦 [{state.guild_id}] Roster copié dans SQLite: {rows} lignes")
+
+
+async def revoke_roles(state, lost):
+    """Retire aux membres concernés les rôles que leur matricule n'accorde plus"""
+    guild = bot.get_guild(state.guild_id)
+    if not lost or not guild:
+        return 0
+
+    claimed = state.claims.claims
+    operations = []
+    for matricule, role_names in lost.items():
+        claimant_id = claimed.get(matricule)
+        if not claimant_id:
+            continue
+        member = guild.get_member(int(claimant_id))
+        if member is None:
+            continue
+        for name in role_names:
+            role = discord.utils.get(guild.roles, name=name)
+            if role is None or role not in member.roles:
+                continue
+            operations.append(role_scheduler.submit(member, role, REMOVE,
+                                                    reason=f"Matricule {matricule} retiré du roster"))
+
+    results = await asyncio.gather(*operations, return_exceptions=True)
+    return sum(1 for r in results if r == APPLIED)
+
+
+@tasks.loop(seconds=ROSTER_POLL_SECONDS)
+async def watch_roster():
+    """Surveille les fichiers des rosters en mémoire et les recharge quand ils changent"""
+    for state in guild_registry.loaded():
+        signature = state.source_signature()
+        if not state.needs_reload(signature):
+            continue
+        logging.info(f"[{state.guild_id}] Sources ({state.config.source_names}) ou règles modifiées, "
+                     f"rechargement du roster...")
+        await reload_roster(state)
+
+
+@tasks.loop(seconds=60)
+async def evict_rosters():
+    """Libère les rosters des serveurs inactifs : la mémoire suit les serveurs actifs"""
+    for state in guild_registry.idle(ROSTER_IDLE_SECONDS):
+        if state.reload_lock.locked() or state.reconcile_lock.locked():
+            continue
+        state.roster = None
+        logging.info(f"💤 [{state.guild_id}] Roster libéré (inactif depuis {ROSTER_IDLE_SECONDS}s)")
+
+
 @bot.event
 async def on_command_error(ctx, error):
     """Gestion des erreurs de commandes"""
@@ -212,6 +521,8 @@ async def on_command_error(ctx, error):
         await ctx.send("❌ Vous n'avez pas la permission d'utiliser cette commande.")
     elif isinstance(error, commands.MissingRequiredArgument):
         await ctx.send(f"❌ Argument manquant. Usage: `{ctx.prefix}{ctx.command.name} {ctx.command.signature}`")
+    elif isinstance(error, commands.BadArgument):
+        await ctx.send(f"❌ Argument invalide: {error}")
     else:
         logging.error(f"Erreur de commande: {error}")
         await ctx.send("❌ Une erreur est survenue.")
@@ -220,300 +531,967 @@ async def on_command_error(ctx, error):
 # === MAIN VALIDATION LOGIC ===
 @bot.event
 async def on_message(message):
-    """Validation des matricules envoyés dans le channel dédié"""
+    """Validation des matricules envoyés dans le channel dédié (mode message, optionnel)"""
     if message.author.bot:
         return
 
     # Vérifier si c'est le bon channel
-    if message.channel.id != CHANNEL_ID:
+    state = guild_registry.get(message.guild.id) if message.guild else None
+    if not MESSAGE_VALIDATION or state is None or message.channel.id != state.config.channel_id:
         await bot.process_commands(message)
         return
 
-    user_input = message.content.strip().upper()
+    channel = message.channel
+    await validate_matricule(message.guild, message.author, message.content, channel.send, ack=channel.send,
+                             quiet=True)
 
-    # Nettoyer l'input
-    matricule = ''.join(c for c in user_input if c.isalnum())
+    await bot.process_commands(message)
 
-    if not matricule:
-        await message.channel.send(f"{message.author.mention}, veuillez entrer un matricule valide.")
-        return
 
-    logging.info(f"Validation tentative: {message.author} -> '{matricule}'")
+async def validate_matricule(guild, author, user_input, send, ack=None, quiet=False):
+    """Cœur de la validation, partagé par on_message et /verify.
 
+    send(texte) envoie la réponse finale ; ack(texte), si fourni, prévient
+    l'utilisateur quand l'attribution du rôle attend dans la file. En mode quiet
+    (channel public), une entrée déjà refusée ou une tentative limitée ne reçoit
+    pas de nouvelle réponse : une seule par fenêtre.
+    """
+    start = time.perf_counter()
+    trace = ValidationTrace()
+    outcome = "error"
     try:
-        # Récupérer le rôle
-        guild = message.guild
-        role = discord.utils.get(guild.roles, name=ROLE_NAME)
+        outcome = await _validate_matricule(guild, author, user_input, send, ack, trace, quiet)
+    finally:
+        elapsed = time.perf_counter() - start
+        VALIDATION_SECONDS.observe(elapsed, outcome=outcome)
+        VALIDATIONS.inc(outcome=outcome)
+        logging.info(
+            f"Validation {outcome}: {author} ({elapsed * 1000:.0f} ms)",
+            extra=trace.log_fields(author, outcome, elapsed)
+        )
 
-        if not role:
-            logging.error(f"Rôle '{ROLE_NAME}' introuvable")
-            await message.channel.send("❌ Erreur: rôle non configuré.")
-            return
 
-        if matricule in matricules:
-            # Vérifier si déjà attribué
-            if matricule in claimed:
-                claimant_id = claimed[matricule]
-
-                if claimant_id == str(message.author.id):
-                    # Même utilisateur
-                    if role not in message.author.roles:
-                        await message.author.add_roles(role)
-                        await message.channel.send(
-                            f"{message.author.mention}, matricule déjà validé ✅. Rôle {ROLE_NAME} ajouté."
-                        )
-                    else:
-                        await message.channel.send(
-                            f"{message.author.mention}, tu as déjà validé ton matricule ✅."
-                        )
-                else:
-                    # Tentative de fraude
-                    logging.warning(f"Tentative de fraude: {message.author} tente d'utiliser le matricule {matricule}")
-                    await message.channel.send(
-                        f"{message.author.mention}, ce matricule est déjà utilisé par un autre membre ❌.\n"
-                        f"Contactez un administrateur si c'est une erreur."
-                    )
-                    return
+async def _validate_matricule(guild, author, user_input, send, ack, trace, quiet=False):
+    """Retourne le résultat de la tentative (label de métrique)"""
+    state = guild_registry.get(guild.id)
+    if state is None:
+        await send("❌ Ce serveur n'est pas configuré pour la validation.")
+        return "unconfigured"
+    if not claims_loaded:
+        # Sans les claims, un matricule déjà réclamé paraîtrait libre
+        await send(f"{author.mention}, ⏳ bot en cours de démarrage, réessayez dans quelques secondes.")
+        return "starting"
+    with trace.stage("normalize"):
+        user_input = user_input.strip().upper()
+
+        # Nettoyer l'input
+        matricule = ''.join(c for c in user_input if c.isalnum())
+        trace.matricule = matricule
+
+    with trace.stage("throttle"):
+        blocked = throttle_attempt(state, author, matricule)
+    if blocked is not None:
+        outcome, reply, first = blocked
+        if first or not quiet:
+            with trace.stage("reply"):
+                await send(reply)
+        return outcome
 
+    if not matricule:
+        rejection_cache.add((state.guild_id, author.id, matricule))
+        with trace.stage("reply"):
+            await send(f"{author.mention}, veuillez entrer un matricule valide.")
+        return "empty"
+
+    logging.info(f"Validation tentative: {author}",
+                 extra={"event": "validation_attempt", "user_id": str(author.id),
+                        "matricule_hash": matricule_hash(matricule)})
+
+    prefiltered = False
+    if state.prefilter is not None:
+        with trace.stage("prefilter"):
+            prefiltered = prefilter_usable(state) and not holds_managed_role(state, author)
+            if prefiltered and matricule not in state.prefilter:
+                # Absent du filtre : refus certain, sans charger le roster ni prendre de verrou
+                PREFILTER.inc(result="rejected")
+                rejection_cache.add((state.guild_id, author.id, matricule))
+                reply = (f"{author.mention}, matricule non reconnu ❌.\n"
+                         f"Vérifiez votre matricule ou contactez un enseignant.")
             else:
-                # Nouvelle validation
-                claimed[matricule] = str(message.author.id)
-                save_claims()
+                reply = None
+        if reply is not None:
+            with trace.stage("reply"):
+                await send(reply)
+            return "rejected"
+        if prefiltered:
+            PREFILTER.inc(result="passed")
 
-                await message.author.add_roles(role)
-                await message.channel.send(
-                    f"{message.author.mention}, matricule valide ✅ ! Rôle {ROLE_NAME} attribué."
-                )
-                logging.info(f"Matricule {matricule} attribué à {message.author}")
+    try:
+        with trace.stage("roster"):
+            data = await ensure_roster(state)
+        if data is None:
+            await send("❌ Liste des matricules indisponible, réessayez plus tard.")
+            return "unavailable"
+        matricules = data.eligible
+        claim_coordinator = state.claims.coordinator
+
+        # Récupérer les rôles gérés par les règles
+        try:
+            all_roles = get_roles(guild, state.managed_roles)
+        except KeyError as e:
+            logging.error(f"Rôle '{e.args[0]}' introuvable")
+            await send("❌ Erreur: rôle non configuré.")
+            return "misconfigured"
+
+        status = None
+        operation = None
+
+        # Verrou par matricule et par utilisateur : seule la décision est sérialisée,
+        # l'appel API passe par le planificateur de rôles
+        lock_start = time.perf_counter()
+        async with claim_coordinator.locked(matricule, author.id):
+            lookup_start = time.perf_counter()
+            trace.record("lock", lookup_start - lock_start)
+
+            if matricule in matricules:
+                roles = [r for r in all_roles if r.name in matricules[matricule]]
+                role_names = ", ".join(r.name for r in roles)
+                status = claim_coordinator.reserve(matricule, author.id)
+
+                missing = [r for r in roles if r not in author.roles]
+                if status == TAKEN:
+                    # Tentative de fraude
+                    logging.warning(f"Tentative de fraude: {author} tente d'utiliser un matricule déjà réclamé",
+                                    extra={"event": "fraud", "user_id": str(author.id),
+                                           "matricule_hash": matricule_hash(matricule)})
+                    outcome = "fraud"
+                    missing = []
+                    reply = (f"{author.mention}, ce matricule est déjà utilisé par un autre membre ❌.\n"
+                             f"Contactez un administrateur si c'est une erreur.")
+                elif status == RESERVED:
+                    # Nouvelle validation : confirmée seulement quand les rôles sont réellement donnés
+                    outcome = "accepted"
+                    reply = f"{author.mention}, matricule valide ✅ ! Rôle {role_names} attribué."
+                elif missing:
+                    # Même utilisateur, rôle perdu
+                    outcome = "restored"
+                    reply = f"{author.mention}, matricule déjà validé ✅. Rôle {role_names} ajouté."
+                else:
+                    outcome = "already"
+                    reply = f"{author.mention}, tu as déjà validé ton matricule ✅."
+                if missing:
+                    operation = asyncio.gather(*(
+                        role_scheduler.submit(author, r, ADD, reason=f"Matricule {matricule}") for r in missing
+                    ))
 
-        else:
-            # Matricule invalide
-            if role in message.author.roles:
-                await message.author.remove_roles(role)
-                await message.channel.send(
-                    f"{message.author.mention}, matricule invalide ❌. Rôle {ROLE_NAME} retiré."
-                )
-                logging.info(f"Rôle retiré pour {message.author} (matricule invalide)")
             else:
-                await message.channel.send(
-                    f"{message.author.mention}, matricule non reconnu ❌.\n"
-                    f"Vérifiez votre matricule ou contactez un enseignant."
-                )
+                # Matricule invalide
+                outcome = "rejected"
+                rejection_cache.add((state.guild_id, author.id, matricule))
+                if prefiltered:
+                    PREFILTER.inc(result="false_positive")
+                held = [r for r in all_roles if r in author.roles]
+                if held:
+                    reply = (f"{author.mention}, matricule invalide ❌. "
+                             f"Rôle {', '.join(r.name for r in held)} retiré.")
+                    operation = asyncio.gather(*(
+                        role_scheduler.submit(author, r, REMOVE, reason="Matricule invalide") for r in held
+                    ))
+                else:
+                    reply = (f"{author.mention}, matricule non reconnu ❌.\n"
+                             f"Vérifiez votre matricule ou contactez un enseignant.")
+
+            trace.record("lookup", time.perf_counter() - lookup_start)
+
+        if status == RESERVED and operation is None:
+            # Rôles déjà présents (ajoutés à la main) : on confirme directement le claim
+            with trace.stage("persist"):
+                claim_coordinator.commit(matricule, author.id)
+            logging.info(f"Matricule attribué à {author}",
+                         extra={"event": "claim", "user_id": str(author.id),
+                                "matricule_hash": matricule_hash(matricule)})
+
+        if operation is not None:
+            try:
+                with trace.stage("roles"):
+                    results = await wait_role_operation(operation, author, ack)
+            except BaseException:
+                if status == RESERVED:
+                    claim_coordinator.rollback(matricule, author.id)
+                raise
+            if SUPERSEDED in results:
+                # Une demande inverse plus récente a remplacé celle-ci : rien n'a été appliqué
+                if status == RESERVED:
+                    claim_coordinator.rollback(matricule, author.id)
+                logging.info(f"Opération de rôle remplacée pour {author} avant application")
+                outcome = "superseded"
+                reply = (f"{author.mention}, ta demande a été remplacée par une demande plus récente ⚠️.\n"
+                         f"Réessaie si besoin.")
+            elif status == RESERVED:
+                with trace.stage("persist"):
+                    claim_coordinator.commit(matricule, author.id)
+                logging.info(f"Matricule attribué à {author}",
+                             extra={"event": "claim", "user_id": str(author.id),
+                                    "matricule_hash": matricule_hash(matricule)})
+            elif status is None:
+                logging.info(f"Rôle retiré pour {author} (matricule invalide)")
+
+        with trace.stage("reply"):
+            await send(reply)
+        return outcome
 
     except discord.Forbidden:
         logging.error("Permissions insuffisantes pour gérer les rôles")
-        await message.channel.send("❌ Erreur de permissions. Vérifiez les droits du bot.")
+        await send("❌ Erreur de permissions. Vérifiez les droits du bot.")
+        return "forbidden"
     except Exception as e:
         logging.error(f"Erreur lors de la validation: {e}")
-        await message.channel.send("❌ Une erreur est survenue lors de la validation.")
+        await send("❌ Une erreur est survenue lors de la validation.")
+        return "error"
+
+
+def throttle_attempt(state, author, matricule):
+    """None si la tentative peut être traitée, sinon (résultat, réponse, première fois dans la fenêtre)"""
+    if (state.guild_id, author.id, matricule) in rejection_cache:
+        if not matricule:
+            return "duplicate", f"{author.mention}, veuillez entrer un matricule valide.", False
+        return ("duplicate", f"{author.mention}, matricule non reconnu ❌ (déjà vérifié, "
+                             f"réessayez dans {REJECTION_CACHE_SECONDS}s).", False)
+
+    wait = user_limiter.hit((state.guild_id, author.id))
+    if not wait and matricule:
+        wait = matricule_limiter.hit((state.guild_id, matricule))
+    if not wait:
+        return None
+
+    # Un seul avertissement par fenêtre : les tentatives suivantes sont ignorées en silence
+    notice = ("throttled", state.guild_id, author.id)
+    first = notice not in rejection_cache
+    if first:
+        rejection_cache.add(notice, ttl=wait)
+        logging.warning(f"Tentatives limitées: {author}, réessai dans {wait:.0f}s",
+                        extra={"event": "throttled", "user_id": str(author.id),
+                               "matricule_hash": matricule_hash(matricule) if matricule else None})
+    return "throttled", f"{author.mention}, trop de tentatives ⏳. Réessayez dans {math.ceil(wait)}s.", first
+
+
+def prefilter_usable(state):
+    """Le filtre reflète les sources actuelles (roster en mémoire, ou fichiers inchangés depuis sa libération)"""
+    return state.roster is not None or state.source_signature() == state.signature
+
+
+def holds_managed_role(state, member):
+    """Un membre qui a un rôle géré passe par la validation complète (le refus lui retire ce rôle)"""
+    managed = set(state.managed_roles)
+    return any(role.name in managed for role in getattr(member, "roles", ()))
+
+
+async def wait_role_operation(operation, member, ack=None):
+    """Attend l'application du rôle ; si la file est longue, prévient l'utilisateur avant la réponse finale"""
+    if ack is None:
+        return await operation
+    try:
+        return await asyncio.wait_for(asyncio.shield(operation), ROLE_ACK_SECONDS)
+    except asyncio.TimeoutError:
+        await ack(f"{member.mention}, ⏳ demande reçue, attribution du rôle en cours...")
+        return await operation
+
+
+# === SLASH COMMAND /verify ===
+def interaction_sender(interaction):
+    """Réponse éphémère via le followup d'une interaction différée"""
+    async def send(text):
+        await interaction.followup.send(text, ephemeral=True)
+    return send
+
+
+class VerifyModal(discord.ui.Modal, title="Vérification du matricule"):
+    matricule = discord.ui.TextInput(
+        label="Matricule",
+        placeholder="ex: 212231455913",
+        min_length=1,
+        max_length=32
+    )
+
+    async def on_submit(self, interaction):
+        # Différé : on a 15 minutes pour répondre même si le rôle attend dans la file
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        await validate_matricule(interaction.guild, interaction.user, self.matricule.value,
+                                 interaction_sender(interaction))
 
-    await bot.process_commands(message)
+
+@bot.tree.command(name="verify", description="Valider ton matricule et obtenir ton rôle")
+@app_commands.guild_only()
+@app_commands.describe(matricule="Ton matricule (laisser vide pour ouvrir le formulaire)")
+async def verify(interaction: discord.Interaction, matricule: str = None):
+    """Validation par commande slash : réponses éphémères, aucun message public"""
+    if matricule is None:
+        await interaction.response.send_modal(VerifyModal())
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    await validate_matricule(interaction.guild, interaction.user, matricule, interaction_sender(interaction))
 
 
 # === ADMIN COMMANDS ===
-@bot.command(name="checkcolumns")
-@commands.has_permissions(administrator=True)
-async def check_columns(ctx):
-    """Vérifie les valeurs dans les colonnes de section"""
-    try:
-        wb = openpyxl.load_workbook(EXCEL_FILE, data_only=True)
-        sheet = wb.active
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    started_at = getattr(ctx, "started_at", None)
+    if started_at is not None:
+        elapsed = time.perf_counter() - started_at
+        ADMIN_COMMAND_SECONDS.observe(elapsed, command=ctx.command.name)
+        logging.info(
+            f"Commande !{ctx.command.name} par {ctx.author} ({elapsed * 1000:.0f} ms)",
+            extra={"event": "command", "command": ctx.command.name, "user_id": str(ctx.author.id),
+                   "durations": {"total": round(elapsed * 1000, 2)}}
+        )
 
-        # Trouver toutes les colonnes liées à "section"
-        section_columns = []
-        for idx, header in enumerate(sheet[1], start=1):
-            if header.value and any(word in str(header.value).lower() for word in ['section', 'sect']):
-                section_columns.append((idx, header.value))
 
-        # Pour le matricule 212231455913 (ligne 320)
-        target_row = 320
-        data = []
+async def command_state(ctx):
+    """État du serveur de la commande ; prévient l'admin et retourne None s'il n'est pas configuré"""
+    state = guild_registry.get(ctx.guild.id) if ctx.guild else None
+    if state is None:
+        await ctx.send("❌ Ce serveur n'est pas configuré.")
+    return state
 
-        for col_idx, header in section_columns:
-            value = sheet.cell(row=target_row, column=col_idx).value
-            data.append(f"**{header}** (colonne {col_idx}): `{value}`")
 
-        # Aussi vérifier la colonne "Section Prog. Web"
-        for idx, header in enumerate(sheet[1], start=1):
-            if header.value and 'prog. web' in str(header.value).lower():
-                value = sheet.cell(row=target_row, column=idx).value
-                data.append(f"**{header.value}** (colonne {idx}): `{value}`")
+async def command_roster(ctx):
+    """(état, roster) du serveur de la commande ; prévient l'admin et retourne (état, None) si indisponible"""
+    state = await command_state(ctx)
+    if state is None:
+        return None, None
+    current_roster = await ensure_roster(state)
+    if current_roster is None:
+        await ctx.send("❌ Roster non chargé.")
+    return state, current_roster
 
-        embed = discord.Embed(
-            title="🔍 Analyse des colonnes Section",
-            description=f"Pour le matricule 212231455913 (ligne {target_row}):",
-            color=discord.Color.orange()
-        )
 
-        embed.add_field(
-            name="📊 Valeurs trouvées",
-            value="\n".join(data),
-            inline=False
-        )
+@bot.command(name="profile")
+@commands.has_permissions(administrator=True)
+async def profile_command(ctx, action: str = "status"):
+    """Profileur par échantillonnage de la boucle asyncio (start | stop | status)"""
+    if action == "start":
+        if profiler.start():
+            await ctx.send("🔬 Profilage démarré. `!profile stop` pour le résultat.")
+        else:
+            await ctx.send("🔬 Profilage déjà en cours.")
+    elif action == "stop":
+        if not profiler.running:
+            await ctx.send("ℹ️ Aucun profilage en cours.")
+            return
+        samples = profiler.stop()
+        path = os.path.join(PROFILE_DIR, f"profile-{datetime.now():%Y%m%d-%H%M%S}.txt")
+        await persistence.run(_write_text, path, profiler.collapsed())
+        top = "\n".join(f"{count:>5} {stack.rsplit(';', 1)[-1]}" for stack, count in samples.most_common(10))
+        await ctx.send(f"🔬 {sum(samples.values())} échantillons\n```{top[:1800]}```", file=discord.File(path))
+    else:
+        state = "en cours" if profiler.running else "arrêté"
+        await ctx.send(f"🔬 Profileur {state}.")
 
-        # Vérifier aussi quelques autres lignes
-        sample_data = []
-        for row in range(2, 7):  # Lignes 2 à 6
-            matricule = sheet.cell(row=row, column=7).value
-            sect = sheet.cell(row=row, column=8).value if len(section_columns) > 0 else "N/A"
-            section_prog = None
 
-            # Trouver "Section Prog. Web"
-            for idx, header in enumerate(sheet[1], start=1):
-                if header.value and 'prog. web' in str(header.value).lower():
-                    section_prog = sheet.cell(row=row, column=idx).value
-                    break
+def _write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
 
-            sample_data.append(f"L{row}: Mat=`{matricule}`, Sect=`{sect}`, Prog.Web=`{section_prog}`")
 
+@bot.command(name="checkcolumns")
+@commands.has_permissions(administrator=True)
+async def check_columns(ctx, matricule: str = "212231455913"):
+    """Vérifie les valeurs dans les colonnes de section pour un matricule"""
+    _, current_roster = await command_roster(ctx)
+    if current_roster is None:
+        return
+
+    # Toutes les colonnes liées à "section" (dont "Section Prog. Web")
+    section_columns = current_roster.find_columns("section", "sect")
+    positions = current_roster.lookup(matricule)
+
+    embed = discord.Embed(
+        title="🔍 Analyse des colonnes Section",
+        color=discord.Color.orange()
+    )
+
+    if positions:
+        pos = positions[0]
+        row_number = current_roster.row_numbers[pos]
+        embed.description = f"Pour le matricule {matricule} (ligne {row_number}):"
+        data = [f"**{name}**: `{current_roster.value(pos, name)}`" for name in section_columns]
+        if current_roster.is_valid(pos):
+            status = "✅ valide"
+        elif current_roster.is_reference(pos):
+            status = f"ℹ️ source de référence ({current_roster.sources[pos]})"
+        else:
+            status = f"❌ {current_roster.reasons[pos]}"
+        data.append(f"**Résultat**: {status}")
+        embed.add_field(name="📊 Valeurs trouvées", value="\n".join(data), inline=False)
+    else:
+        embed.description = f"Matricule {matricule} absent du fichier Excel."
+
+    # Vérifier aussi quelques autres lignes
+    sample_data = []
+    for pos in range(min(5, len(current_roster))):
+        values = ", ".join(f"{name}=`{current_roster.value(pos, name)}`" for name in section_columns)
+        sample_data.append(f"L{current_roster.row_numbers[pos]}: Mat=`{current_roster.matricules[pos]}`, {values}")
+
+    if sample_data:
         embed.add_field(
             name="📝 Exemple autres lignes",
             value="\n".join(sample_data),
             inline=False
         )
 
-        await ctx.send(embed=embed)
+    await ctx.send(embed=embed)
 
-    except Exception as e:
-        await ctx.send(f"❌ Erreur: {e}")
+
+@bot.command(name="reload")
+@commands.has_permissions(administrator=True)
+async def reload_command(ctx):
+    """Recharge le fichier Excel sans redémarrer le bot"""
+    state = guild_registry.get(ctx.guild.id) if ctx.guild else None
+    if state is None:
+        await ctx.send("❌ Ce serveur n'est pas configuré.")
+        return
+    state.touch()
+    result = await reload_roster(state)
+    if result is None:
+        await ctx.send("❌ Rechargement échoué, l'ancien roster est conservé.")
+        return
+
+    added, removed, roles_removed = result
+
+    embed = discord.Embed(
+        title="🔄 Roster rechargé",
+        color=discord.Color.blue()
+    )
+    embed.add_field(name="📈 Total", value=str(len(state.eligible)), inline=True)
+    embed.add_field(name="➕ Ajoutés", value=str(len(added)), inline=True)
+    embed.add_field(name="➖ Retirés", value=str(len(removed)), inline=True)
+    embed.add_field(name="🚫 Rôles retirés", value=str(roles_removed), inline=True)
+    await ctx.send(embed=embed)
+
+
+async def confirm(ctx, prompt):
+    """Demande une confirmation à l'auteur de la commande ("oui" dans le salon, avant le délai)"""
+    await ctx.send(prompt)
+
+    def check(message):
+        return message.author.id == ctx.author.id and message.channel.id == ctx.channel.id
+
+    try:
+        answer = await bot.wait_for("message", check=check, timeout=RECONCILE_CONFIRM_SECONDS)
+    except asyncio.TimeoutError:
+        return False
+    return answer.content.strip().lower() in ("oui", "o", "yes")
+
+
+@bot.command(name="reconcile")
+@commands.has_permissions(administrator=True)
+async def reconcile_command(ctx, mode: str = "dry", option: str = None):
+    """Aligne les rôles du serveur sur les claims et le roster (dry | apply | resume) [force]"""
+    if mode not in ("dry", "apply", "resume") or option not in (None, "force"):
+        await ctx.send(f"❌ Mode inconnu. Usage: `{ctx.prefix}reconcile [dry|apply|resume] [force]`")
+        return
+    force = option == "force"
+    state, current_roster = await command_roster(ctx)
+    if current_roster is None:
+        return
+    if state.reconcile_lock.locked():
+        await ctx.send("⏳ Une réconciliation est déjà en cours.")
+        return
+
+    async with state.reconcile_lock:
+        guild = ctx.guild
+        try:
+            managed = get_roles(guild, state.managed_roles)
+        except KeyError as e:
+            await ctx.send(f"❌ Rôle '{e.args[0]}' introuvable.")
+            return
+
+        dry_run = mode == "dry"
+        after = None
+        if mode == "resume":
+            after = await persistence.run(reconcile.load_checkpoint, RECONCILE_CHECKPOINT.format(guild_id=guild.id), guild.id)
+            if after is None:
+                await ctx.send("ℹ️ Aucun point de reprise, réconciliation complète.")
+
+        # Index inverse id Discord -> rôles souhaités, construit une fois pour toute la passe
+        desired = {}
+        for matricule, user_id in state.claims.claims.items():
+            desired.setdefault(user_id, set()).update(current_roster.eligible.get(matricule, ()))
+
+        def desired_for(member):
+            return desired.get(str(member.id), ())
+
+        if not dry_run:
+            # Estimation sur les membres en cache avant de retirer quoi que ce soit
+            stripped, holders = reconcile.count_stripped(guild.members, managed, desired_for)
+            refusal = reconcile.refusal_reason(len(state.claims.claims), stripped, holders,
+                                               RECONCILE_MAX_STRIP_RATIO)
+            if refusal and not force:
+                logging.warning(f"[{guild.id}] Réconciliation {mode} refusée: {refusal}")
+                await ctx.send(f"🛑 Réconciliation refusée : {refusal}.\n"
+                               f"Vérifiez les claims (`{ctx.prefix}reconcile dry`), ou forcez avec "
+                               f"`{ctx.prefix}reconcile {mode} force`.")
+                return
+            if stripped and not await confirm(ctx, (
+                    f"⚠️ {stripped} membre(s) sur {holders} détenteurs vont perdre au moins un rôle géré. "
+                    f"Répondez `oui` dans les {RECONCILE_CONFIRM_SECONDS}s pour confirmer.")):
+                await ctx.send("❎ Réconciliation annulée.")
+                return
+
+        progress = await ctx.send(f"🔄 Réconciliation {'(simulation) ' if dry_run else ''}en cours...")
+
+        async def on_progress(report):
+            await progress.edit(content=(
+                f"🔄 Réconciliation {'(simulation) ' if dry_run else ''}: {report.members} membres, "
+                f"+{report.to_add} / -{report.to_remove} rôles, {report.applied} appliqués, "
+                f"{report.failed} échecs"
+            ))
+
+        async def on_checkpoint(report):
+            await persistence.run(reconcile.save_checkpoint, RECONCILE_CHECKPOINT.format(guild_id=guild.id), guild.id, report)
+
+        report = await reconcile.reconcile_guild(
+            guild, managed, desired_for, role_scheduler,
+            dry_run=dry_run, after=after, chunk_size=RECONCILE_CHUNK,
+            concurrency=RECONCILE_CONCURRENCY, on_progress=on_progress, on_checkpoint=on_checkpoint
+        )
+        if not dry_run:
+            await persistence.run(reconcile.clear_checkpoint, RECONCILE_CHECKPOINT.format(guild_id=guild.id))
+
+    logging.info(f"Réconciliation {mode} terminée: {report.as_dict()}")
+
+    embed = discord.Embed(
+        title="🔄 Réconciliation terminée" + (" (simulation)" if dry_run else ""),
+        color=discord.Color.blue()
+    )
+    embed.add_field(name="👥 Membres", value=str(report.members), inline=True)
+    embed.add_field(name="➕ À ajouter", value=str(report.to_add), inline=True)
+    embed.add_field(name="➖ À retirer", value=str(report.to_remove), inline=True)
+    if not dry_run:
+        embed.add_field(name="✅ Appliqués", value=str(report.applied), inline=True)
+        embed.add_field(name="❌ Échecs", value=str(report.failed), inline=True)
+    if report.samples:
+        embed.add_field(name="📝 Exemples", value="```" + "\n".join(report.samples) + "```", inline=False)
+    await ctx.send(embed=embed)
 
 
 @bot.command(name="find")
 @commands.has_permissions(administrator=True)
-async def find_matricule(ctx, matricule: str):
-    """Recherche un matricule dans TOUTES les cellules"""
-    matricule = matricule.strip()
+async def find_matricule(ctx, *, query: str):
+    """Recherche un matricule ou un nom dans le roster indexé (exacte, sous-chaîne, puis approchée)"""
+    query = query.strip()
 
-    try:
-        wb = openpyxl.load_workbook(EXCEL_FILE, data_only=True)
-        sheet = wb.active
-
-        matches = []
-
-        # Parcourir TOUTES les cellules
-        for row_idx in range(1, sheet.max_row + 1):
-            for col_idx in range(1, sheet.max_column + 1):
-                cell = sheet.cell(row=row_idx, column=col_idx).value
-                if cell and matricule in str(cell):
-                    # Trouvé ! Récupérer toute la ligne
-                    row_data = []
-                    for c in range(1, sheet.max_column + 1):
-                        header = sheet.cell(row=1, column=c).value or f"Col{c}"
-                        value = sheet.cell(row=row_idx, column=c).value
-                        row_data.append(f"**{header}:** `{value}`")
-
-                    matches.append({
-                        'row': row_idx,
-                        'col': col_idx,
-                        'data': row_data
-                    })
-
-        if matches:
-            embed = discord.Embed(
-                title=f"🔍 Matricule trouvé: {matricule}",
-                description=f"**{len(matches)} occurrence(s) trouvée(s)**",
-                color=discord.Color.green()
-            )
+    _, current_roster = await command_roster(ctx)
+    if current_roster is None:
+        return
 
-            for i, match in enumerate(matches[:3]):  # Limiter à 3 résultats
-                embed.add_field(
-                    name=f"📍 Ligne {match['row']}, Colonne {match['col']}",
-                    value="\n".join(match['data'][:8]),  # Limiter à 8 champs
-                    inline=False
-                )
+    matches = current_roster.lookup(query) or current_roster.search(query)
+    approx = []
+    if not matches and len(roster.normalize_matricule(query)) >= 6:
+        approx = current_roster.fuzzy(query)
+        for _, candidate in approx:
+            matches.extend(current_roster.lookup(candidate))
 
-            if len(matches) > 3:
-                embed.set_footer(text=f"... et {len(matches) - 3} autres occurrences")
+    if matches:
+        title = f"🔍 Matricule trouvé: {query}" if not approx else f"🔍 Correspondances approchées: {query}"
+        embed = discord.Embed(
+            title=title,
+            description=f"**{len(matches)} occurrence(s) trouvée(s)**",
+            color=discord.Color.green() if not approx else discord.Color.orange()
+        )
 
-        else:
-            embed = discord.Embed(
-                title=f"❌ Matricule NON trouvé: {matricule}",
-                description="Le matricule n'existe nulle part dans le fichier Excel",
-                color=discord.Color.red()
+        for pos in matches[:3]:  # Limiter à 3 résultats
+            fields = [f"**{header}:** `{value}`" for header, value in current_roster.row_fields(pos)]
+            source = current_roster.sources[pos]
+            embed.add_field(
+                name=f"📍 {source + ' ' if source else ''}Ligne {current_roster.row_numbers[pos]}",
+                value="\n".join(fields[:8]),  # Limiter à 8 champs
+                inline=False
             )
 
-        await ctx.send(embed=embed)
+        if len(matches) > 3:
+            embed.set_footer(text=f"... et {len(matches) - 3} autres occurrences")
 
-    except Exception as e:
-        await ctx.send(f"❌ Erreur: {e}")
+    else:
+        embed = discord.Embed(
+            title=f"❌ Matricule NON trouvé: {query}",
+            description="Aucun matricule ni nom correspondant dans le fichier Excel",
+            color=discord.Color.red()
+        )
+
+    await ctx.send(embed=embed)
 
 
 @bot.command(name="checkall")
 @commands.has_permissions(administrator=True)
-async def check_all_matricules(ctx):
-    """Vérifie tous les matricules et montre lesquels sont valides"""
-    valid_count = 0
-    invalid_details = []
+async def check_all_matricules(ctx, mode: str = None, *options: str):
+    """Vérifie tous les matricules et montre lesquels sont valides.
+
+    `!checkall export [csv|xlsx] [reason=CODE,..] [section=A,..] [status=valid|invalid|reference]`
+    joint le rapport complet (avec claims et éligibles non réclamés) au lieu du résumé.
+    """
+    if mode is not None and mode.lower() != "export":
+        await ctx.send(f"❌ Usage: `{ctx.prefix}checkall` ou `{ctx.prefix}checkall export [csv|xlsx] "
+                       f"[reason=CODE] [section=A] [status=invalid]`")
+        return
+    state, current_roster = await command_roster(ctx)
+    if current_roster is None:
+        return
+    if mode is not None:
+        await export_report(ctx, state, current_roster, options)
+        return
 
-    try:
-        wb = openpyxl.load_workbook(EXCEL_FILE, data_only=True)
-        sheet = wb.active
-
-        # Trouver les indices des colonnes
-        col_indices = {}
-        headers = [cell.value for cell in next(sheet.iter_rows(min_row=1, max_row=1))]
-        for i, header in enumerate(headers):
-            header_str = str(header).strip() if header else ""
-            if "affectation" in header_str.lower():
-                col_indices["affectation"] = i
-            if "section prog. web" in header_str.lower():
-                col_indices["section"] = i
-            if "matricule" in header_str.lower():
-                col_indices["matricule"] = i
-
-        for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-            try:
-                matricule = str(row[col_indices["matricule"]] or "").strip().upper()
-                matricule = ''.join(c for c in matricule if c.isalnum())
+    # Validité et raisons calculées au chargement : même résultat que la validation
+    invalid = current_roster.invalid_positions()
+    valid_count = current_roster.valid_count()
+    reference_count = current_roster.reference_count()
+    invalid_details = [
+        f"Ligne {current_roster.row_numbers[pos]}: `{current_roster.matricules[pos]}` - {current_roster.reasons[pos]}"
+        for pos in invalid[:10]
+    ]
 
-                if not matricule:
-                    continue
+    # Créer l'embed de rapport
+    embed = discord.Embed(
+        title="📊 Rapport de Validation des Matricules",
+        color=discord.Color.blue()
+    )
 
-                program = str(row[col_indices["affectation"]] or "").strip()
-                section = str(row[col_indices["section"]] or "").strip()
+    embed.add_field(name="✅ Matricules Valides", value=str(valid_count), inline=True)
+    embed.add_field(name="❌ Matricules Invalides", value=str(len(invalid)), inline=True)
+    if reference_count:
+        # Lignes des sources de référence : Total = valides + invalides + référence
+        embed.add_field(name="📚 Référence", value=str(reference_count), inline=True)
+    embed.add_field(name="📈 Total", value=str(len(current_roster)), inline=True)
 
-                program_lower = program.lower()
-                is_valid = ("programmation web" in program_lower and
-                            "introduction à l'ia" in program_lower and
-                            section.upper() == "B")
+    if invalid:
+        # Limiter à 10 lignes pour ne pas dépasser la limite Discord
+        details_text = "\n".join(invalid_details)
+        if len(invalid) > 10:
+            details_text += f"\n... et {len(invalid) - 10} autres (`{ctx.prefix}checkall export` pour tout)"
 
-                if is_valid:
-                    valid_count += 1
-                else:
-                    invalid_details.append(
-                        f"Ligne {row_idx}: `{matricule}` - Prog: `{program[:30]}...` - Sect: `{section}`")
+        embed.add_field(
+            name="📝 Détails des Invalides",
+            value=f"```{details_text[:1000]}```",
+            inline=False
+        )
+
+        reasons_text = "\n".join(f"{code}: {count}" for code, count in current_roster.reason_counts().most_common())
+        embed.add_field(name="📌 Rejets par raison", value=f"```{reasons_text[:1000]}```", inline=False)
 
-            except Exception as e:
-                invalid_details.append(f"Ligne {row_idx}: ERREUR - {e}")
+    await ctx.send(embed=embed)
+
+
+async def export_report(ctx, state, current_roster, options):
+    """Rapport complet écrit dans un thread (mémoire bornée) puis joint à la réponse"""
+    try:
+        fmt, report_filter = report.ReportFilter.parse(options)
+    except report.ReportOptionError as e:
+        await ctx.send(f"❌ {e}")
+        return
+    if export_lock.locked():
+        await ctx.send("⏳ Un export est déjà en cours, patientez.")
+    async with export_lock:
+        directory = tempfile.mkdtemp(prefix="checkall-")
+        try:
+            basename = f"checkall-{state.guild_id}-{datetime.now():%Y%m%d-%H%M%S}"
+            paths, counts = await asyncio.to_thread(
+                report.write_report, directory, basename, fmt, current_roster, state.claims.claims, report_filter)
+            size = sum(os.path.getsize(path) for path in paths)
+            limit = ctx.guild.filesize_limit
+            summary = (f"📊 Rapport complet: {counts['rapport']} ligne(s), "
+                       f"{counts['non-reclames']} matricule(s) éligible(s) non réclamé(s)")
+            if report_filter:
+                summary += f"\n🔎 Filtres: {report_filter.describe()}"
+            if size > limit:
+                await ctx.send(f"{summary}\n❌ Fichier trop volumineux ({size / 1e6:.1f} Mo > {limit / 1e6:.0f} Mo), "
+                               f"ajoutez des filtres ou utilisez xlsx.")
+                return
+            await ctx.send(summary, files=[discord.File(path) for path in paths])
+            logging.info(f"📊 [{state.guild_id}] Export checkall {fmt} ({size} octets) par {ctx.author}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+@bot.command(name="conflicts")
+@commands.has_permissions(administrator=True)
+async def conflicts_command(ctx):
+    """Matricules sur lesquels les sources du roster se contredisent (section, filière...)"""
+    state, current_roster = await command_roster(ctx)
+    if current_roster is None:
+        return
+
+    conflicts = current_roster.conflicts
+    embed = discord.Embed(
+        title="⚖️ Conflits entre sources",
+        description=f"Sources: {state.config.source_names}\n**{len(conflicts)} conflit(s)**",
+        color=discord.Color.orange() if conflicts else discord.Color.green()
+    )
+    lines = [
+        f"`{c['matricule']}` {c['field']}: " + ", ".join(f"{source}=`{value}`" for source, value in c["values"].items())
+        for c in conflicts[:15]
+    ]
+    if lines:
+        text = "\n".join(lines)
+        if len(conflicts) > 15:
+            text += f"\n... et {len(conflicts) - 15} autres"
+        embed.add_field(name="📝 Détails", value=text[:1024], inline=False)
+    await ctx.send(embed=embed)
+
+
+# === CLAIMS (SUPPORT) ===
+MENTION_RE = re.compile(r"<@!?(\d+)>$")
+
+
+def parse_claim_target(text):
+    """("user", id) pour une mention ou un id Discord, sinon ("matricule", matricule normalisé)"""
+    text = text.strip()
+    match = MENTION_RE.match(text)
+    if match:
+        return "user", match.group(1)
+    if text.isdigit() and 15 <= len(text) <= 20:  # Les ids Discord sont plus longs que les matricules
+        return "user", text
+    return "matricule", roster.normalize_matricule(text)
+
+
+def format_claim_event(record):
+    """Une ligne d'historique : date, opération, membres, auteur et raison"""
+    ts = record.get("ts")
+    when = f"<t:{int(ts)}:f>" if ts else "?"
+    if record.get("op") == "claim":
+        text = f"{when} `{record['matricule']}` → <@{record['user_id']}>"
+        if record.get("from"):
+            text += f" (depuis <@{record['from']}>)"
+    else:
+        text = f"{when} `{record['matricule']}` libéré" + (f" (<@{record['user_id']}>)" if record.get("user_id") else "")
+    if record.get("by"):
+        text += f" par <@{record['by']}>"
+    if record.get("reason"):
+        text += f" : {record['reason']}"
+    return text
+
+
+async def update_claim_roles(guild, user_id, add=(), remove=(), reason=None):
+    """Ajoute/retire des rôles par nom à un membre via le planificateur ; retourne le nombre appliqué"""
+    member = guild.get_member(int(user_id))
+    if member is None:
+        return 0
+    operations = []
+    for names, action in ((add, ADD), (remove, REMOVE)):
+        for name in names:
+            role = discord.utils.get(guild.roles, name=name)
+            if role is None or (role in member.roles) == (action == ADD):
                 continue
+            operations.append(role_scheduler.submit(member, role, action, reason=reason))
+    results = await asyncio.gather(*operations, return_exceptions=True)
+    return sum(1 for r in results if r == APPLIED)
+
+
+def roles_kept(state, user_id):
+    """Rôles encore accordés par les matricules restants du membre"""
+    return {name for matricule in state.claims.store.matricules_of(user_id)
+            for name in state.eligible.get(matricule, ())}
+
+
+async def release_claim(state, guild, matricule, actor=None, reason=None):
+    """Libère un matricule et retire au détenteur les rôles qu'il n'a plus ; retourne (détenteur, rôles retirés)"""
+    store = state.claims.store
+    holder = store.claims.get(matricule)
+    if holder is None:
+        return None, 0
+    async with state.claims.coordinator.locked(matricule, holder):
+        if store.claims.get(matricule) != holder:
+            return None, 0  # Modifié pendant l'attente du verrou
+        store.unclaim(matricule, actor, reason)
+    lost = set(state.eligible.get(matricule, ())) - roles_kept(state, holder)
+    removed = await update_claim_roles(guild, holder, remove=lost, reason=f"Matricule {matricule} libéré")
+    logging.info(f"🔓 [{state.guild_id}] Matricule libéré (<@{holder}>): {reason or 'sans raison'}",
+                 extra={"event": "unclaim", "user_id": str(holder), "matricule_hash": matricule_hash(matricule)})
+    return holder, removed
+
 
-        # Créer l'embed de rapport
+@bot.event
+async def on_member_remove(member):
+    """Un membre qui quitte le serveur libère ses matricules (index inverse : pas de parcours des claims)"""
+    state = guild_registry.get(member.guild.id)
+    if not RELEASE_CLAIMS_ON_LEAVE or state is None:
+        return
+    matricules = state.claims.store.matricules_of(member.id)
+    if not matricules:
+        return
+    # Espace de claims partagé : le claim reste valable tant que le membre est sur un autre serveur de l'espace
+    for other in guild_registry.states.values():
+        if other is not state and other.claims is state.claims:
+            guild = bot.get_guild(other.guild_id)
+            if guild is not None and guild.get_member(member.id) is not None:
+                return
+    for matricule in matricules:
+        async with state.claims.coordinator.locked(matricule, member.id):
+            if state.claims.store.claims.get(matricule) == str(member.id):
+                state.claims.store.unclaim(matricule, reason="départ du serveur")
+    logging.info(f"👋 [{state.guild_id}] {member} a quitté le serveur: {len(matricules)} matricule(s) libéré(s)")
+
+
+@bot.command(name="whois")
+@commands.has_permissions(administrator=True)
+async def whois_command(ctx, *, target: str):
+    """Détenteur d'un matricule, ou matricules d'un membre (mention ou id), avec l'historique"""
+    state = await command_state(ctx)
+    if state is None:
+        return
+    store = state.claims.store
+    kind, value = parse_claim_target(target)
+    # Rôles affichés depuis le roster : chargé même s'il a été libéré pour inactivité
+    await ensure_roster(state)
+
+    if kind == "user":
+        matricules = store.matricules_of(value)
         embed = discord.Embed(
-            title="📊 Rapport de Validation des Matricules",
-            color=discord.Color.blue()
+            title="🪪 Matricules du membre",
+            description=f"<@{value}> : **{len(matricules)} matricule(s)**",
+            color=discord.Color.blue() if matricules else discord.Color.light_grey()
         )
+        for matricule in matricules[:10]:
+            ts = store.claimed_at(matricule)
+            roles = ", ".join(state.eligible.get(matricule, ())) or "aucun (hors roster ou roster non chargé)"
+            embed.add_field(name=f"`{matricule}`",
+                            value=f"Validé {f'<t:{int(ts)}:R>' if ts else '(date inconnue)'}\nRôles: {roles}",
+                            inline=False)
+        history = await persistence.run(store.history, user_id=value, limit=5)
+    else:
+        if not value:
+            await ctx.send("❌ Matricule ou membre invalide.")
+            return
+        holder = state.claims.coordinator.holder(value)
+        pending = value in state.claims.coordinator.pending
+        ts = store.claimed_at(value)
+        if holder is None:
+            description = "🆓 Libre"
+        elif pending:
+            description = f"⏳ Validation en cours par <@{holder}>"
+        else:
+            description = f"🔒 <@{holder}>, validé {f'<t:{int(ts)}:R>' if ts else '(date inconnue)'}"
+        embed = discord.Embed(
+            title=f"🪪 Matricule {value}",
+            description=description,
+            color=discord.Color.blue() if holder else discord.Color.light_grey()
+        )
+        roles = state.eligible.get(value)
+        embed.add_field(name="Roster", value=f"Éligible: {', '.join(roles)}" if roles else "Non éligible / absent",
+                        inline=False)
+        history = await persistence.run(store.history, matricule=value, limit=5)
 
-        embed.add_field(name="✅ Matricules Valides", value=str(valid_count), inline=True)
-        embed.add_field(name="❌ Matricules Invalides", value=str(len(invalid_details)), inline=True)
-        embed.add_field(name="📈 Total", value=str(valid_count + len(invalid_details)), inline=True)
+    if history:
+        embed.add_field(name="📜 Historique", value="\n".join(format_claim_event(r) for r in history)[:1024],
+                        inline=False)
+    await ctx.send(embed=embed, allowed_mentions=discord.AllowedMentions.none())
 
-        if invalid_details:
-            # Limiter à 10 lignes pour ne pas dépasser la limite Discord
-            details_text = "\n".join(invalid_details[:10])
-            if len(invalid_details) > 10:
-                details_text += f"\n... et {len(invalid_details) - 10} autres"
 
-            embed.add_field(
-                name="📝 Détails des Invalides",
-                value=f"```{details_text}```",
-                inline=False
-            )
+@bot.command(name="unclaim")
+@commands.has_permissions(administrator=True)
+async def unclaim_command(ctx, target: str, *, reason: str = None):
+    """Libère un matricule (ou tous ceux d'un membre) et retire les rôles qu'il accordait"""
+    state = await command_state(ctx)
+    if state is None:
+        return
+    await ensure_roster(state)
+    kind, value = parse_claim_target(target)
+    matricules = state.claims.store.matricules_of(value) if kind == "user" else [value]
+
+    released = []
+    removed = 0
+    for matricule in matricules:
+        holder, count = await release_claim(state, ctx.guild, matricule, ctx.author.id, reason)
+        if holder is not None:
+            released.append(f"`{matricule}` (<@{holder}>)")
+            removed += count
+
+    if not released:
+        await ctx.send("ℹ️ Aucun matricule attribué correspondant.")
+        return
+    await ctx.send(f"🔓 Libéré: {', '.join(released)}. {removed} rôle(s) retiré(s).",
+                   allowed_mentions=discord.AllowedMentions.none())
+
+
+@bot.command(name="transfer")
+@commands.has_permissions(administrator=True)
+async def transfer_command(ctx, matricule: str, member: discord.Member, *, reason: str = None):
+    """Attribue un matricule à un autre membre : rôles retirés à l'ancien détenteur et donnés au nouveau"""
+    state = await command_state(ctx)
+    if state is None:
+        return
+    current_roster = await ensure_roster(state)
+    matricule = roster.normalize_matricule(matricule)
+    roles = state.eligible.get(matricule)
+    if current_roster is None or not roles:
+        await ctx.send(f"❌ Matricule `{matricule}` non éligible dans le roster.")
+        return
+
+    store = state.claims.store
+    coordinator = state.claims.coordinator
+    async with coordinator.locked(matricule, member.id):
+        if matricule in coordinator.pending:
+            await ctx.send("⏳ Une validation de ce matricule est en cours, réessayez dans un instant.")
+            return
+        previous = store.claims.get(matricule)
+        if previous == str(member.id):
+            await ctx.send(f"ℹ️ {member.mention} détient déjà `{matricule}`.",
+                           allowed_mentions=discord.AllowedMentions.none())
+            return
+        store.claim(matricule, member.id, actor=ctx.author.id, reason=reason or "transfert")
+
+    removed = 0
+    if previous is not None:
+        lost = set(roles) - roles_kept(state, previous)
+        removed = await update_claim_roles(ctx.guild, previous, remove=lost,
+                                           reason=f"Matricule {matricule} transféré")
+    added = await update_claim_roles(ctx.guild, member.id, add=roles, reason=f"Matricule {matricule}")
+    logging.info(f"🔁 [{state.guild_id}] Matricule transféré de {previous} à {member} par {ctx.author}",
+                 extra={"event": "transfer", "user_id": str(member.id), "matricule_hash": matricule_hash(matricule)})
+    await ctx.send(
+        f"🔁 `{matricule}` attribué à {member.mention}"
+        + (f" (retiré à <@{previous}>, {removed} rôle(s) retiré(s))" if previous else "")
+        + f", {added} rôle(s) ajouté(s).",
+        allowed_mentions=discord.AllowedMentions.none()
+    )
+
+
+@bot.command(name="stats")
+@commands.has_permissions(administrator=True)
+async def stats_command(ctx, hours: float = 24.0):
+    """Claims par section sur les dernières heures et éligibles jamais réclamés (requêtes SQLite indexées)"""
+    if repository is None:
+        await ctx.send("ℹ️ Statistiques disponibles avec le backend SQLite (`STORAGE_BACKEND=sqlite`).")
+        return
+    state, current_roster = await command_roster(ctx)
+    if current_roster is None:
+        return
+    namespace = state.config.claims_namespace
+    since = time.time() - hours * 3600
+    per_section = await repository.claims_per_section(state.guild_id, namespace, since)
+    unclaimed = await repository.unclaimed_per_section(state.guild_id, namespace)
+    events = await repository.event_counts(namespace, since)
+
+    embed = discord.Embed(
+        title=f"📈 Claims des dernières {hours:g} h",
+        description=(f"**{sum(count for _, count in per_section)}** nouveau(x) claim(s), "
+                     f"{events.get('unclaim', 0)} libération(s)"),
+        color=discord.Color.blue()
+    )
+    if per_section:
+        text = "\n".join(f"{section or '(sans section)'}: {count}" for section, count in per_section[:20])
+        embed.add_field(name="Par section", value=f"```{text[:1000]}```", inline=True)
+    if unclaimed:
+        text = "\n".join(f"{section or '(sans section)'}: {count}" for section, count in unclaimed[:20])
+        embed.add_field(name=f"🆓 Éligibles jamais réclamés ({sum(c for _, c in unclaimed)})",
+                        value=f"```{text[:1000]}```", inline=True)
+    await ctx.send(embed=embed)
 
-        await ctx.send(embed=embed)
 
-    except Exception as e:
-        logging.error(f"Erreur checkall: {e}")
-        await ctx.send(f"❌ Erreur: {e}")
 # === ERROR HANDLER ===
 @bot.event
 async def on_error(event, *args, **kwargs):
@@ -521,10 +1499,44 @@ async def on_error(event, *args, **kwargs):
 
 
 # === RUN BOT ===
+async def shutdown(signame):
+    """Arrêt propre sur SIGTERM/SIGINT (docker stop, systemd) : bot.start() rend la main à main()"""
+    logging.info(f"Arrêt demandé ({signame})")
+    # Les opérations de rôle en file passent tant que la session HTTP du bot est ouverte
+    await role_scheduler.close(timeout=ROLE_SHUTDOWN_SECONDS)
+    await bot.close()
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):  # Windows : pas de add_signal_handler
+            loop.add_signal_handler(sig, lambda name=sig.name: asyncio.create_task(shutdown(name)))
+    try:
+        async with bot:
+            await bot.start(TOKEN)
+    finally:
+        # Arrêt sans signal : les opérations restantes échouent et leurs réservations de claim sont annulées
+        await role_scheduler.close()
+        await stop_http_server()
+        if persistence.running:
+            # Claims confirmés aux étudiants : écrits avant que le processus ne se termine
+            await persistence.aflush()
+
+
 if __name__ == "__main__":
     try:
-        bot.run(TOKEN)
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logging.info("Arrêt demandé")
     except discord.LoginFailure:
         logging.error("Échec de connexion. Vérifiez le token Discord.")
     except Exception as e:
-        logging.error(f"Erreur inattendue: {e}")
\ No newline at end of file
+        logging.error(f"Erreur inattendue: {e}")
+    finally:
+        # Garantie d'écriture : tout claim accepté est dans le journal avant de quitter
+        persistence.close()
+        claims_registry.close()
+        if repository is not None:
+            repository.close()
+        log_listener.stop()
@@ -0,0 +1,211 @@
+"""Métriques du bot au format texte Prometheus et profileur par échantillonnage.
+
+Pas de dépendance externe : compteurs, jauges et histogrammes minimalistes,
+lus par la route /metrics du serveur keep_alive.
+"""
+import collections
+import contextlib
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Labels attendus {labelnames}, reçus {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        with _lock:
+            REGISTRY.append(self)
+
+    def set_function(self, function):
+        """Valeur calculée au rendu : function() -> nombre, ou {tuple de labels: nombre}"""
+        self._function = function
+
+    def _collect(self):
+        values = dict(self._values)
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception:
+                result = None
+            if isinstance(result, dict):
+                values.update(result)
+            elif result is not None:
+                values[()] = result
+        return values
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Compteur monotone"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        for key, value in sorted(self._collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valeur instantanée"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = self._header()
+        for key, value in sorted(self._collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Histogramme cumulatif (buckets en secondes)"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Mesure la durée du bloc"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = self._header()
+        for key, (counts, total, total_sum) in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total_sum}")
+        return lines
+
+
+def render():
+    """Toutes les métriques au format texte Prometheus (version 0.0.4)"""
+    with _lock:
+        metrics = list(REGISTRY)
+    lines = []
+    for metric in metrics:
+        with _lock:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# === PROFILEUR PAR ÉCHANTILLONNAGE ===
+class SamplingProfiler:
+    """Échantillonne périodiquement la pile d'un thread (par défaut celui de la boucle asyncio).
+
+    Le résultat est au format "collapsed" (pile;pile;... nombre), lisible par
+    les outils de flamegraph. Désactivé par défaut : aucun coût hors session.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id=None):
+        """Démarre l'échantillonnage du thread donné (thread courant par défaut)"""
+        if self.running:
+            return False
+        self._target = thread_id or threading.get_ident()
+        self.samples.clear()
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Arrête l'échantillonnage et retourne les piles collectées"""
+        if not self.running:
+            return self.samples
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(names))] += 1
+
+    def collapsed(self):
+        """Texte au format collapsed, piles les plus fréquentes d'abord"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
@@ -0,0 +1,138 @@
+"""File d'écriture différée (write-behind) exécutée sur un thread I/O dédié."""
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class _Call:
+    """Fonction à exécuter sur le thread I/O, après les écritures en attente"""
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class WriteBehindQueue:
+    """Regroupe les enregistrements soumis et les écrit par lots sur un thread dédié.
+
+    submit() ne bloque jamais la boucle asyncio. Un lot est écrit via sink(batch)
+    dès qu'il atteint batch_size ou que flush_interval secondes se sont écoulées
+    depuis son premier enregistrement, ainsi qu'à la fermeture.
+    """
+
+    def __init__(self, sink, batch_size=100, flush_interval=1.0, name="persistence"):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self.batches_written = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+
+    # === CYCLE DE VIE ===
+    def start(self):
+        """Démarre le thread I/O (idempotent)"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self, timeout=10.0):
+        """Écrit tout ce qui est en attente puis arrête le thread"""
+        if self._closed or self._thread is None:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"[{self.name}] Arrêt incomplet: {self.pending} écriture(s) en attente")
+
+    @property
+    def running(self):
+        """Thread I/O démarré, vivant et file encore ouverte"""
+        return self._thread is not None and self._thread.is_alive() and not self._closed
+
+    @property
+    def pending(self):
+        """Nombre d'éléments en attente dans la file"""
+        return self._queue.qsize()
+
+    # === API ===
+    def submit(self, record):
+        """Ajoute un enregistrement à écrire (non bloquant)"""
+        if self._closed:
+            raise RuntimeError(f"[{self.name}] file fermée")
+        self._queue.put_nowait(record)
+
+    def call(self, fn, *args, **kwargs):
+        """Exécute fn sur le thread I/O après les écritures en attente ; retourne un Future"""
+        if self._closed:
+            raise RuntimeError(f"[{self.name}] file fermée")
+        item = _Call(fn, args, kwargs)
+        self._queue.put_nowait(item)
+        return item.future
+
+    async def run(self, fn, *args, **kwargs):
+        """Version awaitable de call()"""
+        return await asyncio.wrap_future(self.call(fn, *args, **kwargs))
+
+    def flush(self, timeout=None):
+        """Bloque jusqu'à ce que tout ce qui a été soumis soit écrit"""
+        self.call(lambda: None).result(timeout)
+
+    async def aflush(self):
+        """Attend (sans bloquer la boucle) que tout ce qui a été soumis soit écrit"""
+        await self.run(lambda: None)
+
+    # === THREAD I/O ===
+    def _worker(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write(batch)
+                deadline = None
+                continue
+
+            if item is _STOP:
+                self._write(batch)
+                return
+
+            if isinstance(item, _Call):
+                self._write(batch)
+                deadline = None
+                try:
+                    item.future.set_result(item.fn(*item.args, **item.kwargs))
+                except BaseException as e:
+                    item.future.set_exception(e)
+                continue
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                deadline = None
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.sink(list(batch))
+            self.batches_written += 1
+        except Exception as e:
+            logging.error(f"[{self.name}] Erreur d'écriture d'un lot de {len(batch)}: {e}")
+        batch.clear()
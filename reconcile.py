@@ -0,0 +1,161 @@
+"""Réconciliation en masse des rôles du serveur avec les claims et le roster."""
+import asyncio
+import json
+import logging
+import os
+
+import discord
+
+from role_scheduler import ADD, REMOVE, APPLIED
+
+
+class ReconcileReport:
+    """Compteurs d'une réconciliation (en cours ou terminée)"""
+
+    def __init__(self):
+        self.members = 0
+        self.to_add = 0
+        self.to_remove = 0
+        self.applied = 0
+        self.failed = 0
+        self.last_member_id = None
+        self.samples = []  # Quelques différences, pour le dry-run
+
+    def as_dict(self):
+        return {
+            "members": self.members,
+            "to_add": self.to_add,
+            "to_remove": self.to_remove,
+            "applied": self.applied,
+            "failed": self.failed,
+            "last_member_id": self.last_member_id,
+        }
+
+
+async def reconcile_guild(guild, managed_roles, desired_for, scheduler, *, dry_run=True,
+                          after=None, chunk_size=1000, concurrency=4,
+                          on_progress=None, on_checkpoint=None):
+    """Parcourt les membres par blocs et applique uniquement les différences de rôles.
+
+    desired_for(member) retourne les noms des rôles gérés que le membre devrait
+    avoir. Les opérations passent par le planificateur de rôles avec au plus
+    `concurrency` opérations en cours, pour laisser la place aux validations.
+    Après chaque bloc, on_checkpoint(id du dernier membre) permet de reprendre
+    avec `after` ; on_progress(report) est appelé pour le suivi.
+    """
+    report = ReconcileReport()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def apply(member, role, action):
+        async with semaphore:
+            try:
+                result = await scheduler.submit(member, role, action, reason="Réconciliation des rôles")
+                if result == APPLIED:
+                    report.applied += 1
+            except Exception as e:
+                report.failed += 1
+                logging.error(f"Réconciliation: échec {action} {role} pour {member}: {e}")
+
+    async def process(chunk):
+        tasks = []
+        for member in chunk:
+            desired = desired_for(member)
+            for role in managed_roles:
+                has_role = role in member.roles
+                wants_role = role.name in desired
+                if has_role == wants_role:
+                    continue
+                action = ADD if wants_role else REMOVE
+                if action == ADD:
+                    report.to_add += 1
+                else:
+                    report.to_remove += 1
+                if dry_run:
+                    if len(report.samples) < 10:
+                        report.samples.append(f"{'+' if action == ADD else '-'}{role.name} {member}")
+                    continue
+                tasks.append(apply(member, role, action))
+        await asyncio.gather(*tasks)
+        report.members += len(chunk)
+        report.last_member_id = chunk[-1].id
+        if on_checkpoint is not None and not dry_run:
+            await on_checkpoint(report)
+        if on_progress is not None:
+            await on_progress(report)
+
+    chunk = []
+    after_obj = discord.Object(id=after) if after else None
+    # fetch_members pagine par 1000 et retourne les membres par id croissant
+    async for member in guild.fetch_members(limit=None, after=after_obj):
+        if member.bot:
+            continue
+        chunk.append(member)
+        if len(chunk) >= chunk_size:
+            await process(chunk)
+            chunk = []
+    if chunk:
+        await process(chunk)
+
+    return report
+
+
+# === GARDE-FOU ===
+def count_stripped(members, managed_roles, desired_for):
+    """(membres qui perdraient au moins un rôle géré, membres qui en détiennent au moins un)"""
+    stripped = holders = 0
+    for member in members:
+        if member.bot:
+            continue
+        held = [role for role in managed_roles if role in member.roles]
+        if not held:
+            continue
+        holders += 1
+        desired = desired_for(member)
+        if any(role.name not in desired for role in held):
+            stripped += 1
+    return stripped, holders
+
+
+def refusal_reason(claims_count, stripped, holders, max_ratio):
+    """Motif de refus d'une réconciliation appliquée, None si elle peut être lancée.
+
+    Un fichier de claims perdu ou tronqué ferait retirer les rôles de tout le
+    serveur : on refuse sans claims, ou au-delà de `max_ratio` des détenteurs.
+    """
+    if not stripped:
+        return None
+    if claims_count == 0:
+        return f"aucun claim chargé : {stripped} membre(s) perdraient tous leurs rôles"
+    if stripped / holders > max_ratio:
+        return (f"{stripped} des {holders} détenteurs d'un rôle géré le perdraient "
+                f"({stripped / holders:.0%} > {max_ratio:.0%})")
+    return None
+
+
+# === CHECKPOINT ===
+def save_checkpoint(path, guild_id, report):
+    """Écrit le point de reprise de façon atomique"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"guild_id": guild_id, **report.as_dict()}, f)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, guild_id):
+    """Id du dernier membre traité pour ce serveur, ou None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if data.get("guild_id") != guild_id:
+        return None
+    return data.get("last_member_id")
+
+
+def clear_checkpoint(path):
+    """Supprime le point de reprise (réconciliation terminée)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,172 @@
+"""Export complet du rapport de validation (!checkall export) : CSV ou xlsx écrit ligne par ligne.
+
+    !checkall export xlsx "reason=critere:Section Prog. Web,critere:Affectation" section=A status=invalid
+
+Les codes de rejet sont ceux de la colonne « Code » du rapport (critere:<nom du
+critère>) ; une option qui contient des espaces se met entre guillemets.
+
+Le fichier est produit dans un thread, sans construire le rapport en mémoire :
+le roster n'est jamais modifié une fois chargé (un rechargement le remplace) et
+les claims ne sont lus que par get(), pendant que la boucle continue d'en ajouter.
+
+Contenu : une ligne par ligne du roster (statut, raison, rôles, membre qui l'a
+réclamé), puis la liste des matricules éligibles non réclamés. En xlsx, deux
+feuilles ; en CSV, deux fichiers (séparateur ";" et BOM, pour Excel).
+"""
+import csv
+import os
+
+from openpyxl import Workbook
+
+import rules
+
+FORMATS = ("csv", "xlsx")
+STATUSES = ("valid", "invalid", "reference")
+
+
+class ReportOptionError(ValueError):
+    """Option d'export invalide"""
+
+
+class ReportFilter:
+    """Filtres optionnels : codes de rejet, sections, statuts (valeurs multiples séparées par des virgules)"""
+
+    def __init__(self, reasons=(), sections=(), statuses=()):
+        self.reasons = {r.upper() for r in reasons}
+        self.sections = {rules.normalize_text(s) for s in sections}
+        self.statuses = set(statuses)
+        unknown = self.statuses - set(STATUSES)
+        if unknown:
+            raise ReportOptionError(f"Statut inconnu: {', '.join(sorted(unknown))} (valid, invalid, reference)")
+
+    @classmethod
+    def parse(cls, options):
+        """(format, filtre) depuis les arguments de la commande : [csv|xlsx] [reason=..] [section=..] [status=..]"""
+        fmt = "csv"
+        values = {"reason": [], "section": [], "status": []}
+        for option in options:
+            if option.lower() in FORMATS:
+                fmt = option.lower()
+                continue
+            key, sep, value = option.partition("=")
+            key = key.lower()
+            if not sep or key not in values:
+                raise ReportOptionError(f"Option inconnue: '{option}'")
+            values[key].extend(v.strip() for v in value.split(",") if v.strip())
+        return fmt, cls(values["reason"], values["section"], values["status"])
+
+    def __bool__(self):
+        return bool(self.reasons or self.sections or self.statuses)
+
+    def describe(self):
+        parts = []
+        if self.statuses:
+            parts.append("statut " + ", ".join(sorted(self.statuses)))
+        if self.reasons:
+            parts.append("raison " + ", ".join(sorted(self.reasons)))
+        if self.sections:
+            parts.append("section " + ", ".join(sorted(self.sections)))
+        return " ; ".join(parts)
+
+    def matches(self, roster, pos, section):
+        if self.statuses and row_status(roster, pos) not in self.statuses:
+            return False
+        if self.reasons and roster.reason_codes[pos].upper() not in self.reasons:
+            return False
+        if self.sections and rules.normalize_text(section or "") not in self.sections:
+            return False
+        return True
+
+
+def row_status(roster, pos):
+    if roster.is_valid(pos):
+        return "valid"
+    if roster.is_reference(pos):
+        return "reference"
+    return "invalid"
+
+
+class _Layout:
+    """Colonnes du rapport pour un roster donné (section et colonnes de recherche)"""
+
+    def __init__(self, roster):
+        self.roster = roster
+        self.section = roster.section_getter()
+        self.search_names = [roster.column_names[i] for i in roster.search_cols]
+        self.search_columns = [roster.columns[name] for name in self.search_names]
+
+    def extra(self, pos):
+        return ["" if values[pos] is None else values[pos] for values in self.search_columns]
+
+    @property
+    def report_headers(self):
+        return (["Ligne", "Source", "Matricule", "Statut", "Code", "Raison", "Rôles", "Section"]
+                + self.search_names + ["Réclamé par"])
+
+    @property
+    def unclaimed_headers(self):
+        return ["Matricule", "Rôles", "Source", "Ligne", "Section"] + self.search_names
+
+
+def report_rows(roster, claims, report_filter):
+    """Lignes du rapport complet (générateur, en-têtes en premier)"""
+    layout = _Layout(roster)
+    yield layout.report_headers
+    for pos in range(len(roster)):
+        section = layout.section(pos)
+        if not report_filter.matches(roster, pos, section):
+            continue
+        matricule = roster.matricules[pos]
+        yield ([roster.row_numbers[pos], roster.sources[pos], matricule, row_status(roster, pos),
+                roster.reason_codes[pos], roster.reasons[pos], ", ".join(roster.roles[pos]), section]
+               + layout.extra(pos) + [claims.get(matricule, "")])
+
+
+def unclaimed_rows(roster, claims, report_filter):
+    """Matricules éligibles sans membre associé (générateur, en-têtes en premier)"""
+    layout = _Layout(roster)
+    yield layout.unclaimed_headers
+    for matricule, roles in roster.eligible.items():
+        if claims.get(matricule):
+            continue
+        # Première ligne qui accorde un rôle : provenance et colonnes affichées
+        pos = next(p for p in roster.lookup(matricule) if roster.is_valid(p))
+        section = layout.section(pos)
+        if not report_filter.matches(roster, pos, section):
+            continue
+        yield ([matricule, ", ".join(roles), roster.sources[pos], roster.row_numbers[pos], section]
+               + layout.extra(pos))
+
+
+def write_report(directory, basename, fmt, roster, claims, report_filter):
+    """Écrit le rapport dans `directory` (à appeler dans un thread) ; retourne (chemins, {section: lignes})"""
+    if fmt not in FORMATS:
+        raise ReportOptionError(f"Format non supporté: '{fmt}' ({', '.join(FORMATS)})")
+    parts = [("rapport", "Rapport", report_rows(roster, claims, report_filter)),
+             ("non-reclames", "Non réclamés", unclaimed_rows(roster, claims, report_filter))]
+    counts = {}
+
+    if fmt == "xlsx":
+        path = os.path.join(directory, f"{basename}.xlsx")
+        # write_only : les lignes partent dans des fichiers temporaires, pas dans un arbre en mémoire
+        workbook = Workbook(write_only=True)
+        for key, title, rows in parts:
+            sheet = workbook.create_sheet(title)
+            counts[key] = -1
+            for row in rows:
+                sheet.append(row)
+                counts[key] += 1
+        workbook.save(path)
+        return [path], counts
+
+    paths = []
+    for key, _, rows in parts:
+        path = os.path.join(directory, f"{basename}-{key}.csv")
+        counts[key] = -1
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f, delimiter=";")
+            for row in rows:
+                writer.writerow(row)
+                counts[key] += 1
+        paths.append(path)
+    return paths, counts
@@ -0,0 +1,223 @@
+"""Planificateur des ajouts/retraits de rôles : token bucket, regroupement et retries."""
+import asyncio
+import logging
+import random
+import time
+
+import discord
+
+ADD = "add"
+REMOVE = "remove"
+
+APPLIED = "applied"  # Appel API effectué
+SKIPPED = "skipped"  # Rien à faire : le membre est déjà dans l'état voulu
+SUPERSEDED = "superseded"  # Remplacée avant exécution par l'intention inverse : non appliquée
+
+
+class TokenBucket:
+    """Limiteur de débit : `rate` jetons par seconde, jusqu'à `capacity` en rafale"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Attend qu'un jeton soit disponible puis le consomme"""
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            # Tolérance : l'attente calculée peut laisser un reliquat d'arrondi (0.9999999...)
+            if self.tokens >= 1 - 1e-9:
+                self.tokens = max(0.0, self.tokens - 1)
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Bloque le bucket (ex: après un 429) et vide les jetons"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class RoleOperation:
+    """Intention d'ajout/retrait d'un rôle pour un membre"""
+
+    def __init__(self, member, role, action, reason):
+        self.member = member
+        self.role = role
+        self.action = action
+        self.reason = reason
+        self.futures = []
+
+    @property
+    def key(self):
+        return self.member.id, self.role.id
+
+
+class RoleScheduler:
+    """File des opérations de rôles exécutées par quelques workers sous un token bucket.
+
+    Les opérations en attente pour le même (membre, rôle) et la même action sont
+    regroupées : tous les appelants reçoivent le même résultat. Une intention
+    inverse remplace l'opération en attente, dont les appelants reçoivent
+    SUPERSEDED (à traiter comme un échec). Une opération déjà satisfaite (rôle
+    déjà présent/absent) ne coûte aucun appel API. Les 429 et erreurs 5xx sont
+    retentés avec backoff exponentiel.
+    """
+
+    def __init__(self, rate=5.0, burst=10, workers=2, max_retries=5, base_delay=1.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.stats = {"applied": 0, "skipped": 0, "coalesced": 0, "retries": 0,
+                      "rate_limited": 0, "failed": 0, "superseded": 0}
+        self._pending = {}  # (member_id, role_id) -> RoleOperation pas encore démarrée
+        self._in_flight = set()
+        self._queue = None
+        self._tasks = []
+
+    # === CYCLE DE VIE ===
+    def start(self):
+        """Démarre les workers sur la boucle courante (idempotent)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        for key in self._pending:
+            if key not in self._in_flight:
+                self._queue.put_nowait(key)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"role-worker-{i}")
+                       for i in range(self.workers)]
+
+    async def close(self, timeout=0.0):
+        """Arrête les workers après au plus `timeout` s d'attente des opérations en file (les autres échouent)"""
+        deadline = time.monotonic() + timeout
+        while self.running and (self._pending or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        dropped = len(self._pending) + len(self._in_flight)
+        if dropped:
+            logging.warning(f"Planificateur de rôles arrêté: {dropped} opération(s) abandonnée(s)")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for op in self._pending.values():
+            _resolve(op, exc=RuntimeError("Planificateur de rôles arrêté"))
+        self._pending.clear()
+
+    @property
+    def running(self):
+        """Workers démarrés et vivants"""
+        return bool(self._tasks) and not all(task.done() for task in self._tasks)
+
+    @property
+    def pending(self):
+        """Nombre d'opérations en attente d'exécution"""
+        return len(self._pending)
+
+    # === API ===
+    def submit(self, member, role, action, reason=None):
+        """Ajoute une intention ; retourne un Future résolu avec APPLIED, SKIPPED ou SUPERSEDED"""
+        future = asyncio.get_running_loop().create_future()
+        key = (member.id, role.id)
+        op = self._pending.get(key)
+        if op is not None:
+            if op.action != action:
+                # Intention inverse : les appelants précédents ne doivent pas croire leur opération appliquée
+                self.stats["superseded"] += len(op.futures)
+                _resolve(op, result=SUPERSEDED)
+                op.futures = []
+                op.action = action
+                op.reason = reason
+            else:
+                op.reason = reason or op.reason
+                self.stats["coalesced"] += 1
+            op.member = member
+        else:
+            op = RoleOperation(member, role, action, reason)
+            self._pending[key] = op
+            # Si une opération est en cours pour ce membre, on attend sa fin pour enfiler
+            if key not in self._in_flight and self._queue is not None:
+                self._queue.put_nowait(key)
+        op.futures.append(future)
+        return future
+
+    # === WORKERS ===
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            op = self._pending.pop(key, None)
+            if op is None:
+                continue
+            self._in_flight.add(key)
+            try:
+                result = await self._execute(op)
+            except asyncio.CancelledError:
+                _resolve(op, exc=RuntimeError("Planificateur de rôles arrêté"))
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error(f"Échec {op.action} rôle {op.role} pour {op.member}: {e}")
+                _resolve(op, exc=e)
+            else:
+                _resolve(op, result=result)
+            finally:
+                self._in_flight.discard(key)
+                if key in self._pending:
+                    self._queue.put_nowait(key)
+
+    async def _execute(self, op):
+        has_role = op.role in op.member.roles
+        if (op.action == ADD) == has_role:
+            self.stats["skipped"] += 1
+            return SKIPPED
+
+        call = op.member.add_roles if op.action == ADD else op.member.remove_roles
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await call(op.role, reason=op.reason)
+                self.stats["applied"] += 1
+                return APPLIED
+            except (discord.Forbidden, discord.NotFound):
+                raise
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    self.stats["rate_limited"] += 1
+                    delay = getattr(e, "retry_after", None) or self._backoff(attempt)
+                    self.bucket.pause(delay)
+                elif e.status >= 500:
+                    delay = self._backoff(attempt)
+                else:
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+            attempt += 1
+            self.stats["retries"] += 1
+            logging.warning(f"Retry {attempt}/{self.max_retries} ({op.action} {op.role} pour {op.member}) "
+                            f"dans {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt):
+        delay = self.base_delay * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+
+
+def _resolve(op, result=None, exc=None):
+    for future in op.futures:
+        if future.done():
+            continue
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
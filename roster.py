@@ -0,0 +1,406 @@
+"""Chargement de la liste des matricules, modèle indexé en mémoire et snapshot compilé."""
+import hashlib
+import logging
+import os
+import pickle
+from collections import Counter, defaultdict
+
+import openpyxl
+
+from rules import normalize_text
+
+SNAPSHOT_VERSION = 5
+GRAM = 3  # Taille des n-grammes de l'index de recherche
+
+
+# === MODÈLE EN MÉMOIRE ===
+class Roster:
+    """Roster chargé une fois, stocké par colonnes, partagé par la validation et les commandes admin.
+
+    - columns[nom]      : valeurs brutes de la colonne (une entrée par ligne)
+    - normalized[nom]   : valeurs normalisées des colonnes lues par les règles / la recherche
+    - matricules        : matricule normalisé (chiffres uniquement) de chaque ligne
+    - roles / reason_codes / reasons : résultat des règles, calculé au chargement
+    - sources           : source (fichier, feuille) de chaque ligne
+    - eligible          : matricule -> rôles accordés (utilisé par la validation)
+    - conflicts         : désaccords entre sources (voir ingest.merge_rosters)
+
+    Une ligne sans rôle ni code de rejet vient d'une source de référence : elle
+    est indexée (recherche, provenance, conflits) mais n'accorde rien.
+
+    Index : lookup() exact sur le matricule, search() par sous-chaîne (trigrammes)
+    sur le matricule et les colonnes de recherche, fuzzy() distance d'édition <= 2.
+    """
+
+    def __init__(self, headers, matricule_col, search_cols=(), rule_cols=()):
+        self.headers = list(headers)
+        self.column_names = _unique_names(self.headers)
+        self.matricule_col = matricule_col
+        self.search_cols = list(search_cols)
+        self.columns = {name: [] for name in self.column_names}
+        self.normalized = {self.column_names[i]: [] for i in sorted(set(search_cols) | set(rule_cols))}
+        self.matricules = []
+        self.row_numbers = []  # Numéro de ligne Excel
+        self.roles = []
+        self.reason_codes = []
+        self.reasons = []
+        self.sources = []
+        self.source_columns = {}  # source -> colonnes de cette source (roster fusionné)
+        self.eligible = {}
+        self.conflicts = []
+        self._by_matricule = {}  # matricule -> [positions]
+        self._search_text = []  # Texte normalisé indexé, par position
+        self._grams = defaultdict(set)  # trigramme -> positions
+        self._matricule_grams = defaultdict(set)  # trigramme -> matricules
+
+    def __len__(self):
+        return len(self.row_numbers)
+
+    def add_row(self, row_number, row, matricule, roles, reason_code="", reason="", source=""):
+        """Ajoute une ligne (et le résultat des règles) puis met à jour les index"""
+        pos = len(self.row_numbers)
+        for i, name in enumerate(self.column_names):
+            self.columns[name].append(row[i] if i < len(row) else None)
+        for name, values in self.normalized.items():
+            value = self.columns[name][pos]
+            values.append(normalize_text(value) if value is not None else "")
+        self.matricules.append(matricule)
+        self.row_numbers.append(row_number)
+        self.roles.append(roles)
+        self.reason_codes.append(reason_code)
+        self.reasons.append(reason)
+        self.sources.append(source)
+        if roles:
+            # Un matricule présent sur plusieurs lignes cumule les rôles
+            self.eligible[matricule] = tuple(dict.fromkeys(self.eligible.get(matricule, ()) + roles))
+
+        self._by_matricule.setdefault(matricule, []).append(pos)
+        for gram in _grams(matricule):
+            self._matricule_grams[gram].add(matricule)
+
+        parts = [matricule]
+        for idx in self.search_cols:
+            parts.append(self.normalized[self.column_names[idx]][pos])
+        text = " | ".join(p for p in parts if p)
+        self._search_text.append(text)
+        for gram in _grams(text):
+            self._grams[gram].add(pos)
+
+    def extend(self, other, constants=None):
+        """Ajoute toutes les lignes d'un autre Roster (colonnes associées par nom).
+
+        Les index de `other` sont réutilisés avec un décalage de position, sans
+        re-normaliser les lignes. `constants` : colonne -> valeur pour toutes les lignes.
+        """
+        offset = len(self)
+        count = len(other)
+        constants = constants or {}
+        for name in self.column_names:
+            if name in constants:
+                self.columns[name].extend([constants[name]] * count)
+            else:
+                self.columns[name].extend(other.columns.get(name) or [None] * count)
+        for name, values in self.normalized.items():
+            if name in other.normalized:
+                values.extend(other.normalized[name])
+            else:
+                values.extend(normalize_text(v) if v is not None else "" for v in self.columns[name][offset:])
+        self.matricules.extend(other.matricules)
+        self.row_numbers.extend(other.row_numbers)
+        self.roles.extend(other.roles)
+        self.reason_codes.extend(other.reason_codes)
+        self.reasons.extend(other.reasons)
+        self.sources.extend(other.sources)
+        for matricule, roles in other.eligible.items():
+            self.eligible[matricule] = tuple(dict.fromkeys(self.eligible.get(matricule, ()) + roles))
+
+        for matricule, positions in other._by_matricule.items():
+            self._by_matricule.setdefault(matricule, []).extend(p + offset for p in positions)
+        for gram, found in other._matricule_grams.items():
+            self._matricule_grams[gram].update(found)
+        # Texte de recherche de la source (ses propres colonnes de recherche)
+        self._search_text.extend(other._search_text)
+        for gram, positions in other._grams.items():
+            self._grams[gram].update(p + offset for p in positions)
+
+    # === REQUÊTES ===
+    def lookup(self, matricule):
+        """Positions des lignes ayant exactement ce matricule"""
+        return list(self._by_matricule.get(normalize_matricule(matricule), ()))
+
+    def search(self, query, limit=50):
+        """Positions des lignes dont le matricule ou une colonne de recherche contient `query`"""
+        query = normalize_text(query)
+        if not query:
+            return []
+        if len(query) < GRAM:
+            candidates = range(len(self))
+        else:
+            postings = sorted((self._grams.get(g, set()) for g in set(_grams(query))), key=len)
+            if not postings or not postings[0]:
+                return []
+            candidates = sorted(set.intersection(*postings))
+        results = []
+        for pos in candidates:
+            if query in self._search_text[pos]:
+                results.append(pos)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def fuzzy(self, matricule, max_distance=2, limit=10):
+        """Matricules à distance d'édition <= max_distance ; retourne [(distance, matricule)]"""
+        matricule = normalize_matricule(matricule)
+        if not matricule:
+            return []
+        grams = set(_grams(matricule))
+        # Lemme des q-grammes : k éditions détruisent au plus k * GRAM trigrammes
+        threshold = max(1, len(grams) - max_distance * GRAM)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._matricule_grams.get(gram, ()))
+        results = []
+        for candidate, shared in counts.items():
+            if shared < threshold or abs(len(candidate) - len(matricule)) > max_distance:
+                continue
+            distance = edit_distance(matricule, candidate, max_distance)
+            if distance <= max_distance:
+                results.append((distance, candidate))
+        results.sort()
+        return results[:limit]
+
+    def row_fields(self, pos):
+        """[(en-tête, valeur)] pour une ligne (colonnes de sa source seulement)"""
+        names = self.source_columns.get(self.sources[pos], self.column_names)
+        return [(name, self.columns[name][pos]) for name in names]
+
+    def value(self, pos, name):
+        """Valeur brute d'une cellule, colonne désignée par son en-tête"""
+        return self.columns[self.column_name(name)][pos]
+
+    def column_name(self, name):
+        """Nom de colonne exact correspondant à `name` (insensible casse/accents)"""
+        if name in self.columns:
+            return name
+        wanted = normalize_text(name)
+        for candidate in self.column_names:
+            if normalize_text(candidate) == wanted:
+                return candidate
+        raise KeyError(name)
+
+    def find_columns(self, *words):
+        """Colonnes dont l'en-tête contient l'un des mots (insensible casse/accents)"""
+        words = [normalize_text(w) for w in words]
+        return [name for name in self.column_names if any(w in normalize_text(name) for w in words)]
+
+    def section_getter(self):
+        """Fonction position -> section ("Sect" du CMS, "Section" de la L3 : première valeur non vide)"""
+        columns = [self.columns[name] for name in self.find_columns("sect")]
+
+        def section(pos):
+            for values in columns:
+                value = values[pos]
+                if value not in (None, ""):
+                    return str(value)
+            return ""
+        return section
+
+    def is_valid(self, pos):
+        """La ligne accorde-t-elle au moins un rôle ?"""
+        return bool(self.roles[pos])
+
+    def is_reference(self, pos):
+        """La ligne vient-elle d'une source de référence (sans règles) ?"""
+        return not self.roles[pos] and not self.reason_codes[pos]
+
+    def invalid_positions(self):
+        """Positions des lignes rejetées par les règles"""
+        return [pos for pos, code in enumerate(self.reason_codes) if code]
+
+    def valid_count(self):
+        """Nombre de lignes qui accordent au moins un rôle"""
+        return sum(1 for roles in self.roles if roles)
+
+    def reference_count(self):
+        """Nombre de lignes des sources de référence (ni valides ni rejetées)"""
+        return sum(1 for pos in range(len(self)) if self.is_reference(pos))
+
+    def reason_counts(self):
+        """Nombre de lignes rejetées par code de rejet"""
+        return Counter(code for code in self.reason_codes if code)
+
+
+def _unique_names(headers):
+    """En-têtes utilisables comme clés : ColN pour les vides, suffixe pour les doublons"""
+    names = []
+    seen = set()
+    for i, header in enumerate(headers):
+        name = str(header).strip() if header not in (None, "") else f"Col{i + 1}"
+        base, n = name, 2
+        while name in seen:
+            name = f"{base} ({n})"
+            n += 1
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _grams(text):
+    return [text[i:i + GRAM] for i in range(len(text) - GRAM + 1)]
+
+
+def edit_distance(a, b, max_distance):
+    """Distance de Levenshtein, arrêtée dès qu'elle dépasse max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+# === SIGNATURE DU FICHIER SOURCE ===
+def file_signature(path):
+    """Retourne (taille, mtime_ns) du fichier"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def file_hash(path):
+    """SHA-256 du contenu du fichier, lu par blocs"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# === SNAPSHOT ===
+def load_snapshot(snapshot_path, source_path, rules_fingerprint):
+    """Charge le snapshot s'il correspond encore au fichier source et aux règles, sinon None"""
+    try:
+        with open(snapshot_path, "rb") as f:
+            snap = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Snapshot illisible ({snapshot_path}): {e}")
+        return None
+
+    if not isinstance(snap, dict) or snap.get("version") != SNAPSHOT_VERSION:
+        return None
+    if snap.get("rules") != rules_fingerprint:
+        return None
+
+    size, mtime_ns = file_signature(source_path)
+    if snap["size"] == size and snap["mtime_ns"] == mtime_ns:
+        return snap
+
+    # mtime modifié (copie, checkout git...) : on compare le contenu
+    if snap["size"] == size and snap["sha256"] == file_hash(source_path):
+        snap["mtime_ns"] = mtime_ns
+        _write_snapshot(snapshot_path, snap)
+        return snap
+
+    return None
+
+
+def save_snapshot(snapshot_path, source_path, rules_fingerprint, data):
+    """Écrit le snapshot compilé (roster et ses index) de façon atomique"""
+    size, mtime_ns = file_signature(source_path)
+    snap = {
+        "version": SNAPSHOT_VERSION,
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "sha256": file_hash(source_path),
+        "rules": rules_fingerprint,
+        "roster": data,
+    }
+    _write_snapshot(snapshot_path, snap)
+
+
+def _write_snapshot(snapshot_path, snap):
+    tmp_path = snapshot_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snap, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except Exception as e:
+        logging.warning(f"Impossible d'écrire le snapshot ({snapshot_path}): {e}")
+
+
+# === PARSING EXCEL ===
+def normalize_matricule(raw):
+    """Convertit une cellule Excel en matricule (chiffres uniquement)"""
+    if raw is None:
+        return ""
+    if isinstance(raw, (int, float)):
+        # Si c'est un float (212231455913.0), convertir en int puis string
+        return str(int(raw))
+    return ''.join(filter(str.isdigit, str(raw).strip()))
+
+
+def parse_roster(path, ruleset, sheet=None, header_row=1, source=""):
+    """Lit le fichier Excel en mode streaming, évalue les règles et indexe en une seule passe.
+
+    `sheet` : nom de la feuille (feuille active par défaut) ; `header_row` : ligne des
+    en-têtes, les lignes au-dessus (titres, logos...) sont ignorées.
+    """
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet else wb.active
+        return build_roster(ws.iter_rows(min_row=header_row, values_only=True), ruleset, header_row, source)
+    finally:
+        wb.close()
+
+
+def build_roster(rows, ruleset, header_row=1, source=""):
+    """Construit le Roster depuis un itérable de lignes dont la première contient les en-têtes"""
+    rows = iter(rows)
+    headers = list(next(rows, ()))
+    logging.info(f"En-têtes: {headers}")
+    compiled = ruleset.compile(headers)
+    logging.info(f"Colonne matricule: {compiled.matricule_col}, rôles: {compiled.role_names}")
+
+    data = Roster(headers, compiled.matricule_col, compiled.search_cols, compiled.columns)
+
+    for row_idx, row in enumerate(rows, start=header_row + 1):
+        try:
+            if compiled.matricule_col >= len(row):
+                continue
+            matricule = normalize_matricule(row[compiled.matricule_col])
+            if not matricule:
+                continue
+
+            roles, code, reason = compiled.evaluate(row)
+            data.add_row(row_idx, row, matricule, roles, code, reason, source)
+
+        except Exception as e:
+            logging.warning(f"Erreur ligne {row_idx}: {e}")
+            continue
+
+    rejected = data.reason_counts()
+    if rejected:
+        # Comptes par code seulement : matricules et contenu des cellules restent hors des logs
+        summary = ", ".join(f"{code}: {count}" for code, count in rejected.most_common())
+        logging.info(f"Rejets par code: {summary}")
+
+    return data
+
+
+def load_roster_cached(path, snapshot_path, ruleset):
+    """Retourne le Roster depuis le snapshot, ou re-parse l'Excel s'il (ou les règles) a changé"""
+    snap = load_snapshot(snapshot_path, path, ruleset.fingerprint)
+    if snap is not None:
+        logging.info(f"⚡ Snapshot utilisé: {len(snap['roster'])} lignes ({snapshot_path})")
+        return snap["roster"]
+
+    logging.info(f"Fichier {path} ou règles modifiés (ou snapshot absent), parsing...")
+    data = parse_roster(path, ruleset)
+    save_snapshot(snapshot_path, path, ruleset.fingerprint, data)
+    return data
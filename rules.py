@@ -0,0 +1,223 @@
+"""Règles d'éligibilité configurables : colonnes résolues par en-tête, prédicats compilés, rôles.
+
+Exemple de fichier (rules.json) :
+
+    {
+        "matricule_column": "Matricule",
+        "roles": [
+            {
+                "role": "ACAD B",
+                "all": [
+                    {"column": "Affectation", "contains": "programmation web", "normalize": true},
+                    {"column": "Section Prog. Web", "equals": "B"}
+                ]
+            }
+        ]
+    }
+
+Prédicats : "contains", "equals", "regex". Options : "normalize" (insensible aux
+accents), "ignore_case" (vrai par défaut), "not" (inverse le résultat). Une
+règle peut combiner "all" (toutes vraies) et "any" (au moins une vraie).
+"search_columns" liste les colonnes indexées pour !find en plus du matricule.
+"""
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+
+PREDICATES = ("contains", "equals", "regex")
+
+
+class RulesError(ValueError):
+    """Fichier de règles invalide ou colonne introuvable"""
+
+
+def strip_accents(value):
+    """Texte sans accents (décomposition NFKD, marques combinantes retirées)"""
+    value = unicodedata.normalize("NFKD", str(value))
+    return "".join(c for c in value if not unicodedata.combining(c))
+
+
+def normalize_text(value):
+    """Minuscules, sans accents, espaces regroupés"""
+    return " ".join(strip_accents(value).casefold().split())
+
+
+def resolve_column(headers, name):
+    """Index de la colonne dont l'en-tête correspond à `name` (insensible casse/accents)"""
+    wanted = normalize_text(name)
+    for idx, header in enumerate(headers):
+        if header is not None and normalize_text(header) == wanted:
+            return idx
+    raise RulesError(f"Colonne introuvable: '{name}' (en-têtes: {headers})")
+
+
+def _cell(row, idx):
+    value = row[idx] if idx < len(row) else None
+    return "" if value is None else str(value).strip()
+
+
+def _compile_condition(cond, headers):
+    """Compile une condition en fonction row -> None si vraie, sinon (code, raison)"""
+    predicates = [p for p in PREDICATES if p in cond]
+    if "column" not in cond or len(predicates) != 1:
+        raise RulesError(f"Condition invalide: {cond}")
+
+    column = cond["column"]
+    idx = resolve_column(headers, column)
+    predicate = predicates[0]
+    expected = cond[predicate]
+    negate = bool(cond.get("not", False))
+
+    if cond.get("normalize", False):
+        prepare = normalize_text
+    elif cond.get("ignore_case", True):
+        def prepare(v):
+            return v.casefold()
+    else:
+        prepare = str
+
+    if predicate == "contains":
+        needle = prepare(expected)
+
+        def test(v):
+            return needle in v
+    elif predicate == "equals":
+        target = prepare(expected)
+
+        def test(v):
+            return v == target
+    else:
+        if cond.get("normalize", False):
+            # Le texte testé est normalisé : le motif aussi (accents retirés), sans casse.
+            # normalize_text() complet casserait le motif (\S -> \s, espaces regroupés)
+            source = strip_accents(expected)
+            flags = re.IGNORECASE
+        else:
+            source = expected
+            flags = re.IGNORECASE if cond.get("ignore_case", True) else 0
+        try:
+            pattern = re.compile(source, flags)
+        except re.error as e:
+            raise RulesError(f"Expression régulière invalide pour '{column}': {e}") from e
+
+        def test(v):
+            return pattern.search(v) is not None
+
+    label = f"{'not ' if negate else ''}{predicate} '{expected}'"
+
+    def check(row):
+        raw = _cell(row, idx)
+        if test(prepare(raw)) != negate:
+            return None
+        code = f"{'vide' if not raw else 'critere'}:{column}"
+        return code, f"{column}: '{raw[:50]}' ({label})"
+
+    check.column = idx
+    return check
+
+
+class CompiledRule:
+    """Règle compilée pour un rôle"""
+
+    def __init__(self, role, all_checks, any_checks):
+        self.role = role
+        self.all_checks = all_checks
+        self.any_checks = any_checks
+
+    @property
+    def columns(self):
+        return {check.column for check in self.all_checks + self.any_checks}
+
+    def match(self, row):
+        """Retourne None si la règle est satisfaite, sinon (code, raison) du premier échec"""
+        for check in self.all_checks:
+            failure = check(row)
+            if failure:
+                return failure
+        if self.any_checks:
+            failures = []
+            for check in self.any_checks:
+                failure = check(row)
+                if not failure:
+                    return None
+                failures.append(failure)
+            return failures[0][0], " / ".join(reason for _, reason in failures)
+        return None
+
+
+class CompiledRules:
+    """Ensemble de règles compilées pour une liste d'en-têtes donnée"""
+
+    def __init__(self, matricule_col, rules, search_cols=()):
+        self.matricule_col = matricule_col
+        self.rules = rules
+        self.search_cols = list(search_cols)
+
+    @property
+    def role_names(self):
+        return [rule.role for rule in self.rules]
+
+    @property
+    def columns(self):
+        """Index des colonnes lues par les règles"""
+        return sorted(set().union(*(rule.columns for rule in self.rules)))
+
+    def evaluate(self, row):
+        """Retourne (rôles accordés, code de rejet, raison) ; code et raison vides si accepté"""
+        roles = []
+        first_failure = None
+        for rule in self.rules:
+            failure = rule.match(row)
+            if failure is None:
+                roles.append(rule.role)
+            elif first_failure is None:
+                first_failure = failure
+        if roles or first_failure is None:
+            return tuple(roles), "", ""
+        return (), first_failure[0], first_failure[1]
+
+
+class RuleSet:
+    """Règles chargées depuis le fichier de configuration, à compiler contre les en-têtes"""
+
+    def __init__(self, config):
+        if not isinstance(config, dict) or not config.get("roles"):
+            raise RulesError("Le fichier de règles doit définir au moins un rôle")
+        self.config = config
+        self.matricule_column = config.get("matricule_column", "Matricule")
+        self.search_columns = config.get("search_columns", [])
+        self.fingerprint = hashlib.sha256(
+            json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    @property
+    def role_names(self):
+        return [entry["role"] for entry in self.config["roles"]]
+
+    def compile(self, headers):
+        """Résout les colonnes et compile les prédicats (une seule fois par chargement)"""
+        rules = []
+        for entry in self.config["roles"]:
+            if "role" not in entry:
+                raise RulesError(f"Règle sans rôle: {entry}")
+            all_checks = [_compile_condition(c, headers) for c in entry.get("all", [])]
+            any_checks = [_compile_condition(c, headers) for c in entry.get("any", [])]
+            rules.append(CompiledRule(entry["role"], all_checks, any_checks))
+        search_cols = []
+        for name in self.search_columns:
+            try:
+                search_cols.append(resolve_column(headers, name))
+            except RulesError:
+                logging.warning(f"Colonne de recherche ignorée (introuvable): '{name}'")
+        return CompiledRules(resolve_column(headers, self.matricule_column), rules, search_cols)
+
+
+def load_rules(path):
+    """Charge le fichier de règles JSON"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return RuleSet(json.load(f))
+    except json.JSONDecodeError as e:
+        raise RulesError(f"JSON invalide dans {path}: {e}") from e
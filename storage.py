@@ -0,0 +1,437 @@
+"""Backend SQLite optionnel (mode WAL) : claims, historique d'audit et copie des rosters.
+
+Activé par STORAGE_BACKEND=sqlite. Les claims restent indexés en mémoire
+(chemin chaud de la validation) ; SQLite remplace le snapshot JSON et son
+journal comme stockage durable, et sert les requêtes transverses (!stats) :
+
+    claims par section sur la dernière heure, éligibles jamais réclamés...
+
+Accès :
+- une seule connexion d'écriture, sur son propre thread (transaction par lot)
+- un pool de connexions de lecture (WAL : lectures concurrentes des écritures)
+- méthodes async pour la boucle, versions synchrones pour le thread I/O des claims
+
+Migration unique depuis claimed.json (+ journal et historique) et le roster :
+
+    python storage.py migrate --db disbot.db
+
+ou automatiquement au premier chargement d'un espace de claims.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from claims import ClaimIndex, ClaimsStore
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS claims (
+    namespace TEXT NOT NULL,
+    matricule TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    claimed_at REAL,
+    PRIMARY KEY (namespace, matricule)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS claims_user ON claims (namespace, user_id);
+CREATE INDEX IF NOT EXISTS claims_time ON claims (namespace, claimed_at);
+CREATE TABLE IF NOT EXISTS claim_events (
+    id INTEGER PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    op TEXT NOT NULL,
+    matricule TEXT NOT NULL,
+    user_id TEXT,
+    from_user TEXT,
+    actor TEXT,
+    reason TEXT,
+    ts REAL
+);
+CREATE INDEX IF NOT EXISTS events_matricule ON claim_events (namespace, matricule, ts);
+CREATE INDEX IF NOT EXISTS events_user ON claim_events (namespace, user_id, ts);
+CREATE INDEX IF NOT EXISTS events_from ON claim_events (namespace, from_user, ts);
+CREATE INDEX IF NOT EXISTS events_actor ON claim_events (namespace, actor, ts);
+CREATE INDEX IF NOT EXISTS events_time ON claim_events (ts);
+CREATE TABLE IF NOT EXISTS roster_rows (
+    guild_id INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    matricule TEXT NOT NULL,
+    source TEXT,
+    row_number INTEGER,
+    section TEXT,
+    status TEXT,
+    reason_code TEXT,
+    reason TEXT,
+    roles TEXT,
+    PRIMARY KEY (guild_id, pos)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS roster_matricule ON roster_rows (guild_id, matricule);
+CREATE INDEX IF NOT EXISTS roster_section ON roster_rows (guild_id, section);
+CREATE TABLE IF NOT EXISTS eligible (
+    guild_id INTEGER NOT NULL,
+    matricule TEXT NOT NULL,
+    roles TEXT,
+    section TEXT,
+    PRIMARY KEY (guild_id, matricule)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS eligible_section ON eligible (guild_id, section);
+"""
+
+
+class Repository:
+    """Accès SQLite : un thread d'écriture (connexion unique), un pool de lecteurs"""
+
+    def __init__(self, path, readers=2):
+        self.path = path
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._write_conn = None
+        self._local = threading.local()
+        self._reader_conns = []
+        self._readers_lock = threading.Lock()
+        # Le schéma existe avant qu'un lecteur ne s'ouvre
+        self._writer.submit(self._open_writer).result()
+        self._readers = concurrent.futures.ThreadPoolExecutor(max_workers=readers, thread_name_prefix="sqlite-reader")
+
+    # === CONNEXIONS ===
+    def _open_writer(self):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # Durable au checkpoint, sans fsync par transaction
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        self._write_conn = conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._readers_lock:
+                self._reader_conns.append(conn)
+        return conn
+
+    def _transaction(self, fn, args):
+        conn = self._write_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _query(self, sql, params):
+        return self._reader().execute(sql, params).fetchall()
+
+    # === API SYNCHRONE (threads I/O) ===
+    def write(self, fn, *args):
+        """Exécute fn(connexion, *args) dans une transaction sur le thread d'écriture et attend le résultat"""
+        return self._writer.submit(self._transaction, fn, args).result()
+
+    def query(self, sql, params=()):
+        """Lignes d'une requête, sur un lecteur du pool"""
+        return self._readers.submit(self._query, sql, params).result()
+
+    # === API ASYNC (boucle) ===
+    async def fetchall(self, sql, params=()):
+        return await asyncio.wrap_future(self._readers.submit(self._query, sql, params))
+
+    def close(self):
+        self._readers.shutdown(wait=True)
+        with self._readers_lock:
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns.clear()
+
+        def close_writer():
+            # Checkpoint final : le fichier .db est complet sans le -wal
+            self._write_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._write_conn.close()
+        self._writer.submit(close_writer).result()
+        self._writer.shutdown(wait=True)
+
+    # === META ===
+    def get_meta(self, key):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    @staticmethod
+    def _set_meta(conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # === CLAIMS ===
+    def load_claims(self, namespace):
+        """Index des claims d'un espace de noms"""
+        index = ClaimIndex()
+        for matricule, user_id, claimed_at in self.query(
+                "SELECT matricule, user_id, claimed_at FROM claims WHERE namespace = ?", (namespace,)):
+            index.set(matricule, user_id, claimed_at)
+        return index
+
+    def write_claim_records(self, namespace, records):
+        """Applique un lot d'entrées du journal (état + historique) en une transaction"""
+        self.write(_apply_claim_records, namespace, records)
+
+    def claim_history(self, namespace, matricule=None, user_id=None, limit=10):
+        """Dernières entrées d'audit d'un matricule ou d'un membre, dans l'ordre chronologique"""
+        columns = "op, matricule, user_id, from_user, actor, reason, ts"
+        if matricule is not None:
+            rows = self.query(f"SELECT {columns} FROM claim_events WHERE namespace = ? AND matricule = ? "
+                              f"ORDER BY id DESC LIMIT ?", (namespace, matricule, limit))
+        else:
+            rows = self.query(
+                f"SELECT {columns} FROM claim_events WHERE id IN ("
+                f"SELECT id FROM claim_events WHERE namespace = ? AND user_id = ? UNION "
+                f"SELECT id FROM claim_events WHERE namespace = ? AND from_user = ? UNION "
+                f"SELECT id FROM claim_events WHERE namespace = ? AND actor = ?) ORDER BY id DESC LIMIT ?",
+                (namespace, user_id, namespace, user_id, namespace, user_id, limit))
+        return [_event_record(row) for row in reversed(rows)]
+
+    def import_claims(self, namespace, store, force=False):
+        """Migration d'un ClaimsStore JSON chargé (claims + historique d'audit).
+
+        Un espace déjà migré est ignoré (None) sauf `force`. L'import ne supprime
+        rien : un claim de la base plus récent que les fichiers sources est conservé,
+        et les entrées d'historique déjà présentes (matricule, date, opération) ne
+        sont pas dupliquées. Retourne (claims importés, entrées importées).
+        """
+        if not force and self.get_meta(f"migrated:{namespace}") is not None:
+            return None
+        events = []
+        if os.path.exists(store.audit_path):
+            with open(store.audit_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        # Date des fichiers sources : référence des claims sans date (ancien format)
+        source_mtime = max((os.path.getmtime(path) for path in
+                            (store.snapshot_path, store.journal_path, store.journal_path + ".old", store.audit_path)
+                            if os.path.exists(path)), default=0.0)
+
+        def run(conn):
+            claims = 0
+            for matricule, user_id in store.claims.items():
+                ts = store.claimed_at(matricule)
+                reference = ts if ts is not None else source_mtime
+                latest = conn.execute(
+                    "SELECT MAX(ts) FROM claim_events WHERE namespace = ? AND matricule = ?",
+                    (namespace, matricule)).fetchone()[0]
+                if latest is not None and latest > reference:
+                    continue  # Modifié dans la base après les fichiers (claim, libération, transfert)
+                existing = conn.execute("SELECT claimed_at FROM claims WHERE namespace = ? AND matricule = ?",
+                                        (namespace, matricule)).fetchone()
+                if existing is not None and (existing[0] or 0) > reference:
+                    continue
+                conn.execute("INSERT OR REPLACE INTO claims (namespace, matricule, user_id, claimed_at) "
+                             "VALUES (?, ?, ?, ?)", (namespace, matricule, user_id, ts))
+                claims += 1
+            imported = 0
+            for record in events:
+                if conn.execute("SELECT 1 FROM claim_events WHERE namespace = ? AND matricule = ? AND ts IS ? "
+                                "AND op = ?", (namespace, record.get("matricule"), record.get("ts"),
+                                               record.get("op"))).fetchone():
+                    continue
+                conn.execute(_INSERT_EVENT, _event_row(namespace, record))
+                imported += 1
+            self._set_meta(conn, f"migrated:{namespace}", store.snapshot_path)
+            return claims, imported
+        return self.write(run)
+
+    # === ROSTERS ===
+    def roster_signature(self, guild_id):
+        return self.get_meta(f"roster:{guild_id}")
+
+    def sync_roster(self, guild_id, data, signature):
+        """Copie le roster s'il a changé depuis la dernière copie ; retourne le nombre de lignes (None si inchangé)"""
+        if self.roster_signature(guild_id) == signature:
+            return None
+        return self.save_roster(guild_id, data, signature)
+
+    def save_roster(self, guild_id, data, signature):
+        """Remplace la copie du roster d'un serveur (lignes et éligibles) en une transaction"""
+        section = data.section_getter()
+        rows = []
+        for pos in range(len(data)):
+            if data.is_valid(pos):
+                status = "valid"
+            elif data.is_reference(pos):
+                status = "reference"
+            else:
+                status = "invalid"
+            rows.append((guild_id, pos, data.matricules[pos], data.sources[pos], data.row_numbers[pos],
+                         section(pos), status, data.reason_codes[pos], data.reasons[pos],
+                         ", ".join(data.roles[pos])))
+        eligible = []
+        for matricule, roles in data.eligible.items():
+            pos = next(p for p in data.lookup(matricule) if data.is_valid(p))
+            eligible.append((guild_id, matricule, ", ".join(roles), section(pos)))
+
+        def run(conn):
+            conn.execute("DELETE FROM roster_rows WHERE guild_id = ?", (guild_id,))
+            conn.execute("DELETE FROM eligible WHERE guild_id = ?", (guild_id,))
+            conn.executemany("INSERT INTO roster_rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO eligible VALUES (?, ?, ?, ?)", eligible)
+            self._set_meta(conn, f"roster:{guild_id}", signature)
+        self.write(run)
+        return len(rows)
+
+    # === ANALYTIQUE (requêtes indexées) ===
+    async def claims_per_section(self, guild_id, namespace, since):
+        """[(section, claims depuis `since`)] ; section vide si le matricule n'est plus éligible"""
+        return await self.fetchall(
+            "SELECT COALESCE(e.section, ''), COUNT(*) FROM claims c "
+            "LEFT JOIN eligible e ON e.guild_id = ? AND e.matricule = c.matricule "
+            "WHERE c.namespace = ? AND c.claimed_at >= ? GROUP BY 1 ORDER BY 2 DESC",
+            (guild_id, namespace, since))
+
+    async def unclaimed_per_section(self, guild_id, namespace):
+        """[(section, éligibles jamais réclamés)]"""
+        return await self.fetchall(
+            "SELECT e.section, COUNT(*) FROM eligible e WHERE e.guild_id = ? AND NOT EXISTS ("
+            "SELECT 1 FROM claims c WHERE c.namespace = ? AND c.matricule = e.matricule) "
+            "GROUP BY 1 ORDER BY 2 DESC",
+            (guild_id, namespace))
+
+    async def event_counts(self, namespace, since):
+        """{op: nombre} des entrées d'audit depuis `since`"""
+        rows = await self.fetchall(
+            "SELECT op, COUNT(*) FROM claim_events WHERE namespace = ? AND ts >= ? GROUP BY op",
+            (namespace, since))
+        return dict(rows)
+
+
+_INSERT_EVENT = ("INSERT INTO claim_events (namespace, op, matricule, user_id, from_user, actor, reason, ts) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def _event_row(namespace, record):
+    return (namespace, record.get("op"), record.get("matricule"), record.get("user_id"), record.get("from"),
+            record.get("by"), record.get("reason"), record.get("ts"))
+
+
+def _event_record(row):
+    """Ligne de claim_events -> entrée au format du journal (voir claims.ClaimsStore)"""
+    op, matricule, user_id, from_user, actor, reason, ts = row
+    record = {"op": op, "matricule": matricule, "user_id": user_id, "ts": ts}
+    for key, value in (("from", from_user), ("by", actor), ("reason", reason)):
+        if value is not None:
+            record[key] = value
+    return record
+
+
+def _apply_claim_records(conn, namespace, records):
+    for record in records:
+        if record["op"] == "claim":
+            conn.execute("INSERT OR REPLACE INTO claims (namespace, matricule, user_id, claimed_at) "
+                         "VALUES (?, ?, ?, ?)",
+                         (namespace, record["matricule"], record["user_id"], record.get("ts")))
+        elif record["op"] == "unclaim":
+            conn.execute("DELETE FROM claims WHERE namespace = ? AND matricule = ?",
+                         (namespace, record["matricule"]))
+    conn.executemany(_INSERT_EVENT, [_event_row(namespace, record) for record in records])
+
+
+# === CLAIMS SUR SQLITE ===
+class SqliteClaimsStore(ClaimsStore):
+    """ClaimsStore dont le stockage durable est SQLite (même index en mémoire, même file d'écriture).
+
+    `legacy_path` : claimed(.<espace>).json, importé au premier chargement s'il existe.
+    """
+
+    def __init__(self, repository, namespace, legacy_path, writer=None):
+        super().__init__(legacy_path, writer=writer)
+        self.repository = repository
+        self.namespace = namespace
+
+    def load(self):
+        """Relit les claims de l'espace ; migre le JSON une seule fois si l'espace n'a jamais été importé"""
+        if self.repository.get_meta(f"migrated:{self.namespace}") is None:
+            legacy = ClaimsStore(self.snapshot_path, audit_path=self.audit_path)
+            legacy.load()
+            result = self.repository.import_claims(self.namespace, legacy)
+            if result is not None:
+                logging.info(f"📦 Claims '{self.namespace}' migrés vers SQLite: {result[0]} claim(s), "
+                             f"{result[1]} entrée(s) d'historique")
+        with self._lock:
+            self.index.replace(self.repository.load_claims(self.namespace))
+        return self.claims
+
+    def write_records(self, records):
+        try:
+            self.repository.write_claim_records(self.namespace, records)
+        except Exception as e:
+            logging.error(f"Erreur lors de l'écriture des claims (SQLite): {e}")
+
+    def history(self, matricule=None, user_id=None, limit=10):
+        return self.repository.claim_history(self.namespace, matricule,
+                                             str(user_id) if user_id is not None else None, limit)
+
+    def compact(self):
+        # Pas de journal : SQLite fait ses propres checkpoints WAL
+        return False
+
+    def close(self):
+        pass
+
+
+# === MIGRATION ===
+def migrate(db_path, guilds_file="guilds.json", claims_file="claimed.json", rosters=True, force=False):
+    """Importe les claims JSON de chaque espace de noms (une seule fois, sauf `force`) et les rosters"""
+    import guilds
+    import ingest
+
+    configs = guilds.load_guild_configs(guilds_file)
+    registry = guilds.ClaimsRegistry(claims_file)
+    repository = Repository(db_path)
+    try:
+        for name in sorted({config.claims_namespace for config in configs.values()}):
+            store = ClaimsStore(registry.path_for(name))
+            store.load()
+            result = repository.import_claims(name, store, force=force)
+            if result is None:
+                print(f"claims '{name}': déjà migré, ignoré (--force pour réimporter)")
+                continue
+            count, events = result
+            print(f"claims '{name}': {count} claim(s), {events} entrée(s) d'historique")
+        if rosters:
+            for guild_id, config in configs.items():
+                data, _ = ingest.load_sources(config.sources, merged_snapshot=config.merged_snapshot)
+                rows = repository.save_roster(guild_id, data, json.dumps(config.source_signature()))
+                print(f"roster {guild_id}: {rows} ligne(s), {len(data.eligible)} éligible(s)")
+    finally:
+        repository.close()
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Backend SQLite du bot (migration depuis les fichiers JSON/Excel)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = sub.add_parser("migrate", help="Importe claimed.json (+ journal, historique) et les rosters")
+    migrate_parser.add_argument("--db", default="disbot.db")
+    migrate_parser.add_argument("--guilds", default="guilds.json")
+    migrate_parser.add_argument("--claims", default="claimed.json")
+    migrate_parser.add_argument("--no-rosters", action="store_true", help="Claims seulement")
+    migrate_parser.add_argument("--force", action="store_true",
+                                help="Réimporte les espaces déjà migrés (sans supprimer les claims plus récents)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    start = time.perf_counter()
+    migrate(args.db, args.guilds, args.claims, rosters=not args.no_rosters, force=args.force)
+    print(f"Migration terminée en {time.perf_counter() - start:.1f}s -> {args.db}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules du bot à la racine du dépôt (pas de package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,147 @@
+"""ClaimsStore : rejeu du journal, compaction interrompue, lignes tronquées."""
+import json
+import os
+
+import pytest
+
+import claims
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "claimed.json"), str(tmp_path / "claimed.json.journal")
+
+
+def reopen(snapshot_path):
+    store = claims.ClaimsStore(snapshot_path)
+    store.load()
+    return store
+
+
+def journal_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_replay_restores_claims(paths):
+    store = claims.ClaimsStore(paths[0])
+    store.claim("1001", 1)
+    store.claim("1002", 2)
+    store.close()
+
+    reloaded = reopen(paths[0])
+    assert reloaded.claims == {"1001": "1", "1002": "2"}
+    assert reloaded.matricules_of(2) == ["1002"]
+
+
+def test_crash_between_snapshot_and_journal_truncation(paths, monkeypatch):
+    store = claims.ClaimsStore(paths[0])
+    store.claim("1001", 1)
+    store.claim("1002", 2)
+    store.unclaim("1002")
+
+    class Crash(Exception):
+        pass
+
+    real_remove = os.remove
+
+    def crash_on_old_journal(path):
+        if path.endswith(".old"):
+            raise Crash(path)
+        real_remove(path)
+
+    # Snapshot écrit et renommé, mais l'ancien journal n'est pas supprimé
+    monkeypatch.setattr(claims.os, "remove", crash_on_old_journal)
+    with pytest.raises(Crash):
+        store.compact()
+    monkeypatch.undo()
+    assert os.path.exists(paths[1] + ".old")
+
+    # Entrées écrites après la bascule : nouveau journal, rejoué après l'ancien
+    store.claim("1003", 3)
+    store.close()
+
+    reloaded = reopen(paths[0])
+    assert reloaded.claims == {"1001": "1", "1003": "3"}
+
+    # La compaction suivante termine le travail
+    assert reloaded.compact()
+    assert not os.path.exists(paths[1] + ".old")
+    assert reopen(paths[0]).claims == {"1001": "1", "1003": "3"}
+
+
+def test_crash_before_snapshot_rename_keeps_old_journal(paths, monkeypatch):
+    store = claims.ClaimsStore(paths[0])
+    store.claim("1001", 1)
+
+    def fail_replace(src, dst):
+        raise OSError("disque plein")
+
+    # os.replace sert aussi à basculer le journal : on ne fait échouer que le snapshot
+    real_replace = os.replace
+    monkeypatch.setattr(claims.os, "replace",
+                        lambda src, dst: fail_replace(src, dst) if src.endswith(".tmp") else real_replace(src, dst))
+    assert not store.compact()
+    monkeypatch.undo()
+    store.claim("1002", 2)
+    store.close()
+
+    assert reopen(paths[0]).claims == {"1001": "1", "1002": "2"}
+
+
+def test_batch_keeps_latest_record_per_matricule(paths):
+    store = claims.ClaimsStore(paths[0])
+    records = [
+        {"op": "claim", "matricule": "1001", "user_id": "1", "ts": 1.0},
+        {"op": "claim", "matricule": "1002", "user_id": "2", "ts": 2.0},
+        {"op": "unclaim", "matricule": "1001", "user_id": "1", "ts": 3.0},
+        {"op": "claim", "matricule": "1001", "user_id": "3", "ts": 4.0},
+    ]
+    store.write_records(records)
+    store.close()
+
+    lines = journal_lines(paths[1])
+    assert [(r["matricule"], r["op"], r["user_id"]) for r in lines] == [("1002", "claim", "2"),
+                                                                       ("1001", "claim", "3")]
+    # L'historique garde toutes les entrées
+    assert len(store.history(matricule="1001")) == 3
+
+    reloaded = reopen(paths[0])
+    assert reloaded.claims == {"1001": "3", "1002": "2"}
+    assert reloaded.claimed_at("1001") == 4.0
+
+
+def test_release_then_reclaim(paths):
+    store = claims.ClaimsStore(paths[0])
+    store.claim("1001", 1)
+    assert store.unclaim("1001") == "1"
+    assert store.unclaim("1001") is None
+    assert store.claim("1001", 2) is None
+    store.close()
+
+    reloaded = reopen(paths[0])
+    assert reloaded.claims == {"1001": "2"}
+    assert reloaded.matricules_of(1) == []
+    assert reloaded.matricules_of(2) == ["1001"]
+
+    assert reloaded.compact()
+    reloaded.close()
+    assert reopen(paths[0]).claims == {"1001": "2"}
+
+
+def test_torn_final_journal_line(paths):
+    store = claims.ClaimsStore(paths[0])
+    store.claim("1001", 1)
+    store.claim("1002", 2)
+    store.close()
+    with open(paths[1], "a", encoding="utf-8") as f:
+        f.write('{"op": "claim", "matricule": "1003", "us')
+
+    reloaded = reopen(paths[0])
+    assert reloaded.claims == {"1001": "1", "1002": "2"}
+
+    # L'entrée suivante ne doit pas se coller au fragment tronqué
+    reloaded.claim("1004", 4)
+    reloaded.close()
+    assert reopen(paths[0]).claims == {"1001": "1", "1002": "2", "1004": "4"}
+    assert len(journal_lines(paths[1])) == 3
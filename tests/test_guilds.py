@@ -0,0 +1,90 @@
+"""GuildState : rechargement du roster seulement quand les fichiers changent, pas en boucle sur un échec."""
+import os
+import shutil
+
+import pytest
+
+import guilds
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GOOD = ("Matricule;Nom et Prénom;Affectation;Section Prog. Web\n"
+        "212231455913;BOUCENNA Khaled;Programmation web - Introduction à l'IA;B\n")
+BROKEN = "Nom;Prénom\nBOUCENNA;Khaled\n"  # Pas de colonne Matricule : chargement en échec
+
+
+@pytest.fixture
+def state(tmp_path):
+    shutil.copy(os.path.join(ROOT, "rules.json"), tmp_path)
+    path = tmp_path / "roster.csv"
+    path.write_text(BROKEN, encoding="utf-8")
+    config = guilds.GuildConfig(1, sources=[{"path": str(path)}], rules_file=str(tmp_path / "rules.json"))
+    return guilds.GuildState(config, claims=None)
+
+
+def load(state):
+    """Chargement comme reload_roster : échec mémorisé avec la signature des fichiers"""
+    signature = state.source_signature()
+    data = state.load_roster()
+    if data is None or not data.eligible:
+        state.record_failure(signature)
+        return None
+    state.roster, state.signature, state.load_failed = data, signature, False
+    return data
+
+
+def source_path(state):
+    return state.config.sources[0].path
+
+
+def test_failed_load_is_not_retried_until_files_change(state):
+    assert state.needs_reload(state.source_signature())
+    assert load(state) is None
+    assert state.failed_on(state.source_signature())
+    assert not state.needs_reload(state.source_signature())
+
+    # Contenu corrigé : taille différente
+    with open(source_path(state), "w", encoding="utf-8") as f:
+        f.write(GOOD)
+    assert state.needs_reload(state.source_signature())
+    assert load(state) is not None
+    assert not state.load_failed
+    assert not state.needs_reload(state.source_signature())
+
+
+def test_mtime_change_alone_triggers_retry(state):
+    assert load(state) is None
+    stat = os.stat(source_path(state))
+    os.utime(source_path(state), ns=(stat.st_atime_ns, stat.st_mtime_ns + 5 * 10 ** 9))
+    assert state.needs_reload(state.source_signature())
+
+
+def test_rules_change_triggers_retry(state):
+    assert load(state) is None
+    with open(state.config.sources[0].rules_file, "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert state.needs_reload(state.source_signature())
+
+
+def test_missing_file_is_not_reloaded(state):
+    os.remove(source_path(state))
+    assert state.source_signature() is None
+    assert not state.needs_reload(None)
+
+
+def test_registry_resolves_or_raises_unknown_guild():
+    class Claims:
+        def get(self, name):
+            return None
+
+    one = guilds.GuildConfig(1, excel_file="roster.xlsx")
+    two = guilds.GuildConfig(2, excel_file="roster.xlsx")
+    single = guilds.GuildRegistry({1: one}, Claims())
+    assert single.resolve().guild_id == 1
+    assert single.resolve("1").guild_id == 1
+
+    registry = guilds.GuildRegistry({1: one, 2: two}, Claims())
+    assert registry.resolve(2).guild_id == 2
+    for guild_id in (None, "3", "abc"):
+        with pytest.raises(guilds.UnknownGuild):
+            registry.resolve(guild_id)
@@ -0,0 +1,34 @@
+"""Garde-fou de !reconcile apply : pas de retrait massif de rôles sur des claims perdus."""
+import types
+
+import reconcile
+
+
+def member(member_id, *roles, bot=False):
+    return types.SimpleNamespace(id=member_id, roles=list(roles), bot=bot)
+
+
+def role(name):
+    return types.SimpleNamespace(name=name)
+
+
+ACAD_B, ACAD_C = role("ACAD B"), role("ACAD C")
+
+
+def test_count_stripped_counts_members_losing_a_managed_role():
+    members = [member(1, ACAD_B), member(2, ACAD_B, ACAD_C), member(3), member(4, ACAD_B, bot=True)]
+    desired = {1: {"ACAD B"}, 2: {"ACAD B"}}
+    assert reconcile.count_stripped(members, [ACAD_B, ACAD_C], lambda m: desired.get(m.id, ())) == (1, 2)
+
+
+def test_empty_claims_index_is_refused():
+    assert "aucun claim" in reconcile.refusal_reason(0, 40, 40, 0.2)
+
+
+def test_ratio_above_limit_is_refused():
+    assert reconcile.refusal_reason(100, 30, 100, 0.2) is not None
+    assert reconcile.refusal_reason(100, 20, 100, 0.2) is None
+
+
+def test_nothing_to_strip_is_allowed():
+    assert reconcile.refusal_reason(0, 0, 0, 0.2) is None
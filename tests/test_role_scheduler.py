@@ -0,0 +1,194 @@
+"""RoleScheduler : regroupement par intention, retries des 429, débit du token bucket (horloge simulée)."""
+import asyncio
+import types
+
+import discord
+import pytest
+
+import role_scheduler
+from role_scheduler import ADD, APPLIED, REMOVE, SKIPPED, SUPERSEDED, RoleScheduler
+
+real_sleep = asyncio.sleep
+
+
+class FakeClock:
+    """Temps simulé : sleep() avance l'horloge au lieu d'attendre"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += max(0.0, seconds)
+        await real_sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    fake_asyncio = types.SimpleNamespace(**{name: getattr(asyncio, name) for name in dir(asyncio)
+                                            if not name.startswith("_")})
+    fake_asyncio.sleep = clock.sleep
+    # Remplacé dans role_scheduler seulement : la boucle garde le vrai temps
+    monkeypatch.setattr(role_scheduler, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(role_scheduler, "asyncio", fake_asyncio)
+    return clock
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "Too Many Requests" if status == 429 else "Error"
+
+
+def http_error(status, retry_after=None):
+    error = discord.HTTPException(FakeResponse(status), {"message": "erreur simulée"})
+    error.retry_after = retry_after
+    return error
+
+
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+        self.name = f"role{role_id}"
+
+
+class FakeMember:
+    """Membre dont les appels API sont horodatés ; `failures` : exceptions levées aux premiers appels"""
+
+    def __init__(self, member_id, clock, roles=(), failures=()):
+        self.id = member_id
+        self.clock = clock
+        self.roles = list(roles)
+        self.failures = list(failures)
+        self.calls = []
+
+    async def _call(self, action, role):
+        self.calls.append((action, self.clock.now))
+        if self.failures:
+            raise self.failures.pop(0)
+
+    async def add_roles(self, role, reason=None):
+        await self._call(ADD, role)
+        self.roles.append(role)
+
+    async def remove_roles(self, role, reason=None):
+        await self._call(REMOVE, role)
+        self.roles.remove(role)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_opposite_intent_supersedes_pending_operation(clock):
+    async def scenario():
+        scheduler = RoleScheduler(workers=1)
+        member, role = FakeMember(1, clock), FakeRole(5)
+        added = scheduler.submit(member, role, ADD)
+        removed = scheduler.submit(member, role, REMOVE)
+        scheduler.start()
+        results = await asyncio.gather(added, removed)
+        await scheduler.close()
+        return scheduler, member, results
+
+    scheduler, member, results = run(scenario())
+    # L'ajout n'a jamais été appliqué : son appelant ne doit pas croire le contraire
+    assert results == [SUPERSEDED, SKIPPED]
+    assert member.calls == []
+    assert scheduler.stats["superseded"] == 1
+    assert scheduler.stats["coalesced"] == 0
+
+
+def test_same_intent_is_coalesced(clock):
+    async def scenario():
+        scheduler = RoleScheduler(workers=1)
+        member, role = FakeMember(1, clock), FakeRole(5)
+        futures = [scheduler.submit(member, role, ADD) for _ in range(3)]
+        scheduler.start()
+        results = await asyncio.gather(*futures)
+        await scheduler.close()
+        return scheduler, member, results
+
+    scheduler, member, results = run(scenario())
+    assert results == [APPLIED] * 3
+    assert len(member.calls) == 1
+    assert scheduler.stats["coalesced"] == 2
+
+
+def test_rate_limit_retries_back_off(clock, monkeypatch):
+    monkeypatch.setattr(role_scheduler.random, "uniform", lambda a, b: 0.0)
+
+    async def scenario():
+        scheduler = RoleScheduler(workers=1, base_delay=1.0)
+        member = FakeMember(1, clock, failures=[http_error(429), http_error(429), http_error(503)])
+        scheduler.start()
+        result = await scheduler.submit(member, FakeRole(5), ADD)
+        await scheduler.close()
+        return scheduler, member, result
+
+    scheduler, member, result = run(scenario())
+    assert result == APPLIED
+    assert len(member.calls) == 4
+    gaps = [b[1] - a[1] for a, b in zip(member.calls, member.calls[1:])]
+    assert gaps == [1.0, 2.0, 4.0]  # base_delay * 2^tentative
+    assert scheduler.stats["rate_limited"] == 2
+    assert scheduler.stats["retries"] == 3
+
+
+def test_retry_after_is_honoured_and_pauses_bucket(clock):
+    async def scenario():
+        scheduler = RoleScheduler(workers=1, base_delay=1.0)
+        member = FakeMember(1, clock, failures=[http_error(429, retry_after=7.5)])
+        scheduler.start()
+        result = await scheduler.submit(member, FakeRole(5), ADD)
+        await scheduler.close()
+        return scheduler, member, result
+
+    scheduler, member, result = run(scenario())
+    assert result == APPLIED
+    assert member.calls[1][1] - member.calls[0][1] == 7.5
+    assert scheduler.bucket.blocked_until == member.calls[0][1] + 7.5
+
+
+def test_retries_are_bounded(clock):
+    async def scenario():
+        scheduler = RoleScheduler(workers=1, max_retries=2, base_delay=0.1)
+        member = FakeMember(1, clock, failures=[http_error(429)] * 5)
+        scheduler.start()
+        try:
+            with pytest.raises(discord.HTTPException):
+                await scheduler.submit(member, FakeRole(5), ADD)
+        finally:
+            await scheduler.close()
+        return scheduler, member
+
+    scheduler, member = run(scenario())
+    assert len(member.calls) == 3
+    assert scheduler.stats["failed"] == 1
+
+
+def test_bucket_limits_throughput(clock):
+    rate, burst, count = 5.0, 2, 12
+
+    async def scenario():
+        scheduler = RoleScheduler(rate=rate, burst=burst, workers=1)
+        members = [FakeMember(i, clock) for i in range(count)]
+        start = clock.now
+        scheduler.start()
+        results = await asyncio.gather(*(scheduler.submit(m, FakeRole(5), ADD) for m in members))
+        await scheduler.close()
+        return start, members, results
+
+    start, members, results = run(scenario())
+    assert results == [APPLIED] * count
+    times = sorted(t - start for m in members for _, t in m.calls)
+    # Rafale immédiate, puis un appel tous les 1/rate
+    assert times[:burst] == [0.0] * burst
+    for i, t in enumerate(times):
+        assert i + 1 <= burst + rate * t + 1e-6
+    assert times[-1] == pytest.approx((count - burst) / rate)
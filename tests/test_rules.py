@@ -0,0 +1,83 @@
+"""Règles compilées : équivalence avec l'ancienne validation codée en dur, prédicats."""
+import os
+
+import openpyxl
+import pytest
+
+import roster
+import rules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXCEL_FILE = os.path.join(ROOT, "CMS62026.xlsx")
+RULES_FILE = os.path.join(ROOT, "rules.json")
+
+
+def legacy_valid_matricules(path):
+    """Validation d'origine : colonnes G (matricule), I (programme), J (section) en dur"""
+    wb = openpyxl.load_workbook(path, data_only=True)
+    try:
+        valid = set()
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            raw = row[6]
+            if raw is None:
+                continue
+            if isinstance(raw, (int, float)):
+                matricule = str(int(raw))
+            else:
+                matricule = "".join(filter(str.isdigit, str(raw).strip()))
+            if not matricule:
+                continue
+            program = str(row[8]).strip().lower() if row[8] else ""
+            section = str(row[9]).strip().upper() if row[9] else ""
+            if "programmation web" in program and "introduction à l'ia" in program and section == "B":
+                valid.add(matricule)
+        return valid
+    finally:
+        wb.close()
+
+
+def test_compiled_rules_match_legacy_validation():
+    legacy = legacy_valid_matricules(EXCEL_FILE)
+    parsed = roster.parse_roster(EXCEL_FILE, rules.load_rules(RULES_FILE))
+    assert len(legacy) == 100
+    assert set(parsed.eligible) == legacy
+    assert all(roles == ("ACAD B",) for roles in parsed.eligible.values())
+
+
+def compile_one(condition, headers=("Matricule", "Programme")):
+    ruleset = rules.RuleSet({"roles": [{"role": "R", "all": [condition]}]})
+    return ruleset.compile(list(headers))
+
+
+def accepts(compiled, value):
+    roles, _, _ = compiled.evaluate(["1", value])
+    return roles == ("R",)
+
+
+@pytest.mark.parametrize("condition, value, expected", [
+    ({"column": "Programme", "contains": "introduction à l'ia", "normalize": True}, "INTRODUCTION A L'IA", True),
+    ({"column": "Programme", "equals": "b"}, " B ", True),
+    ({"column": "Programme", "equals": "b", "ignore_case": False}, "B", False),
+    ({"column": "Programme", "contains": "web", "not": True}, "Programmation Web", False),
+    ({"column": "Programme", "regex": r"^L3\s+acad"}, "l3 ACAD C", True),
+])
+def test_predicates(condition, value, expected):
+    assert accepts(compile_one(condition), value) is expected
+
+
+def test_regex_honours_normalize():
+    compiled = compile_one({"column": "Programme", "regex": r"intro\S* à l'IA$", "normalize": True})
+    assert accepts(compiled, "Introduction à l'IA")
+    assert accepts(compiled, "INTRODUCTION A L'IA")
+    assert accepts(compiled, "Introduction   à l'IA")
+    assert not accepts(compiled, "Introduction à l'IA avancée")
+
+
+def test_invalid_regex_is_rejected_at_compile():
+    with pytest.raises(rules.RulesError):
+        compile_one({"column": "Programme", "regex": "("})
+
+
+def test_unknown_column_is_rejected():
+    with pytest.raises(rules.RulesError):
+        compile_one({"column": "Absente", "equals": "x"})
@@ -0,0 +1,139 @@
+"""SqliteClaimsStore : même contrat que ClaimsStore, migration unique depuis les fichiers JSON."""
+import json
+
+import pytest
+
+import claims
+import storage
+
+
+@pytest.fixture
+def repository(tmp_path):
+    repo = storage.Repository(str(tmp_path / "disbot.db"))
+    yield repo
+    repo.close()
+
+
+@pytest.fixture
+def legacy_path(tmp_path):
+    return str(tmp_path / "claimed.json")
+
+
+def open_store(repository, legacy_path, namespace="default"):
+    store = storage.SqliteClaimsStore(repository, namespace, legacy_path)
+    store.load()
+    return store
+
+
+def event_count(repository):
+    return repository.query("SELECT COUNT(*) FROM claim_events")[0][0]
+
+
+def test_claim_and_reload(repository, legacy_path):
+    store = open_store(repository, legacy_path)
+    store.claim("1001", 1)
+    store.claim("1002", 2)
+
+    reloaded = open_store(repository, legacy_path)
+    assert reloaded.claims == {"1001": "1", "1002": "2"}
+    assert reloaded.matricules_of(2) == ["1002"]
+    assert reloaded.claimed_at("1001") is not None
+
+
+def test_release_then_reclaim(repository, legacy_path):
+    store = open_store(repository, legacy_path)
+    store.claim("1001", 1)
+    assert store.unclaim("1001") == "1"
+    assert store.unclaim("1001") is None
+    assert store.claim("1001", 2) is None
+
+    reloaded = open_store(repository, legacy_path)
+    assert reloaded.claims == {"1001": "2"}
+    assert reloaded.matricules_of(1) == []
+
+
+def test_transfer_and_history(repository, legacy_path):
+    store = open_store(repository, legacy_path)
+    store.claim("1001", 1)
+    assert store.claim("1001", 2, actor=99, reason="transfert") == "1"
+
+    reloaded = open_store(repository, legacy_path)
+    assert reloaded.claims == {"1001": "2"}
+    history = reloaded.history(matricule="1001")
+    assert [(r["op"], r["user_id"]) for r in history] == [("claim", "1"), ("claim", "2")]
+    assert history[-1]["from"] == "1" and history[-1]["by"] == "99" and history[-1]["reason"] == "transfert"
+    # L'ancien détenteur et l'auteur de l'action retrouvent l'entrée
+    assert len(reloaded.history(user_id=1)) == 2
+    assert len(reloaded.history(user_id=99)) == 1
+
+
+def test_namespaces_are_isolated(repository, legacy_path):
+    open_store(repository, legacy_path, "a").claim("1001", 1)
+    assert open_store(repository, legacy_path, "b").claims == {}
+
+
+def test_batch_keeps_every_event(repository, legacy_path):
+    store = open_store(repository, legacy_path)
+    store.write_records([
+        {"op": "claim", "matricule": "1001", "user_id": "1", "ts": 1.0},
+        {"op": "unclaim", "matricule": "1001", "user_id": "1", "ts": 2.0},
+        {"op": "claim", "matricule": "1001", "user_id": "3", "ts": 3.0},
+    ])
+    reloaded = open_store(repository, legacy_path)
+    assert reloaded.claims == {"1001": "3"}
+    assert len(reloaded.history(matricule="1001")) == 3
+
+
+def write_legacy(legacy_path):
+    legacy = claims.ClaimsStore(legacy_path)
+    legacy.claim("1001", 1)
+    legacy.claim("1002", 2)
+    legacy.unclaim("1002")
+    legacy.close()
+
+
+def test_first_load_migrates_json_once(repository, legacy_path):
+    write_legacy(legacy_path)
+    store = open_store(repository, legacy_path)
+    assert store.claims == {"1001": "1"}
+    assert event_count(repository) == 3
+
+    # Second chargement : déjà migré, rien n'est réimporté
+    open_store(repository, legacy_path)
+    assert repository.import_claims("default", claims.ClaimsStore(legacy_path)) is None
+    assert event_count(repository) == 3
+
+
+def test_forced_migration_keeps_newer_claims(repository, legacy_path):
+    write_legacy(legacy_path)
+    store = open_store(repository, legacy_path)
+    # Modifications faites dans la base après la migration
+    store.unclaim("1001")
+    store.claim("1003", 3)
+
+    legacy = claims.ClaimsStore(legacy_path)
+    legacy.load()
+    assert repository.import_claims("default", legacy, force=True) == (0, 0)
+    assert open_store(repository, legacy_path).claims == {"1003": "3"}
+
+
+def test_migrate_cli_twice(tmp_path, capsys):
+    legacy_path = str(tmp_path / "claimed.json")
+    write_legacy(legacy_path)
+    guilds_file = tmp_path / "guilds.json"
+    guilds_file.write_text(json.dumps({"guilds": {"1": {"excel_file": "absent.xlsx",
+                                                        "claims_namespace": "default"}}}), encoding="utf-8")
+    db_path = str(tmp_path / "disbot.db")
+
+    storage.migrate(db_path, str(guilds_file), legacy_path, rosters=False)
+    storage.migrate(db_path, str(guilds_file), legacy_path, rosters=False)
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "claims 'default': 1 claim(s), 3 entrée(s) d'historique"
+    assert "déjà migré" in out[1]
+
+    repository = storage.Repository(db_path)
+    try:
+        assert event_count(repository) == 3
+        assert dict(repository.load_claims("default").by_matricule) == {"1001": "1"}
+    finally:
+        repository.close()
@@ -0,0 +1,139 @@
+"""Protection de la validation contre le spam et la force brute : tout est en mémoire, sur la boucle.
+
+- SlidingWindowLimiter : au plus N tentatives par clé (membre, matricule) sur une fenêtre glissante
+- NegativeCache : entrées rejetées récemment, pour ne pas répondre deux fois à la même erreur
+- BloomFilter : pré-filtre compact des matricules éligibles ; « absent » est certain, on
+  rejette sans charger le roster ni prendre de verrou
+
+Chaque structure compte ses décisions dans `stats` (exposé par /metrics).
+"""
+import collections
+import hashlib
+import math
+import time
+
+
+class SlidingWindowLimiter:
+    """`limit` tentatives par clé sur les `window` dernières secondes (limit <= 0 : désactivé)"""
+
+    PRUNE_EVERY = 1000  # Purge des clés inactives toutes les 1000 tentatives
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.hits = {}  # clé -> deque des horodatages acceptés
+        self.stats = {"allowed": 0, "limited": 0}
+        self._calls = 0
+
+    def hit(self, key, now=None):
+        """Enregistre une tentative ; retourne 0 si acceptée, sinon les secondes avant la prochaine"""
+        if self.limit <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self._calls += 1
+        if self._calls % self.PRUNE_EVERY == 0:
+            self.prune(now)
+
+        hits = self.hits.get(key)
+        if hits is None:
+            hits = self.hits[key] = collections.deque()
+        limit = now - self.window
+        while hits and hits[0] <= limit:
+            hits.popleft()
+        if len(hits) >= self.limit:
+            # Les tentatives refusées ne prolongent pas la fenêtre
+            self.stats["limited"] += 1
+            return hits[0] + self.window - now
+        hits.append(now)
+        self.stats["allowed"] += 1
+        return 0.0
+
+    def prune(self, now=None):
+        """Oublie les clés sans tentative dans la fenêtre"""
+        limit = (time.monotonic() if now is None else now) - self.window
+        for key in [k for k, hits in self.hits.items() if not hits or hits[-1] <= limit]:
+            del self.hits[key]
+
+    def __len__(self):
+        return len(self.hits)
+
+
+class NegativeCache:
+    """Clés rejetées récemment, oubliées après `ttl` secondes (au plus `max_size`, les plus anciennes sortent)"""
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()  # clé -> expiration
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def __contains__(self, key):
+        expires = self.entries.get(key)
+        if expires is not None and expires > time.monotonic():
+            self.stats["hits"] += 1
+            return True
+        if expires is not None:
+            del self.entries[key]
+        self.stats["misses"] += 1
+        return False
+
+    def add(self, key, ttl=None):
+        if self.ttl <= 0 and ttl is None:
+            return
+        now = time.monotonic()
+        self.entries[key] = now + (self.ttl if ttl is None else ttl)
+        self.entries.move_to_end(key)
+        # Ordre d'insertion ~ ordre d'expiration : on purge par la tête
+        while self.entries:
+            oldest, expires = next(iter(self.entries.items()))
+            if expires > now and len(self.entries) <= self.max_size:
+                break
+            del self.entries[oldest]
+            if expires > now:
+                self.stats["evicted"] += 1
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class BloomFilter:
+    """Ensemble probabiliste : pas de faux négatifs, faux positifs au taux `error_rate`"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def from_keys(cls, keys, error_rate=0.01):
+        bloom = cls(len(keys), error_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, key):
+        # Double hachage (Kirsch-Mitzenmacher) : un seul digest pour les k positions
+        digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def nbytes(self):
+        return len(self.bits)